@@ -0,0 +1,193 @@
+import json
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import catalog
+
+FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar'
+}
+
+# Read and emit stored files in slices of this size
+CHUNK_SIZE = 256 * 1024
+# Files read ahead by the I/O pool while earlier ones are being sent; files
+# larger than PREFETCH_MAX_BYTES are streamed in chunks instead
+PREFETCH_FILES = 4
+PREFETCH_MAX_BYTES = 8 * 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def normalize_query(params):
+    """Validate an export request and fill in defaults"""
+    params = dict(params or {})
+    query = dict(catalog.normalize_range(params), format=params.get('format') or 'zip')
+    if query['format'] not in FORMATS:
+        raise ValueError(f"format must be one of {sorted(FORMATS)}")
+    return query
+
+
+def archive_name(path):
+    """Name inside the archive: the month directory and file name"""
+    return '/'.join(Path(path).parts[-2:])
+
+
+class _Sink:
+    """Write-only file object that collects output until it is drained.
+
+    It has no seek/tell, so zipfile writes data descriptors after each entry
+    instead of seeking back to patch headers.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return b''.join(chunks)
+
+
+def _read_small(path, size):
+    if size > PREFETCH_MAX_BYTES:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_chunks(path, size):
+    """Stream exactly size bytes of a file in CHUNK_SIZE pieces"""
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _prefetch(files):
+    """Yield (path, name, size, info, data) with small files read ahead in parallel
+
+    data is the whole file for small files, or None when the caller should
+    stream it with _read_chunks. At most PREFETCH_FILES reads are in flight.
+    """
+    pool = ThreadPoolExecutor(max_workers=PREFETCH_FILES, thread_name_prefix='export-read')
+    window = deque()
+    pending = iter(files)
+    try:
+        while True:
+            while len(window) < PREFETCH_FILES:
+                item = next(pending, None)
+                if item is None:
+                    break
+                window.append((item, pool.submit(_read_small, item[0], item[2])))
+            if not window:
+                return
+            item, future = window.popleft()
+            yield item + (future.result(),)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ExportStream:
+    """Generate a zip or tar of catalog entries without touching the disk.
+
+    Files are stored uncompressed (JPEGs do not shrink) and the archive ends
+    with a manifest.json holding the catalog metadata of everything included
+    plus any entries whose files were missing.
+    """
+    def __init__(self, entries, query):
+        self.query = query
+        self.files = []
+        self.missing = []
+        for path, info in entries:
+            try:
+                size = Path(path).stat().st_size
+            except OSError:
+                self.missing.append(path)
+                continue
+            self.files.append((path, archive_name(path), size, info))
+
+    def manifest(self):
+        return json.dumps({
+            'generated': datetime.now().isoformat(),
+            'query': self.query,
+            'count': len(self.files),
+            'total_bytes': sum(size for _, _, size, _ in self.files),
+            'files': {name: dict(info, path=path) for path, name, _, info in self.files},
+            'missing': self.missing
+        }, indent=2, default=str).encode()
+
+    def __iter__(self):
+        if self.query['format'] == 'tar':
+            return self._tar()
+        return self._zip()
+
+    def _zip(self):
+        sink = _Sink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for path, name, size, info, data in _prefetch(self.files):
+                zinfo = zipfile.ZipInfo(name, date_time=self._date_time(info, path))
+                zinfo.compress_type = zipfile.ZIP_STORED
+                zinfo.file_size = size
+                with archive.open(zinfo, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as entry:
+                    for chunk in ([data] if data is not None else _read_chunks(path, size)):
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+            archive.writestr(MANIFEST_NAME, self.manifest())
+        yield sink.drain()
+
+    def _tar(self):
+        for path, name, size, info, data in _prefetch(self.files):
+            header = tarfile.TarInfo(name)
+            header.size = size
+            header.mtime = self._mtime(info, path)
+            header.mode = 0o644
+            yield header.tobuf(format=tarfile.PAX_FORMAT)
+            written = 0
+            for chunk in ([data[:size]] if data is not None else _read_chunks(path, size)):
+                written += len(chunk)
+                yield chunk
+            # Keep the header honest if the file shrank after it was stat'ed
+            yield b'\0' * (size - written) + self._tar_padding(size)
+
+        manifest = self.manifest()
+        header = tarfile.TarInfo(MANIFEST_NAME)
+        header.size = len(manifest)
+        header.mtime = int(time.time())
+        header.mode = 0o644
+        yield header.tobuf(format=tarfile.PAX_FORMAT) + manifest + self._tar_padding(len(manifest))
+
+        # Two zero blocks mark the end of the archive
+        yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+    @staticmethod
+    def _tar_padding(size):
+        remainder = size % tarfile.BLOCKSIZE
+        return b'\0' * (tarfile.BLOCKSIZE - remainder) if remainder else b''
+
+    @staticmethod
+    def _mtime(info, path):
+        try:
+            return int(datetime.fromisoformat(info['timestamp']).timestamp())
+        except (KeyError, TypeError, ValueError):
+            return int(Path(path).stat().st_mtime)
+
+    def _date_time(self, info, path):
+        stamp = time.localtime(self._mtime(info, path))
+        # Zip timestamps cannot predate 1980
+        return stamp[:6] if stamp.tm_year >= 1980 else (1980, 1, 1, 0, 0, 0)
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from benchmarks.common import load_camera_app, quiet_logging, summarize
+
+FULL_VIEWERS = (1, 10, 100, 1000)
+QUICK_VIEWERS = (1, 10, 100)
+
+
+class SimulatedViewer:
+    """In-memory stand-in for a viewer WebSocket connection"""
+    def __init__(self, index):
+        self.remote_address = ('127.0.0.1', 20000 + index)
+        self.frames = 0
+        self.bytes = 0
+
+    async def send(self, message, text=None):
+        self.frames += 1
+        self.bytes += len(message)
+
+
+def run(quick=False):
+    """broadcast_frame fan-out cost to N simulated viewers"""
+    camera_app = load_camera_app()
+    import websocket_server
+    quiet_logging()
+
+    frame_data = camera_app.camera.get_frame_data()
+    iterations = 20 if quick else 100
+    results = []
+    for count in (QUICK_VIEWERS if quick else FULL_VIEWERS):
+        viewers = [SimulatedViewer(i) for i in range(count)]
+        websocket_server.connected_viewers.clear()
+        websocket_server.connected_viewers.update(viewers)
+
+        async def measure():
+            await websocket_server.broadcast_frame(frame_data)
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await websocket_server.broadcast_frame(frame_data)
+                samples.append(time.perf_counter() - start)
+            return samples
+
+        samples = asyncio.run(measure())
+        websocket_server.connected_viewers.clear()
+        results.append(summarize(
+            'broadcast_frame', samples, params={'viewers': count},
+            frame_bytes=len(frame_data),
+            per_viewer_seconds=(sum(samples) / len(samples)) / count
+        ))
+    return results
@@ -0,0 +1,19 @@
+from benchmarks.common import load_camera_app, isolated_storage, summarize, time_calls
+
+
+def run(quick=False):
+    """End-to-end /capture latency against MockCamera"""
+    camera_app = load_camera_app()
+    iterations = 10 if quick else 50
+    results = []
+    with isolated_storage(camera_app):
+        client = camera_app.app.test_client()
+
+        def capture():
+            response = client.get('/capture')
+            assert response.status_code == 200, response.data
+            response.close()
+
+        samples = time_calls(capture, iterations)
+        results.append(summarize('capture_e2e', samples, params={'camera': type(camera_app.camera).__name__}))
+    return results
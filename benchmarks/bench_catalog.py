@@ -0,0 +1,41 @@
+import json
+
+from benchmarks.common import load_camera_app, isolated_storage, summarize, synthetic_catalog, time_calls
+
+FULL_SIZES = (0, 10_000, 100_000)
+QUICK_SIZES = (0, 10_000)
+
+
+def _seed(camera_app, size):
+    """Write a synthetic catalog of the given size to the scratch metadata file"""
+    with open(camera_app.METADATA_FILE, 'w') as f:
+        json.dump(synthetic_catalog(size), f, indent=2)
+
+
+def run(quick=False):
+    """organize_image throughput and /images latency as the catalog grows"""
+    camera_app = load_camera_app()
+    results = []
+    for size in (QUICK_SIZES if quick else FULL_SIZES):
+        iterations = 3 if size >= 100_000 else (5 if quick else 20)
+        with isolated_storage(camera_app) as scratch:
+            _seed(camera_app, size)
+            source = scratch / 'source.jpg'
+            camera_app.camera.capture_file(str(source))
+
+            samples = time_calls(lambda: camera_app.organize_image(source), iterations)
+            results.append(summarize(
+                'organize_image', samples, params={'catalog_size': size},
+                images_per_second=len(samples) / sum(samples)
+            ))
+
+            client = camera_app.app.test_client()
+
+            def list_images():
+                response = client.get('/images')
+                assert response.status_code == 200
+                response.close()
+
+            samples = time_calls(list_images, iterations)
+            results.append(summarize('list_images', samples, params={'catalog_size': size}))
+    return results
@@ -0,0 +1,85 @@
+import base64
+import json
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from benchmarks.common import load_camera_app, summarize
+
+FULL_FRAMES = 300
+QUICK_FRAMES = 60
+
+# Per-pixel sensor noise added to every frame, in 0-255 levels
+NOISE_SIGMA = 2.0
+
+
+def _scene(base, count, moving, seed=0):
+    """Frames of the mock test pattern with a ticking clock, noise and optionally a moving animal"""
+    rng = np.random.default_rng(seed)
+    height, width = base.shape[:2]
+    for i in range(count):
+        img = Image.fromarray(base)
+        draw = ImageDraw.Draw(img)
+        draw.text((10, height - 30), f"00:00:{i:04d}", fill='white')
+        if moving:
+            x = (i * 8) % (width - 60)
+            draw.ellipse([x, height // 2 - 20, x + 60, height // 2 + 20], fill=(70, 50, 30))
+        frame = np.asarray(img, dtype=np.float32) + rng.normal(0, NOISE_SIGMA, base.shape)
+        yield np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def _psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def run(quick=False):
+    """Bytes on the device link per frame: full JPEG frames versus the tile codec"""
+    camera_app = load_camera_app()
+    from frame_codec import TileDecoder, TileEncoder, encode_jpeg, to_json
+    from network_manager import STREAM_QUALITY
+
+    base = camera_app.camera.capture_array('stream')
+    count = QUICK_FRAMES if quick else FULL_FRAMES
+    results = []
+    for scene in ('static', 'moving'):
+        frames = list(_scene(base, count, moving=scene == 'moving'))
+
+        jpeg_bytes = 0
+        jpeg_samples = []
+        for frame in frames:
+            start = time.perf_counter()
+            message = json.dumps({'type': 'camera_frame', 'device_id': 'bench',
+                                  'frame_data': base64.b64encode(encode_jpeg(frame, STREAM_QUALITY)).decode('utf-8')})
+            jpeg_samples.append(time.perf_counter() - start)
+            jpeg_bytes += len(message)
+
+        encoder = TileEncoder(quality=STREAM_QUALITY)
+        decoder = TileDecoder()
+        tile_bytes = 0
+        tile_samples = []
+        quality = []
+        for frame in frames:
+            start = time.perf_counter()
+            encoded = encoder.encode(frame)
+            message = json.dumps({'type': 'camera_tiles', 'device_id': 'bench', 'frame': to_json(encoded)}) if encoded else ''
+            tile_samples.append(time.perf_counter() - start)
+            tile_bytes += len(message)
+            if encoded:
+                decoder.apply(encoded)
+            quality.append(_psnr(decoder.frame, frame))
+
+        params = {'scene': scene, 'frames': count, 'size': f"{base.shape[1]}x{base.shape[0]}"}
+        results.append(summarize('jpeg_frames', jpeg_samples, params=params,
+                                 bytes_per_frame=jpeg_bytes / count))
+        results.append(summarize(
+            'tile_codec', tile_samples, params=params,
+            bytes_per_frame=tile_bytes / count,
+            savings=1.0 - tile_bytes / jpeg_bytes,
+            keyframes=encoder.stats['keyframes'],
+            deltas=encoder.stats['deltas'],
+            unchanged=encoder.stats['skipped'],
+            min_psnr_db=min(quality)
+        ))
+    return results
@@ -0,0 +1,145 @@
+import asyncio
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import load_camera_app, quiet_logging, summarize
+
+FULL_VIEWERS = (1, 10, 50)
+QUICK_VIEWERS = (1, 10)
+# Frames broadcast before measuring, so connection buffers reach steady state
+WARMUP_FRAMES = 5
+# Pause between broadcast frames; the live stream runs at a few per second
+FRAME_INTERVAL = 0.02
+NOISE_SIGMA = 2.0
+
+# Real viewer connections, in a child process so their memory is not traced
+VIEWER_SCRIPT = '''
+import asyncio, sys, websockets
+
+async def viewer(url):
+    async with websockets.connect(url, max_size=None) as websocket:
+        async for _ in websocket:
+            pass
+
+async def main(url, count):
+    await asyncio.gather(*(viewer(url) for _ in range(count)))
+
+asyncio.run(main(sys.argv[1], int(sys.argv[2])))
+'''
+
+
+def _traced_peak(func):
+    """Peak bytes allocated while func runs, above what was live before"""
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    return tracemalloc.get_traced_memory()[1] - before
+
+
+def _frame_results(camera_app, iterations):
+    """Transient allocation per uplink frame: bytes copies versus a pooled buffer"""
+    from buffers import BufferPool, MemoryBudget
+    from frame_codec import encode_jpeg
+    from network_manager import STREAM_QUALITY
+    from protocol import frame_header, pack_frame
+
+    base = camera_app.camera.capture_array('stream').astype(np.float32)
+    rng = np.random.default_rng(0)
+    frame = np.clip(base + rng.normal(0, NOISE_SIGMA, base.shape), 0, 255).astype(np.uint8)
+    header = {'type': 'camera_frame', 'device_id': 'b827eb12ab34'}
+    pool = BufferPool(count=1, budget=MemoryBudget())
+
+    def copied():
+        jpeg = encode_jpeg(frame, STREAM_QUALITY)
+        return len(pack_frame(header, [jpeg]))
+
+    def pooled():
+        with pool.acquire() as buffer:
+            encode_jpeg(frame, STREAM_QUALITY, buffer)
+            buffer.prepend(frame_header(header, [len(buffer)]))
+            return len(buffer.view())
+
+    results = []
+    # The first pooled frame may grow its buffer; measure from the second
+    size = pooled()
+    for name, send in (('bytes', copied), ('pooled', pooled)):
+        samples = []
+        peaks = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            peaks.append(_traced_peak(send))
+            samples.append(time.perf_counter() - start)
+        results.append(summarize(
+            'uplink_frame_memory', samples,
+            params={'buffer': name, 'size': f"{frame.shape[1]}x{frame.shape[0]}"},
+            frame_bytes=size,
+            peak_allocated_bytes=int(np.median(peaks))
+        ))
+    return results
+
+
+async def _viewer_round(websocket_server, frame_data, count, frames):
+    import websockets
+
+    server = await websockets.serve(websocket_server.handle_viewer_connection, '127.0.0.1', 0, max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    baseline = tracemalloc.get_traced_memory()[0]
+    viewers = subprocess.Popen([sys.executable, '-c', VIEWER_SCRIPT, f"ws://127.0.0.1:{port}", str(count)])
+    try:
+        while len(websocket_server.connected_viewers) < count:
+            await asyncio.sleep(0.01)
+        for _ in range(WARMUP_FRAMES):
+            await websocket_server.broadcast_frame(frame_data)
+            await asyncio.sleep(FRAME_INTERVAL)
+        samples = []
+        peaks = []
+        steady = []
+        for _ in range(frames):
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            await websocket_server.broadcast_frame(frame_data)
+            samples.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            await asyncio.sleep(FRAME_INTERVAL)
+            steady.append(tracemalloc.get_traced_memory()[0] - baseline)
+        return samples, int(np.median(steady)), int(np.median(peaks))
+    finally:
+        viewers.kill()
+        viewers.wait()
+        server.close()
+        await server.wait_closed()
+        websocket_server.connected_viewers.clear()
+
+
+def _viewer_results(camera_app, quick):
+    """Relay memory held per connected viewer while broadcasting live frames"""
+    import websocket_server
+
+    frame_data = camera_app.camera.get_frame_data()
+    results = []
+    for count in (QUICK_VIEWERS if quick else FULL_VIEWERS):
+        samples, steady, peak = asyncio.run(_viewer_round(websocket_server, frame_data, count, 20 if quick else 50))
+        results.append(summarize(
+            'viewer_memory', samples, params={'viewers': count},
+            frame_bytes=len(frame_data),
+            steady_bytes=steady,
+            steady_bytes_per_viewer=steady // count,
+            peak_bytes=peak,
+            peak_bytes_per_viewer=peak // count
+        ))
+    return results
+
+
+def run(quick=False):
+    """tracemalloc report: per-frame uplink allocations and relay memory per viewer"""
+    quiet_logging()
+    camera_app = load_camera_app()
+    tracemalloc.start()
+    try:
+        return _frame_results(camera_app, 10 if quick else 50) + _viewer_results(camera_app, quick)
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import load_camera_app, isolated_storage, summarize, time_calls
+
+ROTATIONS = (90, 180, 270)
+
+
+def run(quick=False):
+    """Per-frame rotation, enhancement, fusion, night stacking and detection cost"""
+    camera_app = load_camera_app()
+    camera = camera_app.camera
+    iterations = 10 if quick else 50
+    width, height = camera_app.CAMERA_SETTINGS['resolution']
+    frame = Image.new('RGB', (width, height), color='green')
+    results = []
+
+    for degrees in ROTATIONS:
+        samples = time_calls(lambda: frame.rotate(degrees, expand=True), iterations)
+        results.append(summarize('rotate', samples, params={'degrees': degrees, 'size': f"{width}x{height}"}))
+
+    # Mirrors the per-pixel lambdas MockCamera.capture_file applies
+    brightness = 1.2
+    contrast = 1.2
+    samples = time_calls(
+        lambda: Image.eval(frame, lambda x: min(255, max(0, int(x * brightness)))), iterations)
+    results.append(summarize('enhance_brightness', samples, params={'size': f"{width}x{height}"}))
+    samples = time_calls(
+        lambda: Image.eval(frame, lambda x: min(255, max(0, int(128 + (x - 128) * contrast)))), iterations)
+    results.append(summarize('enhance_contrast', samples, params={'size': f"{width}x{height}"}))
+
+    from image_processing import exposure_fusion
+    base = np.asarray(frame, dtype=np.float32)
+    bracket = [np.clip(base * (2.0 ** ev), 0, 255).astype(np.uint8) for ev in (-2, 0, 2)]
+    samples = time_calls(lambda: exposure_fusion(bracket), max(3, iterations // 5))
+    results.append(summarize('exposure_fusion', samples, params={'frames': len(bracket), 'size': f"{width}x{height}"}))
+
+    # Night stacking must fit a per-frame CPU budget between scheduled captures
+    from image_processing import stack_frames
+    from night_mode import STACK_CPU_BUDGET_PER_FRAME, STACK_FRAMES
+    rng = np.random.default_rng(0)
+    night = [np.clip(base * 0.2 + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8) for _ in range(STACK_FRAMES)]
+    stack_iterations = max(3, iterations // 5)
+    for method in ('mean', 'median'):
+        cpu_start = time.process_time()
+        samples = time_calls(lambda: stack_frames(night, method), stack_iterations)
+        # time_calls makes one warmup call on top of the timed ones
+        cpu_per_frame = (time.process_time() - cpu_start) / ((stack_iterations + 1) * STACK_FRAMES)
+        results.append(summarize(
+            'stack_frames', samples,
+            params={'method': method, 'frames': STACK_FRAMES, 'size': f"{width}x{height}"},
+            cpu_per_frame=cpu_per_frame,
+            cpu_budget_per_frame=STACK_CPU_BUDGET_PER_FRAME,
+            within_budget=cpu_per_frame <= STACK_CPU_BUDGET_PER_FRAME
+        ))
+
+    # Batching amortizes per-invocation overhead of the detection backend
+    from detection import BATCH_SIZE, StubBackend
+    detector = camera_app.detector.backend if camera_app.detector else StubBackend()
+    lores = np.asarray(frame.resize(detector.input_size), dtype=np.uint8)
+    for batch_size in sorted({1, BATCH_SIZE, 2 * BATCH_SIZE}):
+        batch = np.stack([lores] * batch_size)
+        samples = time_calls(lambda: detector.infer(batch), iterations)
+        results.append(summarize(
+            'detection_batch', samples,
+            params={'backend': detector.name, 'batch_size': batch_size},
+            per_frame_ms=sum(samples) / len(samples) / batch_size * 1000
+        ))
+
+    # Rotation changes go to a scratch settings store, not storage/settings.json
+    with isolated_storage(camera_app):
+        for degrees in (0,) + ROTATIONS:
+            camera.update_settings({'rotation': degrees})
+            samples = time_calls(camera.get_frame_data, iterations)
+            results.append(summarize('get_frame_data', samples, params={'rotation': degrees}))
+    return results
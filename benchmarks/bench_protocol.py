@@ -0,0 +1,131 @@
+import base64
+import json
+import time
+import zlib
+
+import numpy as np
+
+from benchmarks.common import load_camera_app, quiet_logging, summarize
+
+DEVICE_ID = 'b827eb12ab34'
+# Viewer joins per hour, each sending one keyframe request to the device
+KEYFRAME_REQUESTS_PER_HOUR = 12
+# Per-pixel sensor noise so the test pattern compresses like a real scene
+NOISE_SIGMA = 2.0
+
+
+def _ws_overhead(length, masked):
+    """WebSocket frame header bytes; device-to-relay frames are masked"""
+    header = 2 if length < 126 else (4 if length < 65536 else 10)
+    return header + (4 if masked else 0)
+
+
+class _PerMessageDeflate:
+    """The websockets library's default permessage-deflate, as v1 connections negotiate it"""
+    def __init__(self):
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -12, 5)
+
+    def __call__(self, data):
+        return (self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def _hour_of_control_traffic(heartbeat_seconds):
+    """(message, sent_by_device) pairs for one connected device-hour"""
+    messages = [({'type': 'device_info', 'device_id': DEVICE_ID, 'connection_type': 'cellular'}, True)]
+    heartbeat = {'type': 'heartbeat', 'device_id': DEVICE_ID, 'connection_type': 'cellular'}
+    messages += [(heartbeat, True)] * int(3600 / heartbeat_seconds)
+    messages += [({'type': 'keyframe_request'}, False)] * KEYFRAME_REQUESTS_PER_HOUR
+    return messages
+
+
+def _control_results(heartbeat_seconds):
+    from protocol import ENCODINGS, ControlCodec, hello, negotiate
+
+    traffic = _hour_of_control_traffic(heartbeat_seconds)
+    formats = [('v1 json', None, None), ('v1 json+permessage-deflate', None, None)] + [
+        ('v2', encoding, compression) for encoding in ENCODINGS for compression in (None, 'zlib')
+    ]
+    results = []
+    baseline = None
+    for name, encoding, compression in formats:
+        total = 0
+        samples = []
+        device = relay = None
+        deflate = {True: _PerMessageDeflate(), False: _PerMessageDeflate()} if 'deflate' in name else None
+        if name == 'v2':
+            offer = hello(DEVICE_ID)
+            welcome = negotiate(dict(offer, encodings=[encoding], compression=[compression] if compression else []))
+            for message, masked in ((offer, True), (welcome, False)):
+                data = json.dumps(message)
+                total += len(data) + _ws_overhead(len(data), masked)
+            device = ControlCodec.from_welcome(welcome)
+            relay = ControlCodec.from_welcome(welcome)
+            name = f"v2 {device.name}"
+
+        for message, from_device in traffic:
+            start = time.perf_counter()
+            if device is None:
+                data = json.dumps(message).encode('utf-8')
+                if deflate:
+                    data = deflate[from_device](data)
+            else:
+                sender, receiver = (device, relay) if from_device else (relay, device)
+                data = sender.encode(message)
+                receiver.decode(data)
+            samples.append(time.perf_counter() - start)
+            total += len(data) + _ws_overhead(len(data), from_device)
+
+        baseline = baseline or total
+        results.append(summarize(
+            'control_channel', samples,
+            params={'format': name, 'heartbeat_seconds': heartbeat_seconds},
+            bytes_per_device_hour=total,
+            savings=1.0 - total / baseline
+        ))
+    return results
+
+
+def _frame_results(camera_app, iterations):
+    """Bytes and sender CPU per live frame: base64 JSON (with or without deflate) versus raw binary"""
+    from frame_codec import encode_jpeg
+    from network_manager import STREAM_QUALITY
+    from protocol import pack_frame
+
+    base = camera_app.camera.capture_array('stream').astype(np.float32)
+    rng = np.random.default_rng(0)
+    frame = np.clip(base + rng.normal(0, NOISE_SIGMA, base.shape), 0, 255).astype(np.uint8)
+    jpeg = encode_jpeg(frame, STREAM_QUALITY)
+    header = {'type': 'camera_frame', 'device_id': DEVICE_ID}
+
+    def v1_json():
+        return json.dumps(dict(header, frame_data=base64.b64encode(jpeg).decode('utf-8'))).encode('utf-8')
+
+    deflate = _PerMessageDeflate()
+    transports = {
+        'v1 json': v1_json,
+        'v1 json+permessage-deflate': lambda: deflate(v1_json()),
+        'v2 binary': lambda: pack_frame(header, [jpeg])
+    }
+    results = []
+    for name, send in transports.items():
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            data = send()
+            samples.append(time.perf_counter() - start)
+        results.append(summarize(
+            'frame_transport', samples,
+            params={'format': name, 'size': f"{frame.shape[1]}x{frame.shape[0]}"},
+            jpeg_bytes=len(jpeg),
+            bytes_per_frame=len(data) + _ws_overhead(len(data), True)
+        ))
+    return results
+
+
+def run(quick=False):
+    """Device link bytes per device-hour for control traffic, and per live frame"""
+    quiet_logging()
+    camera_app = load_camera_app()
+    from network_manager import HEARTBEAT_SECONDS
+
+    return _control_results(HEARTBEAT_SECONDS) + _frame_results(camera_app, 20 if quick else 100)
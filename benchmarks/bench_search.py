@@ -0,0 +1,51 @@
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import load_camera_app, isolated_storage, summarize, synthetic_catalog, time_calls
+
+# As many captures as a year at one every 10 minutes
+FULL_SIZE = 52_560
+QUICK_SIZE = 10_000
+
+
+def _seed_index(index, size):
+    """Fill a search index with synthetic features, skipping JPEG decoding"""
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    thumb = bytes(32 * 24)
+    for path, entry in synthetic_catalog(size).items():
+        hour = datetime.fromisoformat(entry['timestamp']).hour
+        brightness = rng.uniform(5, 45) if hour < 6 or hour >= 20 else rng.uniform(60, 200)
+        index.add(path, entry, {
+            'width': 640, 'height': 480, 'brightness': brightness,
+            'is_night': brightness < 50, 'phash': rng.getrandbits(64), 'thumb': thumb
+        })
+    return start
+
+
+def run(quick=False):
+    """/images/search latency over a year-sized feature index"""
+    camera_app = load_camera_app()
+    size = QUICK_SIZE if quick else FULL_SIZE
+    iterations = 5 if quick else 20
+    results = []
+    with isolated_storage(camera_app):
+        start = _seed_index(camera_app.image_index, size)
+        reference = camera_app.image_index.search(limit=1)[0]['path']
+        day = (start + timedelta(days=3)).isoformat()
+        queries = {
+            'time_range_day': f"start={day}&end={(start + timedelta(days=4)).isoformat()}",
+            'night_manual': "night=1&type=manual&max_brightness=30",
+            'bright_scheduled': "type=scheduled&min_brightness=150&limit=1000",
+            'similar_to': f"similar_to={reference}&max_distance=12",
+        }
+        client = camera_app.app.test_client()
+        for name, query in queries.items():
+            def search():
+                response = client.get(f"/images/search?{query}")
+                assert response.status_code == 200
+                response.close()
+
+            samples = time_calls(search, iterations)
+            results.append(summarize('search_images', samples, params={'index_size': size, 'query': name}))
+    return results
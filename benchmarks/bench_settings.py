@@ -0,0 +1,34 @@
+from benchmarks.common import load_camera_app, isolated_storage, summarize, time_calls
+
+
+def run(quick=False):
+    """/status polling cost, lock-free settings reads and durable settings updates"""
+    camera_app = load_camera_app()
+    iterations = 200 if quick else 2000
+    results = []
+    with isolated_storage(camera_app):
+        client = camera_app.app.test_client()
+        store = camera_app.settings_store
+
+        def poll(headers=None, expected=200):
+            response = client.get('/status', headers=headers)
+            assert response.status_code == expected, response.status_code
+            response.close()
+            return response
+
+        etag = poll().headers['ETag']
+        results.append(summarize('status_poll', time_calls(poll, iterations), params={'conditional': False}))
+        results.append(summarize(
+            'status_poll', time_calls(lambda: poll({'If-None-Match': etag}, 304), iterations),
+            params={'conditional': True}
+        ))
+
+        samples = time_calls(lambda: store.snapshot()['camera']['rotation'], iterations)
+        results.append(summarize('settings_read', samples))
+
+        # Each update is journaled and fsynced before it is published
+        values = iter(range(1, iterations + 1))
+        samples = time_calls(lambda: camera_app.camera.update_settings({'brightness': next(values) % 100}),
+                             iterations // 10)
+        results.append(summarize('settings_update', samples, version=store.snapshot().version))
+    return results
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import random
+import time
+
+from benchmarks.common import summarize
+
+MONTHS = 12
+FULL_ITEMS = 100000
+QUICK_ITEMS = 10000
+DIFFERENCES = (0, 1, 10, 100, 1000)
+
+
+class _LoopbackPeer:
+    """Answers reconcile() in process and counts the JSON it would have sent"""
+    def __init__(self, manifest):
+        self.manifest_ = manifest
+        self.bytes_received = 0
+
+    def _reply(self, data):
+        self.bytes_received += len(json.dumps({'status': 'ok', 'data': data}))
+        return data
+
+    def manifest(self):
+        return self._reply({'months': self.manifest_.months()})['months']
+
+    def ranges(self, ranges):
+        return self._reply([self.manifest_.answer(month, prefix) for month, prefix in ranges])
+
+
+def _catalog(count, seed=0):
+    """{key: sha256} spread over MONTHS month directories"""
+    rng = random.Random(seed)
+    items = {}
+    for i in range(count):
+        key = f"2025_{i % MONTHS + 1:02d}/scheduled_{i:08d}.jpg"
+        items[key] = hashlib.sha256(rng.randbytes(16)).hexdigest()
+    return items
+
+
+def run(quick=False):
+    """Bytes and round trips to find what one node lacks, versus sending the full listing"""
+    from replication import Manifest, reconcile
+
+    count = QUICK_ITEMS if quick else FULL_ITEMS
+    remote_items = _catalog(count)
+    remote = Manifest(remote_items)
+    full_listing = len(json.dumps({'status': 'ok', 'data': remote_items}))
+    keys = sorted(remote_items)
+    results = []
+    for differences in DIFFERENCES:
+        lacking = set(random.Random(differences).sample(keys, differences))
+        local = Manifest({key: sha256 for key, sha256 in remote_items.items() if key not in lacking})
+        samples = []
+        for _ in range(3 if quick else 5):
+            peer = _LoopbackPeer(remote)
+            start = time.perf_counter()
+            diff = reconcile(local, peer)
+            samples.append(time.perf_counter() - start)
+        assert set(diff['missing']) == lacking
+        results.append(summarize(
+            'sync_reconcile', samples,
+            params={'items': count, 'missing': differences},
+            rounds=diff['rounds'],
+            summary_bytes=peer.bytes_received,
+            full_listing_bytes=full_listing,
+            savings=1.0 - peer.bytes_received / full_listing
+        ))
+    return results
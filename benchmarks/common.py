@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+def quiet_logging():
+    """Keep application logging from skewing timings"""
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ('camera_app', 'websocket_server', 'network_manager', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def load_camera_app():
+    """Import camera_app (which initializes MockCamera off the Pi)"""
+    quiet_logging()
+    import camera_app
+    quiet_logging()
+    return camera_app
+
+
+@contextmanager
+def isolated_storage(camera_app):
+    """Point camera_app's storage tree at a scratch directory
+
+    Rate limits are off and admission control starts fresh, so benchmarks
+    measure the work itself rather than the limiter refusing a fast loop.
+    """
+    scratch = Path(tempfile.mkdtemp(prefix='ranchpi_bench_'))
+    saved = {
+        name: getattr(camera_app, name)
+        for name in ('STORAGE_ROOT', 'IMAGES_ROOT', 'METADATA_FILE', 'UPLOAD_FOLDER', 'image_index',
+                     'settings_store', 'rate_limiter', 'admission')
+    }
+    try:
+        camera_app.STORAGE_ROOT = scratch / 'storage'
+        camera_app.IMAGES_ROOT = camera_app.STORAGE_ROOT / 'images'
+        camera_app.METADATA_FILE = camera_app.STORAGE_ROOT / 'image_metadata.json'
+        camera_app.UPLOAD_FOLDER = scratch / 'upload'
+        camera_app.IMAGES_ROOT.mkdir(parents=True)
+        camera_app.UPLOAD_FOLDER.mkdir(parents=True)
+        camera_app.image_index = camera_app.ImageIndex(camera_app.STORAGE_ROOT / 'image_index.db')
+        camera_app.settings_store = camera_app.create_settings_store(camera_app.STORAGE_ROOT / 'settings.json')
+        camera_app.rate_limiter = camera_app.RateLimiter(camera_app.ROUTE_RATE_LIMITS, camera_app.DEFAULT_RATE_LIMIT,
+                                                         enabled=False)
+        camera_app.admission = camera_app.AdmissionController(camera_app.ADMISSION_CLASSES)
+        yield scratch
+    finally:
+        for name, value in saved.items():
+            setattr(camera_app, name, value)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def synthetic_catalog(count, start=datetime(2025, 1, 1)):
+    """Build a metadata dict shaped like storage/image_metadata.json"""
+    metadata = {}
+    base = start.timestamp()
+    for i in range(count):
+        ts = datetime.fromtimestamp(base + i * 60)
+        path = f"storage/images/{ts.strftime('%Y_%m')}/capture_{ts.strftime('%Y%m%d_%H%M%S')}.jpg"
+        metadata[path] = {
+            'timestamp': ts.isoformat(),
+            'type': 'scheduled' if i % 4 else 'manual',
+            'size': 9000 + (i % 1000)
+        }
+    return metadata
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * (len(sorted_samples) - 1)))))
+    return sorted_samples[index]
+
+
+def summarize(name, samples, unit='s', params=None, **extra):
+    """Reduce raw samples to a machine-readable result record"""
+    ordered = sorted(samples)
+    result = {
+        'name': name,
+        'params': params or {},
+        'unit': unit,
+        'samples': len(ordered),
+        'mean': statistics.fmean(ordered) if ordered else 0.0,
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'min': ordered[0] if ordered else 0.0,
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1] if ordered else 0.0,
+    }
+    result.update(extra)
+    return result
+
+
+def time_calls(func, iterations, warmup=1):
+    """Call func repeatedly and return per-call durations in seconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def result_key(result):
+    """Identify a result across runs by name and parameters"""
+    params = ','.join(f"{k}={v}" for k, v in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]"
+
+
+def environment():
+    """Describe the machine and revision a run was taken on"""
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'revision': revision,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_report(results, output=None):
+    """Write results as JSON to a file, or stdout when no file is given"""
+    report = {'environment': environment(), 'results': results}
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text)
+    else:
+        print(text)
+    return report
+
+
+def compare_reports(baseline_path, results, threshold=0.10):
+    """Print mean deltas against a previous report; return regressed keys"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {result_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    print(f"{'benchmark':60} {'before':>12} {'after':>12} {'change':>8}", file=sys.stderr)
+    for result in results:
+        key = result_key(result)
+        before = previous.get(key)
+        if not before or not before['mean']:
+            continue
+        change = (result['mean'] - before['mean']) / before['mean']
+        # Throughput-style results regress when they go down
+        if result.get('higher_is_better'):
+            change = -change
+        flag = ' !' if change > threshold else ''
+        print(f"{key:60} {before['mean']:12.6f} {result['mean']:12.6f} {change:+8.1%}{flag}", file=sys.stderr)
+        if change > threshold:
+            regressions.append(key)
+    return regressions
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for the WebSocket relay in websocket_server.py.
+
+Simulates NetworkManager-style devices (device_info, heartbeat, camera_frame)
+and browser-style viewers, optionally with a share of slow consumers, and
+reports relay throughput, end-to-end frame latency percentiles and relay
+memory per connection.
+
+Usage:
+  python3 -m benchmarks.loadgen --devices 50 --viewers 200 --fps 2 --duration 30
+  python3 -m benchmarks.loadgen --devices 2000 --viewers 0 --workers 4 --frame-size 0
+  python3 -m benchmarks.loadgen --relay ws://relay-host:6789 --viewer-url ws://relay-host:6790
+
+Without --relay a relay is spawned locally in a subprocess so its memory can
+be sampled from /proc.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import websockets
+
+from benchmarks.common import REPO_ROOT, percentile, write_report
+
+# Keep at most this many latency samples per worker and profile
+LATENCY_RESERVOIR = 50_000
+
+
+def raise_fd_limit():
+    """Lift the soft open-files limit so thousands of sockets can be opened"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class WorkerStats:
+    """Counters collected by one load-generation worker"""
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.heartbeats_sent = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.received = {'normal': 0, 'slow': 0}
+        self.received_bytes = {'normal': 0, 'slow': 0}
+        self.latencies = {'normal': [], 'slow': []}
+        self._seen = {'normal': 0, 'slow': 0}
+
+    def record_latency(self, profile, value):
+        # Reservoir sampling keeps memory flat on long runs
+        self._seen[profile] += 1
+        samples = self.latencies[profile]
+        if len(samples) < LATENCY_RESERVOIR:
+            samples.append(value)
+        else:
+            slot = random.randrange(self._seen[profile])
+            if slot < LATENCY_RESERVOIR:
+                samples[slot] = value
+
+    def as_dict(self):
+        return {
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'heartbeats_sent': self.heartbeats_sent,
+            'connect_failures': self.connect_failures,
+            'disconnects': self.disconnects,
+            'received': self.received,
+            'received_bytes': self.received_bytes,
+            'latencies': self.latencies
+        }
+
+
+async def simulated_device(index, args, stats, stop):
+    """Behave like NetworkManager: announce, heartbeat and push frames"""
+    device_id = f"loadgen-{os.getpid()}-{index}"
+    payload = base64.b64encode(os.urandom(args.frame_size)).decode('ascii') if args.frame_size else ''
+    try:
+        async with websockets.connect(args.relay, max_size=None) as websocket:
+            await websocket.send(json.dumps({
+                'type': 'device_info',
+                'device_id': device_id,
+                'connection_type': args.connection_type
+            }))
+            frame_interval = 1.0 / args.fps if args.fps > 0 and payload else None
+            next_frame = time.monotonic() + random.random() * (frame_interval or 1.0)
+            next_heartbeat = time.monotonic() + random.random() * args.heartbeat
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    await websocket.send(json.dumps({
+                        'type': 'heartbeat',
+                        'device_id': device_id,
+                        'connection_type': args.connection_type
+                    }))
+                    stats.heartbeats_sent += 1
+                    next_heartbeat += args.heartbeat
+                if frame_interval and now >= next_frame:
+                    # Send time rides in front of the payload so viewers can measure latency
+                    message = json.dumps({
+                        'type': 'camera_frame',
+                        'frame_data': f"{time.time():.6f}|{payload}"
+                    })
+                    await websocket.send(message)
+                    stats.frames_sent += 1
+                    stats.bytes_sent += len(message)
+                    next_frame += frame_interval
+                wake = min(next_heartbeat, next_frame if frame_interval else next_heartbeat)
+                try:
+                    await asyncio.wait_for(stop.wait(), max(0.0, wake - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+    except (OSError, websockets.exceptions.InvalidHandshake):
+        stats.connect_failures += 1
+    except websockets.exceptions.ConnectionClosed:
+        stats.disconnects += 1
+
+
+async def simulated_viewer(index, slow, args, stats, stop):
+    """Behave like live.html, optionally as a slow consumer"""
+    profile = 'slow' if slow else 'normal'
+    try:
+        async with websockets.connect(args.viewer_url, max_size=None) as websocket:
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(websocket.recv(), 1.0)
+                except asyncio.TimeoutError:
+                    continue
+                received_at = time.time()
+                stats.received[profile] += 1
+                stats.received_bytes[profile] += len(message)
+                data = json.loads(message)
+                sent_at, _, _ = (data.get('data') or '').partition('|')
+                try:
+                    stats.record_latency(profile, received_at - float(sent_at))
+                except ValueError:
+                    pass
+                if slow:
+                    await asyncio.sleep(args.slow_delay)
+    except (OSError, websockets.exceptions.InvalidHandshake):
+        stats.connect_failures += 1
+    except websockets.exceptions.ConnectionClosed:
+        stats.disconnects += 1
+
+
+async def run_clients(args, devices, viewers, slow_viewers):
+    stats = WorkerStats()
+    stop = asyncio.Event()
+    tasks = []
+    for i in range(viewers):
+        tasks.append(asyncio.create_task(simulated_viewer(i, i < slow_viewers, args, stats, stop)))
+        if args.connect_rate:
+            await asyncio.sleep(1.0 / args.connect_rate)
+    await asyncio.sleep(args.settle)
+    for i in range(devices):
+        tasks.append(asyncio.create_task(simulated_device(i, args, stats, stop)))
+        if args.connect_rate:
+            await asyncio.sleep(1.0 / args.connect_rate)
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.as_dict()
+
+
+def worker(args, devices, viewers, slow_viewers):
+    """Entry point for one load-generation process"""
+    raise_fd_limit()
+    random.seed(os.getpid())
+    return asyncio.run(run_clients(args, devices, viewers, slow_viewers))
+
+
+def split(total, parts):
+    """Divide total into parts as evenly as possible"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def spawn_relay(host, port):
+    """Start websocket_server in a subprocess and wait until it accepts connections"""
+    code = (
+        "import asyncio, logging, websocket_server;"
+        "logging.getLogger('websocket_server').setLevel(logging.WARNING);"
+        "logging.getLogger('websockets').setLevel(logging.WARNING);"
+        f"asyncio.run(websocket_server.start_server({host!r}, {port}))"
+    )
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=REPO_ROOT, preexec_fn=raise_fd_limit)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            asyncio.run(_probe(f"ws://{host}:{port + 1}"))
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Relay did not start listening within 10 seconds")
+
+
+async def _probe(url):
+    async with websockets.connect(url):
+        pass
+
+
+def rss_kb(pid):
+    """Resident set size of a process in KiB, read from /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """Track the peak RSS of the relay process while load runs"""
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_kb(pid) or 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_kb(self.pid) or 0)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        'samples': len(ordered),
+        'p50': percentile(ordered, 0.50),
+        'p90': percentile(ordered, 0.90),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1] if ordered else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10, help="Simulated camera devices")
+    parser.add_argument('--viewers', type=int, default=10, help="Simulated viewers")
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help="Share of viewers that consume slowly")
+    parser.add_argument('--slow-delay', type=float, default=0.5, help="Seconds a slow viewer stalls after each frame")
+    parser.add_argument('--fps', type=float, default=2.0, help="Frames per second per device")
+    parser.add_argument('--frame-size', type=int, default=20_000, help="Raw JPEG-sized payload bytes per frame (0 disables frames)")
+    parser.add_argument('--heartbeat', type=float, default=5.0, help="Seconds between device heartbeats")
+    parser.add_argument('--connection-type', default='ethernet', help="connection_type reported by devices")
+    parser.add_argument('--duration', type=float, default=15.0, help="Seconds of steady-state load")
+    parser.add_argument('--settle', type=float, default=1.0, help="Seconds between connecting viewers and devices")
+    parser.add_argument('--connect-rate', type=float, default=500.0, help="New connections per second per worker (0 = unthrottled)")
+    parser.add_argument('--workers', type=int, default=1, help="Load-generation processes")
+    parser.add_argument('--relay', help="Device endpoint of an existing relay, e.g. ws://host:6789")
+    parser.add_argument('--viewer-url', help="Viewer endpoint of an existing relay (default: device port + 1)")
+    parser.add_argument('--port', type=int, default=16789, help="Device port for a locally spawned relay")
+    parser.add_argument('-o', '--output', help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    relay_process = None
+    if not args.relay:
+        relay_process = spawn_relay('127.0.0.1', args.port)
+        args.relay = f"ws://127.0.0.1:{args.port}"
+        args.viewer_url = f"ws://127.0.0.1:{args.port + 1}"
+    elif not args.viewer_url:
+        host, _, port = args.relay.rpartition(':')
+        args.viewer_url = f"{host}:{int(port) + 1}"
+
+    sampler = None
+    baseline_kb = None
+    if relay_process:
+        baseline_kb = rss_kb(relay_process.pid)
+        sampler = MemorySampler(relay_process.pid)
+        sampler.start()
+
+    slow_total = int(round(args.viewers * args.slow_fraction))
+    try:
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(worker, args, devices, viewers, slow)
+                for devices, viewers, slow in zip(
+                    split(args.devices, args.workers),
+                    split(args.viewers, args.workers),
+                    split(slow_total, args.workers))
+            ]
+            parts = [future.result() for future in futures]
+        elapsed = time.monotonic() - start
+    finally:
+        if sampler:
+            sampler.stop()
+        if relay_process:
+            relay_process.terminate()
+            relay_process.wait()
+
+    totals = {'normal': 0, 'slow': 0}
+    total_bytes = {'normal': 0, 'slow': 0}
+    latencies = {'normal': [], 'slow': []}
+    for part in parts:
+        for profile in totals:
+            totals[profile] += part['received'][profile]
+            total_bytes[profile] += part['received_bytes'][profile]
+            latencies[profile].extend(part['latencies'][profile])
+    frames_sent = sum(p['frames_sent'] for p in parts)
+    delivered = totals['normal'] + totals['slow']
+    expected = frames_sent * args.viewers
+
+    result = {
+        'name': 'relay_load',
+        'params': {
+            'devices': args.devices, 'viewers': args.viewers, 'slow_viewers': slow_total,
+            'fps': args.fps, 'frame_size': args.frame_size, 'workers': args.workers
+        },
+        'unit': 's',
+        'elapsed': elapsed,
+        'frames_sent': frames_sent,
+        'bytes_sent': sum(p['bytes_sent'] for p in parts),
+        'heartbeats_sent': sum(p['heartbeats_sent'] for p in parts),
+        'frames_delivered': delivered,
+        'delivery_ratio': delivered / expected if expected else None,
+        'delivered_frames_per_second': delivered / args.duration,
+        'delivered_bytes_per_second': (total_bytes['normal'] + total_bytes['slow']) / args.duration,
+        'connect_failures': sum(p['connect_failures'] for p in parts),
+        'disconnects': sum(p['disconnects'] for p in parts),
+        'latency': {profile: latency_summary(samples) for profile, samples in latencies.items() if samples},
+    }
+    if sampler:
+        connections = args.devices + args.viewers
+        result['relay_rss_baseline_kb'] = baseline_kb
+        result['relay_rss_peak_kb'] = sampler.peak
+        result['relay_kb_per_connection'] = (
+            (sampler.peak - baseline_kb) / connections if connections and baseline_kb else None
+        )
+    # Mean latency of normal viewers lets --compare style tooling track this run
+    result['mean'] = (sum(latencies['normal']) / len(latencies['normal'])) if latencies['normal'] else 0.0
+
+    write_report([result], args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Run the RanchPi benchmark suite against MockCamera.
+
+Usage:
+  python3 -m benchmarks.run                       # full suite, JSON to stdout
+  python3 -m benchmarks.run --quick -o out.json   # smaller sizes, JSON to file
+  python3 -m benchmarks.run --compare before.json # flag regressions against a previous run
+"""
+
+import argparse
+import importlib
+import sys
+
+from benchmarks.common import write_report, compare_reports
+
+SUITES = {
+    'capture': 'benchmarks.bench_capture',
+    'catalog': 'benchmarks.bench_catalog',
+    'search': 'benchmarks.bench_search',
+    'broadcast': 'benchmarks.bench_broadcast',
+    'processing': 'benchmarks.bench_processing',
+    'codec': 'benchmarks.bench_codec',
+    'protocol': 'benchmarks.bench_protocol',
+    'settings': 'benchmarks.bench_settings',
+    'sync': 'benchmarks.bench_sync',
+    'memory': 'benchmarks.bench_memory',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', action='append', choices=sorted(SUITES), help="Run only the named suite (repeatable)")
+    parser.add_argument('--quick', action='store_true', help="Use smaller sizes and fewer iterations")
+    parser.add_argument('-o', '--output', help="Write the JSON report to this file")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.only or SUITES:
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        module = importlib.import_module(SUITES[name])
+        for result in module.run(quick=args.quick):
+            result['suite'] = name
+            results.append(result)
+
+    write_report(results, args.output)
+
+    if args.compare:
+        regressions = compare_reports(args.compare, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import threading
+
+from metrics import FRAME_MEMORY_BYTES
+
+# Bytes of frame data that may be in flight at once across capture, encode
+# and send; past it new frames are dropped, which for live video is better
+# than queueing stale ones on a 512 MB board
+FRAME_MEMORY_BUDGET = 24 * 1024 * 1024
+# A pooled buffer fits a 1080p JPEG at live quality; larger frames grow it
+FRAME_BUFFER_SIZE = 512 * 1024
+# Buffers kept for reuse; more can be leased while the budget allows
+FRAME_POOL_SIZE = 8
+# Space left at the front of a buffer for a container header (see prepend)
+FRAME_HEADROOM = 256
+
+
+class BudgetExceeded(Exception):
+    """Taking more frame memory would exceed the budget"""
+
+
+class MemoryBudget:
+    """Byte budget shared by everything holding frame data.
+
+    Reservations fail immediately instead of waiting: a live frame that
+    has to wait for memory is already late, so callers drop it and take
+    the next one.
+    """
+    def __init__(self, limit=FRAME_MEMORY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_reserve(self, size):
+        with self._lock:
+            if self.used + size > self.limit:
+                self.rejected += 1
+                return False
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            used = self.used
+        FRAME_MEMORY_BYTES.set(used, state='in_flight')
+        return True
+
+    def reserve(self, size):
+        if not self.try_reserve(size):
+            raise BudgetExceeded(f"{size} bytes would exceed the {self.limit} byte frame budget ({self.used} in use)")
+
+    def release(self, size):
+        with self._lock:
+            self.used -= size
+            used = self.used
+        FRAME_MEMORY_BYTES.set(used, state='in_flight')
+
+    def status(self):
+        return {'limit': self.limit, 'used': self.used, 'peak': self.peak, 'rejected': self.rejected}
+
+
+class PooledBuffer:
+    """A leased pool buffer used as a write-only file.
+
+    Encoders write into it like a BytesIO; view() returns the written
+    bytes as a memoryview, so they reach the socket without a copy.
+    prepend() fills the headroom kept in front, letting a container
+    header go before a JPEG encoded first. Release it (or leave its with
+    block) once the frame has been sent; views must not outlive that.
+    """
+    def __init__(self, pool, buffer, headroom):
+        self._pool = pool
+        self.buffer = buffer
+        self.reserved = len(buffer)
+        self.start = self.end = headroom
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _grow(self, needed):
+        capacity = max(needed, len(self.buffer) * 2)
+        self._pool.budget.reserve(capacity - self.reserved)
+        grown = bytearray(capacity)
+        grown[self.start:self.end] = self.buffer[self.start:self.end]
+        self.buffer = grown
+        self.reserved = capacity
+
+    def write(self, data):
+        end = self.end + len(data)
+        if end > len(self.buffer):
+            self._grow(end)
+        self.buffer[self.end:end] = data
+        self.end = end
+        return len(data)
+
+    def tell(self):
+        return self.end - self.start
+
+    def flush(self):
+        pass
+
+    def prepend(self, data):
+        """Put data in front of what was written, in the headroom if it fits"""
+        if len(data) > self.start:
+            # Rare: the header outgrew the headroom, so shift the payload
+            payload = bytes(self.buffer[self.start:self.end])
+            self.start, self.end = 0, 0
+            self.write(data)
+            self.write(payload)
+            return
+        self.start -= len(data)
+        self.buffer[self.start:self.start + len(data)] = data
+
+    def view(self):
+        return memoryview(self.buffer)[self.start:self.end]
+
+    def release(self):
+        if self.buffer is not None:
+            self._pool._release(self)
+            self.buffer = None
+
+
+class BufferPool:
+    """Preallocated, reusable frame buffers drawn from a MemoryBudget.
+
+    Every leased buffer counts against the budget for its full capacity
+    until released. Buffers that grew for a large frame return to the
+    pool at their new size, so the pool settles at what frames need.
+    """
+    def __init__(self, size=FRAME_BUFFER_SIZE, count=FRAME_POOL_SIZE, budget=None, headroom=FRAME_HEADROOM):
+        self.size = size
+        self.count = count
+        self.headroom = headroom
+        self.budget = budget or MemoryBudget()
+        self._idle = [bytearray(size) for _ in range(count)]
+        self._lock = threading.Lock()
+        self.allocated = count
+        FRAME_MEMORY_BYTES.set(size * count, state='pooled')
+
+    def acquire(self):
+        """Lease a buffer; raises BudgetExceeded when frame memory is used up"""
+        with self._lock:
+            buffer = self._idle.pop() if self._idle else None
+        if buffer is None:
+            if not self.budget.try_reserve(self.size):
+                raise BudgetExceeded(f"Frame budget of {self.budget.limit} bytes is in use")
+            buffer = bytearray(self.size)
+            self.allocated += 1
+        elif not self.budget.try_reserve(len(buffer)):
+            self._put(buffer)
+            raise BudgetExceeded(f"Frame budget of {self.budget.limit} bytes is in use")
+        self._update_idle()
+        return PooledBuffer(self, buffer, self.headroom)
+
+    def _put(self, buffer):
+        with self._lock:
+            if len(self._idle) < self.count:
+                self._idle.append(buffer)
+
+    def _release(self, lease):
+        self.budget.release(lease.reserved)
+        self._put(lease.buffer)
+        self._update_idle()
+
+    def _update_idle(self):
+        FRAME_MEMORY_BYTES.set(sum(len(buffer) for buffer in self._idle), state='pooled')
+
+    def status(self):
+        return dict(self.budget.status(), idle=len(self._idle), allocated=self.allocated)
+
+
+# One budget for the whole process: camera, device uplink and relay share it
+frame_budget = MemoryBudget()
+frame_pool = BufferPool(budget=frame_budget)
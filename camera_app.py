@@ -1,24 +1,48 @@
+import functools
 import logging
+import math
 import platform
 import time
 from pathlib import Path
 import io
 import os
 from PIL import Image, ImageDraw
-from flask import Flask, render_template, send_file, jsonify, request
+from flask import Flask, render_template, send_file, jsonify, request, Response
 from flask_cors import CORS
 from werkzeug.serving import is_running_from_reloader
 import numpy as np
 from datetime import datetime
 import threading
-import schedule
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 import json
+import hashlib
+import re
 import asyncio
 import websockets
 from websocket_server import start_server, get_connected_devices
 import base64
 from PIL import Image
+from metrics import (REGISTRY, CAPTURE_LATENCY, ENCODE_TIME, DISK_WRITE_TIME,
+                     METADATA_COMMIT_TIME, CAPTURES_TOTAL, CAPTURE_BYTES_TOTAL, API_REJECTIONS,
+                     FRAMES_DROPPED_TOTAL)
+from buffers import BudgetExceeded, frame_pool
+from timelapse import TimelapseBuilder, QueueFull, FORMATS as TIMELAPSE_FORMATS
+from events import EventBus
+from camera_profiles import (CAPTURE_PROFILES, CONSUMERS, CUSTOM_PROFILE, DEFAULT_PROFILE, DEFAULT_SENSOR_RESOLUTION,
+                             build_configuration, custom_profile, resolve_profile, select_stream, stream_sizes,
+                             yuv420_luma, yuv420_to_rgb)
+from image_processing import exposure_fusion, stack_frames
+from governor import Governor, SystemSensors
+from rate_limit import AdmissionController, Overloaded, RateLimiter
+from night_mode import (NightModeController, MODES as NIGHT_MODES, NIGHT_ANALOGUE_GAIN, NIGHT_EXPOSURE_US,
+                        REFERENCE_EXPOSURE_US, STACK_FRAMES, STACK_METHOD)
+from image_index import ImageIndex
+from settings_store import SettingsStore
+from replication import LEAF_SIZE, Replicator, SyncBusy
+from detection import DetectionPipeline, FrameSampler, TriggerRules, load_backend
+import catalog
+from archive import ExportStream, FORMATS as EXPORT_FORMATS, normalize_query
 
 # Configure logging with more detail
 logging.basicConfig(
@@ -27,6 +51,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Routes dashboards and scrapers poll every few seconds; their werkzeug
+# access lines are dropped so the log stays readable. Errors still show.
+POLLED_ROUTES = ('/status', '/metrics', '/governor', '/stream/status', '/sync/status')
+_POLLED_ACCESS = re.compile(r'"(?:GET|HEAD) (?:' + '|'.join(map(re.escape, POLLED_ROUTES)) + r')[? ].*" (?:200|304) ')
+
+class PolledRouteFilter(logging.Filter):
+    """Drop successful werkzeug access log lines for polled routes"""
+    def filter(self, record):
+        return not _POLLED_ACCESS.search(record.getMessage())
+
+logging.getLogger('werkzeug').addFilter(PolledRouteFilter())
+
 app = Flask(__name__, 
     template_folder='templates',  # Explicitly set template folder
     static_folder='static'       # Explicitly set static folder
@@ -44,28 +80,200 @@ CORS(app, resources={
 # Disable Flask debug mode
 app.debug = False
 
+# Behind nginx/Apache, let the proxy stream stored files with X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('RANCHPI_X_SENDFILE') == '1'
+
+# Port of the HTTP API; set RANCHPI_PORT to run several nodes on one host
+HTTP_PORT = int(os.environ.get('RANCHPI_PORT', 5000))
+
+# Only trust X-Forwarded-For when a reverse proxy sets it
+TRUST_PROXY = os.environ.get('RANCHPI_TRUST_PROXY') == '1'
+
+# Token buckets as (requests per second, burst), per client
+DEFAULT_RATE_LIMIT = (20.0, 60)
+ROUTE_RATE_LIMITS = {
+    'capture_image': (0.5, 5),
+    'capture_burst': (0.1, 2),
+    'export_images': (0.02, 2),
+    'create_timelapse': (0.1, 3),
+    'list_images': (1.0, 5),
+    'search_images': (5.0, 20),
+    'camera_settings': (2.0, 10),
+    'set_profile': (0.5, 3),
+    'rotate_camera': (2.0, 10),
+    'set_schedule': (1.0, 5),
+    'sync_pull': (0.1, 3)
+}
+# Cheap, cached reads are never limited so the UI stays responsive under load.
+# Neither are the calls a peer makes during a pull: one 429 would abort it,
+# and sync_pull already limits how often pulls start
+RATE_LIMIT_EXEMPT = {
+    'static', 'index', 'live_feed', 'serve_media', 'event_stream', 'get_status',
+    'get_schedule_status', 'timelapse_status', 'stream_status', 'export_metrics',
+    'governor_status', 'night_status', 'list_profiles', 'list_detections', 'sync_status',
+    'sync_manifest', 'sync_ranges', 'sync_entries'
+}
+
+# Expensive operations as (concurrent, queued, seconds to wait in the queue);
+# the sensor takes one capture at a time, so captures queue briefly
+ADMISSION_CLASSES = {
+    'capture': (1, 4, 5.0),
+    'export': (2, 0, 0)
+}
+MAX_PENDING_TIMELAPSES = 3
+TIMELAPSE_RETRY_SECONDS = 30
+
+# RANCHPI_RATE_LIMITS=off turns per-client limits off, e.g. behind a proxy that
+# already enforces them or for load testing; admission caps still apply
+RATE_LIMITS_ENABLED = os.environ.get('RANCHPI_RATE_LIMITS', 'on') != 'off'
+
+rate_limiter = RateLimiter(ROUTE_RATE_LIMITS, DEFAULT_RATE_LIMIT, enabled=RATE_LIMITS_ENABLED)
+admission = AdmissionController(ADMISSION_CLASSES)
+
+def client_id():
+    """Key rate limits by caller address"""
+    if TRUST_PROXY:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+def retry_response(message, status_code, retry_after):
+    """Error response telling the client when to try again"""
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'status': 'error', 'message': message, 'retry_after': retry_after})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def enforce_rate_limit():
+    """Refuse requests beyond the caller's token buckets with 429"""
+    endpoint = request.endpoint
+    if request.method == 'OPTIONS' or endpoint is None or endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    retry_after = rate_limiter.check(client_id(), endpoint)
+    if retry_after:
+        API_REJECTIONS.inc(route=endpoint, reason='rate_limit')
+        return retry_response('Rate limit exceeded', 429, retry_after)
+    return None
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """Refuse work beyond an admission cap with 503"""
+    API_REJECTIONS.inc(route=request.endpoint or 'unknown', reason='admission')
+    return retry_response(str(e), 503, e.retry_after)
+
+def admitted(name):
+    """Run a view while holding a slot of the named admission class"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token = admission.acquire(name)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.release(token)
+        return wrapper
+    return decorator
+
 # Global variables section
 STORAGE_ROOT = Path("storage")
 IMAGES_ROOT = STORAGE_ROOT / "images"
 METADATA_FILE = STORAGE_ROOT / "image_metadata.json"
+SETTINGS_FILE = STORAGE_ROOT / "settings.json"
 
 # Create necessary directories
 STORAGE_ROOT.mkdir(exist_ok=True)
 IMAGES_ROOT.mkdir(exist_ok=True)
 
+# Stored captures never change, so their content hash is a permanent URL
+MEDIA_CACHE_SECONDS = 365 * 24 * 3600
+MEDIA_DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Serializes read-modify-write cycles on the metadata file
+METADATA_LOCK = threading.RLock()
+
+# sha256 digest -> stored path, kept in step with the catalog
+_media_index = {}
+_media_index_signature = None
+
+# Change feed pushed to browsers over /events instead of polling
+event_bus = EventBus()
+
+# Shares CPU, thermal and power headroom between scheduled, live and background work;
+# RANCHPI_SYSFS_ROOT points it at a fake /proc + /sys tree for testing
+def _governor_changed(status):
+    """Publish a new governor level and fit exports into its background budget"""
+    event_bus.publish('governor', status)
+    admission.set_limit('export', min(ADMISSION_CLASSES['export'][0], status['decisions']['background']['concurrency']))
+
+governor = Governor(
+    SystemSensors(os.environ.get('RANCHPI_SYSFS_ROOT', '/')),
+    on_change=_governor_changed
+)
+
 def save_metadata(metadata):
-    """Save image metadata to JSON file"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    """Atomically rewrite the metadata snapshot, folding in the journal"""
+    with METADATA_COMMIT_TIME.time():
+        catalog.write_snapshot(METADATA_FILE, metadata)
+
+def record_metadata(entries, deletes=()):
+    """Journal new, changed or deleted catalog entries, checkpointing when it grows large"""
+    with METADATA_LOCK:
+        with METADATA_COMMIT_TIME.time():
+            journal_size = catalog.append_journal(METADATA_FILE, puts=entries, deletes=deletes)
+        if journal_size >= catalog.CHECKPOINT_BYTES:
+            save_metadata(load_metadata())
+    if deletes:
+        image_index.remove(deletes)
 
 def load_metadata():
-    """Load image metadata from JSON file"""
-    if METADATA_FILE.exists():
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def organize_image(source_path, is_scheduled=False):
+    """Load image metadata: the JSON snapshot plus any journaled changes"""
+    # Under the lock so a checkpoint cannot fold the journal into a new
+    # snapshot between reading the old snapshot and reading the journal
+    with METADATA_LOCK:
+        return catalog.load(METADATA_FILE)
+
+def recover_metadata():
+    """Replay the journal and reconcile the catalog with storage/images"""
+    with METADATA_LOCK:
+        return catalog.recover(METADATA_FILE, IMAGES_ROOT)
+
+def file_digest(path):
+    """SHA-256 of a stored file, used as its content address"""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def media_url(digest):
+    """Immutable URL for a stored capture"""
+    return f"/media/{digest}.jpg"
+
+def refresh_media_index(force=False):
+    """Rebuild the digest lookup, hashing older entries that have no digest yet"""
+    global _media_index_signature
+    with METADATA_LOCK:
+        signature = catalog.signature(METADATA_FILE)
+        if not force and signature == _media_index_signature:
+            return
+        metadata = load_metadata()
+        index = {}
+        changed = {}
+        for path, info in metadata.items():
+            digest = info.get('sha256')
+            if not digest:
+                if not Path(path).exists():
+                    continue
+                digest = info['sha256'] = file_digest(path)
+                changed[path] = info
+            index[digest] = path
+        if changed:
+            record_metadata(changed)
+        _media_index.clear()
+        _media_index.update(index)
+        _media_index_signature = catalog.signature(METADATA_FILE)
+
+def organize_image(source_path, is_scheduled=False, extra=None):
     """Organize captured image into storage structure"""
     timestamp = datetime.now()
     year_month = timestamp.strftime('%Y_%m')
@@ -77,19 +285,245 @@ def organize_image(source_path, is_scheduled=False):
     target_path = target_dir / filename
 
     # Move file to storage
-    shutil.copy2(source_path, target_path)
+    with DISK_WRITE_TIME.time():
+        shutil.copy2(source_path, target_path)
 
     # Update metadata
-    metadata = load_metadata()
-    metadata[str(target_path)] = {
+    capture_type = 'scheduled' if is_scheduled else 'manual'
+    size = target_path.stat().st_size
+    digest = file_digest(target_path)
+    entry = {
         'timestamp': timestamp.isoformat(),
-        'type': 'scheduled' if is_scheduled else 'manual',
-        'size': target_path.stat().st_size
+        'type': capture_type,
+        'size': size,
+        'sha256': digest
     }
-    save_metadata(metadata)
+    entry.update(extra or {})
+    with METADATA_LOCK:
+        record_metadata({str(target_path): entry})
+        _media_index[digest] = str(target_path)
+
+    image_index.submit(target_path, entry)
+    if detector:
+        detector.submit('capture', path=target_path, entry=entry)
+
+    event_bus.publish('capture', dict(entry, path=str(target_path), url=media_url(digest)))
+
+    CAPTURES_TOTAL.inc(type=capture_type)
+    CAPTURE_BYTES_TOTAL.inc(size, type=capture_type)
 
     return target_path
 
+def encode_frame(array, rotation=0, quality=95):
+    """JPEG-encode an RGB array in memory, applying the configured rotation"""
+    img = Image.fromarray(array)
+    if rotation:
+        img = img.rotate(rotation, expand=True)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def capture_quality(consumer, still_quality):
+    """JPEG quality for a stored capture; scheduled ones follow the governor"""
+    return governor.jpeg_quality('scheduled') if consumer == 'scheduled' else still_quality
+
+def pooled_frame_data(render):
+    """Base64 of the JPEG render(buffer) writes into a pooled frame buffer
+
+    Returns None, dropping the frame, when frame memory is used up.
+    """
+    try:
+        with frame_pool.acquire() as buffer:
+            render(buffer)
+            return base64.b64encode(buffer.view()).decode('utf-8')
+    except BudgetExceeded:
+        FRAMES_DROPPED_TOTAL.inc(role='camera', peer='budget')
+        return None
+    except Exception as e:
+        logger.error(f"Error capturing frame: {e}")
+        return None
+
+def store_burst(frames, fused=None, extra=None):
+    """Persist a burst straight from memory with a single catalog update
+
+    frames is a list of {'jpeg', 'timestamp', 'ev'} dicts; fused is optional
+    JPEG bytes of the exposure-fused result. extra is added to every entry.
+    """
+    started = frames[0]['timestamp']
+    burst_id = started.strftime('%Y%m%d_%H%M%S_%f')
+    target_dir = IMAGES_ROOT / started.strftime('%Y_%m')
+    target_dir.mkdir(exist_ok=True)
+
+    items = [
+        (f"burst_{burst_id}_{index:02d}.jpg", frame['jpeg'], frame['timestamp'], dict(extra or {}, index=index, ev=frame['ev']))
+        for index, frame in enumerate(frames)
+    ]
+    if fused is not None:
+        items.append((f"burst_{burst_id}_fused.jpg", fused, started, dict(extra or {}, fused=True)))
+
+    entries = {}
+    with DISK_WRITE_TIME.time():
+        for filename, data, timestamp, fields in items:
+            target_path = target_dir / filename
+            with open(target_path, 'wb') as f:
+                f.write(data)
+            entries[str(target_path)] = dict({
+                'timestamp': timestamp.isoformat(),
+                'type': 'burst',
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'burst_id': burst_id
+            }, **fields)
+
+    with METADATA_LOCK:
+        record_metadata(entries)
+        for path, entry in entries.items():
+            _media_index[entry['sha256']] = path
+
+    if detector:
+        # One frame labels the whole burst: the fused result, else the first
+        path = list(entries)[-1 if fused is not None else 0]
+        detector.submit('capture', path=path, entry=entries[path])
+    for path, entry in entries.items():
+        image_index.submit(path, entry)
+        CAPTURES_TOTAL.inc(type='burst')
+        CAPTURE_BYTES_TOTAL.inc(entry['size'], type='burst')
+        event_bus.publish('capture', dict(entry, path=path, url=media_url(entry['sha256'])))
+    return burst_id, entries
+
+# Time-lapse jobs render from the catalog into a cache keyed by query
+timelapse_builder = TimelapseBuilder(STORAGE_ROOT / "timelapse", load_metadata, gate=governor.gate,
+                                     max_pending=MAX_PENDING_TIMELAPSES)
+
+# Searchable features (brightness, motion, day/night, perceptual hash) per capture
+image_index = ImageIndex(STORAGE_ROOT / "image_index.db", gate=governor.gate)
+
+def _sync_catalog():
+    """The catalog with a content digest on every entry"""
+    refresh_media_index()
+    return load_metadata()
+
+def _store_synced(entries):
+    """Catalog captures copied from another node"""
+    with METADATA_LOCK:
+        record_metadata(entries)
+        for path, entry in entries.items():
+            _media_index[entry['sha256']] = path
+    for path, entry in entries.items():
+        image_index.submit(path, entry)
+
+# Seconds a sync pull waits for a background slot before giving up; while
+# the governor is critical no slot frees, and the next pull resumes the copy
+SYNC_GATE_TIMEOUT = 300
+
+# Replicates captures between nodes: each node serves range hashes of its
+# catalog and pulls only the captures it lacks (see replication.py)
+replicator = Replicator(IMAGES_ROOT, _sync_catalog, _store_synced,
+                        signature=lambda: catalog.signature(METADATA_FILE),
+                        gate=functools.partial(governor.gate, timeout=SYNC_GATE_TIMEOUT),
+                        on_finished=lambda result: event_bus.publish('sync', result))
+
+# Object detection on sampled lores frames and new captures. RANCHPI_DETECTOR
+# picks the backend ('off', 'stub', 'onnx' or 'tflite'); model backends also
+# need RANCHPI_DETECTOR_MODEL and RANCHPI_DETECTOR_LABELS
+DETECTOR_BACKEND = os.environ.get('RANCHPI_DETECTOR', 'off')
+
+# What to do when something is seen. Each rule fires at most once per
+# cooldown seconds; capture and record only fire for live frames, so a
+# triggered capture cannot trigger another one
+DETECTION_TRIGGERS = [
+    {'labels': ['bear', 'wolf', 'coyote', 'dog', 'person'], 'min_score': 0.5,
+     'actions': ['alert', 'record'], 'cooldown': 120},
+    {'labels': ['car', 'truck', 'motorcycle'], 'min_score': 0.5, 'actions': ['alert', 'capture'], 'cooldown': 300},
+    {'labels': ['cow', 'horse', 'sheep'], 'min_score': 0.6, 'actions': ['capture'], 'cooldown': 600}
+]
+# Frames in a detection-triggered recording burst
+RECORD_FRAMES = 10
+
+# Triggered captures run here so the detection worker never waits on the sensor
+trigger_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='detection-trigger')
+
+def _trigger_fields(detection):
+    return {'trigger': detection['label'], 'trigger_score': detection['score']}
+
+def alert_detection(item, detection):
+    """Log and push a detection alert to event subscribers"""
+    logger.warning(f"Detected {detection['label']} ({detection['score']:.2f}) in {item['source']} frame")
+    event_bus.publish('detection_alert', dict(detection, source=item['source'], path=item['path'], time=item['time']))
+
+def _triggered_capture(detection):
+    token = admission.acquire('capture')
+    try:
+        with CAPTURE_LATENCY.time(type='manual'):
+            temp_path = UPLOAD_FOLDER / f"temp_trigger_{time.time()}.jpg"
+            camera.capture_file(str(temp_path))
+            organize_image(temp_path, extra=_trigger_fields(detection))
+            temp_path.unlink()
+    finally:
+        admission.release(token)
+
+def _triggered_recording(detection):
+    token = admission.acquire('capture')
+    try:
+        with CAPTURE_LATENCY.time(type='burst'):
+            frames = camera.capture_burst(RECORD_FRAMES)
+            rotation = camera.get_status()['settings'].get('rotation', 0)
+            with ENCODE_TIME.time(source='burst'):
+                for frame in frames:
+                    frame['jpeg'] = encode_frame(frame.pop('array'), rotation)
+            store_burst(frames, extra=_trigger_fields(detection))
+    finally:
+        admission.release(token)
+
+def _run_trigger(action, detection):
+    try:
+        action(detection)
+    except Overloaded as e:
+        logger.info(f"Skipping triggered capture: {e}")
+    except Exception as e:
+        logger.error(f"Triggered capture failed: {e}")
+
+TRIGGER_ACTIONS = {
+    'alert': alert_detection,
+    'capture': lambda item, detection: trigger_pool.submit(_run_trigger, _triggered_capture, detection),
+    'record': lambda item, detection: trigger_pool.submit(_run_trigger, _triggered_recording, detection)
+}
+detection_triggers = TriggerRules(DETECTION_TRIGGERS, TRIGGER_ACTIONS)
+
+def handle_detections(item, detections):
+    """Store detections on their capture, publish them and run triggers"""
+    if not detections:
+        return
+    if item['path'] and item['entry'] is not None:
+        with METADATA_LOCK:
+            record_metadata({item['path']: dict(item['entry'], detections=detections)})
+    event_bus.publish('detection', {'source': item['source'], 'path': item['path'],
+                                    'time': item['time'], 'detections': detections})
+    detection_triggers.evaluate(item, detections)
+
+def create_detector():
+    """Build the detection pipeline for RANCHPI_DETECTOR, or None when off"""
+    if DETECTOR_BACKEND == 'off':
+        return None
+    try:
+        backend = load_backend(DETECTOR_BACKEND,
+                               model_path=os.environ.get('RANCHPI_DETECTOR_MODEL'),
+                               labels_path=os.environ.get('RANCHPI_DETECTOR_LABELS'))
+    except (ImportError, OSError, ValueError) as e:
+        logger.error(f"Object detection disabled, could not load {DETECTOR_BACKEND} backend: {e}")
+        return None
+    logger.info(f"Object detection using the {backend.name} backend")
+    return DetectionPipeline(backend, on_result=handle_detections, gate=governor.gate)
+
+detector = create_detector()
+
+# Samples live lores frames while background work has headroom
+detection_sampler = FrameSampler(
+    lambda: camera.capture_array('detection'),
+    detector,
+    should_sample=lambda: governor.decision('background')['concurrency'] > 0
+) if detector else None
+
 UPLOAD_FOLDER = Path("static/images")
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 
@@ -102,138 +536,299 @@ CAPTURE_SETTINGS = {
 # Global camera instance
 camera = None
 
+# Burst frames are held in memory until the batch is stored
+MAX_BURST_FRAMES = 30
+
+# Frames to wait for manual exposure to take effect during bracketing
+BRACKET_SETTLE_FRAMES = 6
+
 # Camera settings
 CAMERA_SETTINGS = {
     'brightness': 50,
     'contrast': 50,
     'rotation': 0,
-    'resolution': (640, 480)
+    'profile': DEFAULT_PROFILE,
+    'resolution': stream_sizes(DEFAULT_PROFILE)['main'],
+    'night_mode': 'auto',  # 'auto' follows scene luminance, 'on'/'off' force it
+    'night_active': False
 }
 
-class MockCamera:
-    """Mock camera for development environment"""
-    def __init__(self):
-        self.width = 640
-        self.height = 480
-        self.settings = CAMERA_SETTINGS.copy()
-        self.is_running = True
-        self.capture_thread = None
-        logger.info("Mock camera initialized with settings: %s", self.settings)
+# Settings handled by dedicated helpers rather than copied verbatim
+SPECIAL_SETTINGS = ('profile', 'resolution', 'night_mode', 'night_active')
+
+# Camera state versioned and published with the settings
+CAMERA_STATE = {
+    'running': False
+}
+
+# Runtime state that is published but not restored after a restart
+TRANSIENT_SETTINGS = {
+    'camera': ('night_active',),
+    'state': ('running',)
+}
+
+# Wakes the scheduled capture loop when the schedule changes
+schedule_wakeup = threading.Event()
+
+def camera_status(snapshot):
+    """Camera status as served by /status and the 'status' event"""
+    return {
+        'running': snapshot['state']['running'],
+        'settings': snapshot.section('camera')
+    }
+
+def _settings_changed(snapshot, section, changed):
+    """Push settings changes to event subscribers and the scheduler"""
+    if section == 'schedule':
+        event_bus.publish('schedule', snapshot.section('schedule'), only_if_changed=True)
+        schedule_wakeup.set()
+    else:
+        event_bus.publish('status', camera_status(snapshot), only_if_changed=True)
+
+def create_settings_store(path):
+    """Persisted camera settings, schedule and camera state"""
+    store = SettingsStore(path, {
+        'camera': CAMERA_SETTINGS,
+        'schedule': CAPTURE_SETTINGS,
+        'state': CAMERA_STATE
+    }, transient=TRANSIENT_SETTINGS)
+    store.subscribe(_settings_changed)
+    return store
+
+# Every settings reader takes the current immutable snapshot; changes go
+# through settings_store.update so they are saved and published
+settings_store = create_settings_store(SETTINGS_FILE)
+
+def _profile_update(camera, new_settings):
+    """Apply a 'profile' or 'resolution' change from a settings update"""
+    if 'profile' in new_settings:
+        camera.set_profile(new_settings['profile'])
+    elif 'resolution' in new_settings:
+        resolution = tuple(new_settings['resolution'])
+        if resolution != tuple(camera.settings['resolution']):
+            camera.set_profile(custom_profile(resolution))
+
+def _night_update(camera, new_settings):
+    """Apply a 'night_mode' change; forced modes take effect immediately"""
+    if 'night_mode' not in new_settings:
+        return
+    mode = new_settings['night_mode']
+    if mode not in NIGHT_MODES:
+        raise ValueError(f"night_mode must be one of {', '.join(NIGHT_MODES)}")
+    settings_store.update('camera', {'night_mode': mode}, source='night_mode')
+    if mode != 'auto':
+        camera.set_night_mode(mode == 'on')
+
+def _settings_update(camera, new_settings):
+    """Store the settings in an update that need no camera reconfiguration"""
+    changes = {key: value for key, value in new_settings.items()
+               if key not in SPECIAL_SETTINGS and key in camera.settings}
+    if 'rotation' in changes:
+        # Normalize rotation to 0, 90, 180, or 270
+        changes['rotation'] = changes['rotation'] % 360
+        logger.info(f"Updated rotation to {changes['rotation']} degrees")
+    return settings_store.update('camera', changes, source='settings').section('camera')
+
+class ScheduledCapture:
+    """Scheduled capture loop shared by MockCamera and PiCamera2Wrapper
+
+    Needs capture_file, capture_burst and settings from the camera; at
+    night a scheduled capture is a stacked burst instead of one frame.
+    """
+    capture_thread = None
 
     def start_scheduled_capture(self, interval_minutes):
         """Start scheduled capture"""
         if interval_minutes <= 0:
             logger.info("Scheduled capture disabled")
-            CAPTURE_SETTINGS['is_scheduled'] = False
-            CAPTURE_SETTINGS['interval'] = 0
+            settings_store.update('schedule', {'interval': 0, 'is_scheduled': False}, source='schedule')
             return
-        
-        CAPTURE_SETTINGS['interval'] = interval_minutes
-        CAPTURE_SETTINGS['is_scheduled'] = True
-        logger.info(f"Starting scheduled capture every {interval_minutes} minutes")
 
-        def scheduled_capture():
-            while CAPTURE_SETTINGS['is_scheduled']:
-                self.capture_scheduled_image()
-                time.sleep(interval_minutes * 60)
+        settings_store.update('schedule', {'interval': interval_minutes, 'is_scheduled': True}, source='schedule')
+        logger.info(f"Starting scheduled capture every {interval_minutes} minutes")
 
         if self.capture_thread is None or not self.capture_thread.is_alive():
-            self.capture_thread = threading.Thread(target=scheduled_capture)
+            self.capture_thread = threading.Thread(target=self._run_schedule)
             self.capture_thread.daemon = True
             self.capture_thread.start()
 
+    def _run_schedule(self):
+        """Capture at the stored interval until scheduling is turned off
+
+        Schedule changes wake the loop, so a new interval applies from the
+        last capture instead of after the old interval runs out.
+        """
+        last_capture = None
+        while True:
+            schedule_wakeup.clear()
+            current_schedule = settings_store.snapshot()['schedule']
+            if not current_schedule['is_scheduled']:
+                return
+            wait = 0 if last_capture is None else last_capture + current_schedule['interval'] * 60 - time.monotonic()
+            if wait > 0:
+                schedule_wakeup.wait(wait)
+                continue
+            last_capture = time.monotonic()
+            self.capture_scheduled_image()
+
     def stop_scheduled_capture(self):
         """Stop scheduled capture"""
-        CAPTURE_SETTINGS['is_scheduled'] = False
-        CAPTURE_SETTINGS['interval'] = 0
+        settings_store.update('schedule', {'interval': 0, 'is_scheduled': False}, source='schedule')
         logger.info("Stopped scheduled capture")
 
     def capture_scheduled_image(self):
         """Capture image on schedule"""
-        temp_path = UPLOAD_FOLDER / f"temp_scheduled_{time.time()}.jpg"
-        self.capture_file(str(temp_path))
-        final_path = organize_image(temp_path, is_scheduled=True)
-        temp_path.unlink()
-        logger.info(f"Scheduled capture saved to {final_path}")
-
+        if self.settings['night_active']:
+            capture_night_stack(self)
+            return
+        with CAPTURE_LATENCY.time(type='scheduled'):
+            temp_path = UPLOAD_FOLDER / f"temp_scheduled_{time.time()}.jpg"
+            self.capture_file(str(temp_path), consumer='scheduled')
+            final_path = organize_image(temp_path, is_scheduled=True)
+            temp_path.unlink()
+        logger.debug(f"Scheduled capture saved to {final_path}")
+
+class MockCamera(ScheduledCapture):
+    """Mock camera for development environment"""
+    def __init__(self):
+        self.sensor_resolution = DEFAULT_SENSOR_RESOLUTION
+        self.profile, self.profile_config = resolve_profile(DEFAULT_PROFILE)
+        self.width, self.height = stream_sizes(self.profile_config)['main']
+        settings_store.update('camera', {'profile': self.profile, 'resolution': (self.width, self.height)})
+        settings_store.update('state', {'running': True})
+        self.capture_thread = None
+        self.scene_light = 1.0
+        logger.info("Mock camera initialized with settings: %s", dict(self.settings))
+
+    @property
+    def settings(self):
+        """Current camera settings, read-only; change them with update_settings"""
+        return settings_store.snapshot()['camera']
+
+    def set_profile(self, profile):
+        """Switch capture profile (a name or a custom_profile() dict); the mock just changes its output sizes"""
+        name, config = resolve_profile(profile)
+        self.profile, self.profile_config = name, config
+        self.width, self.height = stream_sizes(config, self.sensor_resolution)['main']
+        settings_store.update('camera', {'profile': name, 'resolution': (self.width, self.height)}, source='profile')
+        logger.info(f"Mock camera switched to profile {name} ({self.width}x{self.height})")
+
+    def _stream_size(self, consumer):
+        stream = select_stream(self.profile_config, consumer, self.sensor_resolution)
+        return stream_sizes(self.profile_config, self.sensor_resolution)[stream]
+
+    def capture_array(self, consumer='motion', luma=False):
+        """Return a frame from the cheapest stream for consumer as a numpy array"""
+        width, height = self._stream_size(consumer)
+        img = Image.new('RGB', (width, height), color='white')
+        draw = ImageDraw.Draw(img)
+        stripe_height = height // 3
+        for i, color in enumerate(['red', 'green', 'blue']):
+            draw.rectangle([0, i * stripe_height, width, (i + 1) * stripe_height], fill=color)
+        draw.text((10, height - 30), time.strftime("%Y-%m-%d %H:%M:%S"), fill='white')
+        return np.asarray(img.convert('L') if luma else img)
+
+    def set_night_mode(self, enabled):
+        """Switch between auto exposure and the long-exposure night controls"""
+        settings_store.update('camera', {'night_active': bool(enabled)}, source='night_mode')
+        logger.info(f"Mock camera night mode {'on' if enabled else 'off'}")
+
+    def meter(self):
+        """Mean lores luma with the exposure and gain it was taken at"""
+        exposure, gain = (NIGHT_EXPOSURE_US, NIGHT_ANALOGUE_GAIN) if self.settings['night_active'] else (REFERENCE_EXPOSURE_US, 1.0)
+        # scene_light lets development setups simulate dusk
+        luma = self.capture_array('motion', luma=True).mean() * self.scene_light * exposure * gain / REFERENCE_EXPOSURE_US
+        return {'luma': float(min(255.0, luma)), 'exposure': exposure, 'gain': gain}
+
+    def capture_burst(self, count, exposures=None):
+        """Capture frames back to back into memory, optionally bracketed by EV offsets"""
+        frames = []
+        for ev in (exposures or [None] * count):
+            array = self.capture_array('still')
+            if ev:
+                # Simulate the exposure change by scaling the test pattern
+                array = np.clip(array.astype(np.float32) * (2.0 ** ev), 0, 255).astype(np.uint8)
+            frames.append({'array': array, 'ev': ev, 'timestamp': datetime.now()})
+        return frames
 
     def start(self):
-        self.is_running = True
+        settings_store.update('state', {'running': True})
         logger.info("Mock camera started")
 
     def stop(self):
-        self.is_running = False
+        settings_store.update('state', {'running': False})
         logger.info("Mock camera stopped")
 
     def get_status(self):
-        return {
-            'running': self.is_running,
-            'settings': self.settings
-        }
+        return camera_status(settings_store.snapshot())
     
-    def get_frame_data(self):
+    def get_frame_data(self, consumer='stream'):
         """Capture frame and return base64 encoded data"""
-        buffer = io.BytesIO()
-        try:
-            # Create test pattern image
-            img = Image.new('RGB', (self.width, self.height), color='white')
-            draw = ImageDraw.Draw(img)
-
-            # Add colored stripes
-            stripe_height = self.height // 3
-            colors = ['red', 'green', 'blue']
-            for i, color in enumerate(colors):
-                draw.rectangle(
-                    [(0, i * stripe_height), (self.width, (i + 1) * stripe_height)],
-                    fill=color
-                )
-
-            # Add development mode indicator
-            text = "Development Mode"
-            draw.text(
-                (self.width//2 - 100, self.height//2),
-                text,
-                fill='white',
-                stroke_width=2,
-                stroke_fill='black'
+        with ENCODE_TIME.time(source='stream'):
+            return self._render_frame_data(self._stream_size(consumer))
+
+    def _render_frame_data(self, size):
+        return pooled_frame_data(lambda buffer: self._render_frame(buffer, size))
+
+    def _render_frame(self, buffer, size):
+        width, height = size
+        # Create test pattern image
+        img = Image.new('RGB', (width, height), color='white')
+        draw = ImageDraw.Draw(img)
+
+        # Add colored stripes
+        stripe_height = height // 3
+        colors = ['red', 'green', 'blue']
+        for i, color in enumerate(colors):
+            draw.rectangle(
+                [(0, i * stripe_height), (width, (i + 1) * stripe_height)],
+                fill=color
             )
 
-            # Add timestamp
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            draw.text(
-                (10, self.height - 30),
-                timestamp,
-                fill='white',
-                stroke_width=1,
-                stroke_fill='black'
-            )
-
-            # Apply settings
-            if self.settings['rotation'] != 0:
-                img = img.rotate(self.settings['rotation'])
-
-            # Save to buffer
-            img.save(buffer, format='JPEG', quality=85)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-        except Exception as e:
-            logger.error(f"Error capturing frame: {e}")
-            return None
-        finally:
-            buffer.close()
-
-    def capture_file(self, filename):
+        # Add development mode indicator
+        text = "Development Mode"
+        draw.text(
+            (width//2 - 100, height//2),
+            text,
+            fill='white',
+            stroke_width=2,
+            stroke_fill='black'
+        )
+
+        # Add timestamp
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        draw.text(
+            (10, height - 30),
+            timestamp,
+            fill='white',
+            stroke_width=1,
+            stroke_fill='black'
+        )
+
+        # Apply settings
+        if self.settings['rotation'] != 0:
+            img = img.rotate(self.settings['rotation'])
+
+        # Save to buffer
+        img.save(buffer, format='JPEG', quality=governor.jpeg_quality('live'))
+
+    def capture_file(self, filename, consumer='still'):
+        with ENCODE_TIME.time(source='still'):
+            return self._render_capture(filename, self._stream_size(consumer), capture_quality(consumer, 95))
+
+    def _render_capture(self, filename, size, quality):
+        width, height = size
         try:
             # Create a test pattern image
-            img = Image.new('RGB', (self.width, self.height), color='white')
+            img = Image.new('RGB', (width, height), color='white')
             draw = ImageDraw.Draw(img)
 
             # Add colored stripes
-            stripe_height = self.height // 3
+            stripe_height = height // 3
             colors = ['red', 'green', 'blue']
             for i, color in enumerate(colors):
                 draw.rectangle(
-                    [0, i * stripe_height, self.width, (i + 1) * stripe_height],
+                    [0, i * stripe_height, width, (i + 1) * stripe_height],
                     fill=color
                 )
 
@@ -241,7 +836,7 @@ class MockCamera:
             font_size = 36
             text = "Development Mode"
             draw.text(
-                (self.width//2 - 100, self.height//2 - font_size//2),
+                (width//2 - 100, height//2 - font_size//2),
                 text,
                 fill='white',
                 stroke_width=2,
@@ -251,7 +846,7 @@ class MockCamera:
             # Add timestamp
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
             draw.text(
-                (10, self.height - 30),
+                (10, height - 30),
                 timestamp,
                 fill='white',
                 stroke_width=1,
@@ -270,11 +865,11 @@ class MockCamera:
 
             # Apply rotation if needed
             if self.settings['rotation'] != 0:
-                logger.info(f"Rotating image by {self.settings['rotation']} degrees")
+                logger.debug(f"Rotating image by {self.settings['rotation']} degrees")
                 img = img.rotate(self.settings['rotation'], expand=True)
 
-            img.save(filename, quality=95)
-            logger.info(f"Mock camera: captured test pattern saved to {filename}")
+            img.save(filename, quality=quality)
+            logger.debug(f"Mock camera: captured test pattern saved to {filename}")
             return True
         except Exception as e:
             logger.error(f"Mock camera: error capturing image: {e}")
@@ -282,68 +877,188 @@ class MockCamera:
 
     def update_settings(self, new_settings):
         try:
-            for key, value in new_settings.items():
-                if key in self.settings:
-                    self.settings[key] = value
-                    if key == 'rotation':
-                        # Normalize rotation to 0, 90, 180, or 270
-                        self.settings['rotation'] = (value % 360)
-                        logger.info(f"Updated rotation to {self.settings['rotation']} degrees")
-            return self.settings
+            _profile_update(self, new_settings)
+            _night_update(self, new_settings)
+            return _settings_update(self, new_settings)
         except Exception as e:
             logger.error(f"Error updating settings: {e}")
             raise
 
-class PiCamera2Wrapper:
+class PiCamera2Wrapper(ScheduledCapture):
     """Wrapper for PiCamera2 to handle rotation consistently"""
-    def __init__(self, picam):
+    def __init__(self, picam, profile=DEFAULT_PROFILE):
         self.camera = picam
-        self.settings = CAMERA_SETTINGS.copy()
-        self.is_running = True
-        logger.info("PiCamera2Wrapper initialized with settings: %s", self.settings)
-    
-    def get_frame_data(self):
+        self.profile, self.profile_config = resolve_profile(profile)
+        self.sensor_resolution = tuple(picam.sensor_resolution)
+        settings_store.update('camera', {
+            'profile': self.profile,
+            'resolution': stream_sizes(self.profile_config, self.sensor_resolution)['main']
+        })
+        settings_store.update('state', {'running': True})
+        # Mode switches must not interleave with captures
+        self._lock = threading.RLock()
+        limits = picam.camera_controls.get('FrameDurationLimits')
+        self._frame_duration_limits = (limits[0], limits[1]) if limits else None
+        logger.info("PiCamera2Wrapper initialized with settings: %s", dict(self.settings))
+
+    @property
+    def settings(self):
+        """Current camera settings, read-only; change them with update_settings"""
+        return settings_store.snapshot()['camera']
+
+    def set_profile(self, profile):
+        """Reconfigure the sensor outputs in place, without closing the camera
+
+        profile is a name from CAPTURE_PROFILES or a custom_profile() dict.
+        """
+        name, profile_config = resolve_profile(profile)
+        config = build_configuration(self.camera, profile_config)
+        with self._lock:
+            self.camera.switch_mode(config)
+            self.profile, self.profile_config = name, profile_config
+        settings_store.update('camera', {
+            'profile': name,
+            'resolution': stream_sizes(profile_config, self.sensor_resolution)['main']
+        }, source='profile')
+        logger.info(f"Switched camera to profile {name}")
+
+    def set_night_mode(self, enabled):
+        """Switch between auto exposure and the long-exposure night controls"""
+        if enabled:
+            exposure_limits = self.camera.camera_controls.get('ExposureTime')
+            exposure = min(NIGHT_EXPOSURE_US, exposure_limits[1]) if exposure_limits else NIGHT_EXPOSURE_US
+            controls = {
+                'AeEnable': False,
+                'ExposureTime': int(exposure),
+                'AnalogueGain': NIGHT_ANALOGUE_GAIN,
+                # The frame must be at least as long as the exposure
+                'FrameDurationLimits': (int(exposure), int(exposure))
+            }
+        else:
+            controls = {'AeEnable': True}
+            if self._frame_duration_limits:
+                controls['FrameDurationLimits'] = self._frame_duration_limits
+        with self._lock:
+            self.camera.set_controls(controls)
+        settings_store.update('camera', {'night_active': bool(enabled)}, source='night_mode')
+        logger.info(f"PiCamera night mode {'on' if enabled else 'off'}")
+
+    def meter(self):
+        """Mean lores luma with the exposure and gain it was taken at"""
+        with self._lock:
+            luma = self.capture_array('motion', luma=True)
+            metadata = self.camera.capture_metadata()
+        return {
+            'luma': float(luma.mean()),
+            'exposure': metadata.get('ExposureTime'),
+            'gain': metadata.get('AnalogueGain')
+        }
+
+    def _capture_jpeg(self, consumer, target, quality=85):
+        """Write a JPEG from the cheapest stream that serves consumer"""
+        stream = select_stream(self.profile_config, consumer, self.sensor_resolution)
+        with self._lock:
+            if stream == 'main':
+                self.camera.capture_file(target, name='main', format='jpeg')
+                return
+            frame = self.camera.capture_array('lores')
+        size = stream_sizes(self.profile_config, self.sensor_resolution)['lores']
+        Image.fromarray(yuv420_to_rgb(frame, size)).save(target, format='JPEG', quality=quality)
+
+    def capture_array(self, consumer='motion', luma=False):
+        """Return a frame from the cheapest stream for consumer as a numpy array"""
+        stream = select_stream(self.profile_config, consumer, self.sensor_resolution)
+        with self._lock:
+            frame = self.camera.capture_array(stream)
+        if stream == 'lores':
+            size = stream_sizes(self.profile_config, self.sensor_resolution)['lores']
+            return yuv420_luma(frame, size) if luma else yuv420_to_rgb(frame, size)
+        frame = frame[..., :3]
+        if luma:
+            return (frame @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8)
+        return frame
+
+    def capture_burst(self, count, exposures=None):
+        """Capture frames back to back into memory, optionally bracketed by EV offsets
+
+        Frames are grabbed as raw arrays at the sensor rate and only encoded
+        afterwards. Bracketing switches to manual exposure around the current
+        auto-exposure value and restores auto exposure when done.
+        """
+        with self._lock:
+            if not exposures:
+                return [
+                    {'array': self.camera.capture_array('main')[..., :3].copy(), 'ev': None, 'timestamp': datetime.now()}
+                    for _ in range(count)
+                ]
+
+            current = self.camera.capture_metadata()
+            base_exposure = current['ExposureTime']
+            gain = current.get('AnalogueGain', 1.0)
+            frames = []
+            try:
+                for ev in exposures:
+                    target = int(base_exposure * 2.0 ** ev)
+                    self.camera.set_controls({'AeEnable': False, 'ExposureTime': target, 'AnalogueGain': gain})
+                    # Controls apply a few frames later; skip frames until they have
+                    for attempt in range(BRACKET_SETTLE_FRAMES):
+                        request = self.camera.capture_request()
+                        try:
+                            actual = request.get_metadata().get('ExposureTime', 0)
+                            settled = abs(actual - target) <= max(100, target * 0.05)
+                            if settled or attempt == BRACKET_SETTLE_FRAMES - 1:
+                                frames.append({
+                                    'array': request.make_array('main')[..., :3].copy(),
+                                    'ev': ev,
+                                    'timestamp': datetime.now()
+                                })
+                                break
+                        finally:
+                            request.release()
+            finally:
+                self.camera.set_controls({'AeEnable': True})
+            return frames
+
+    def get_frame_data(self, consumer='stream'):
         """Capture frame and return base64 encoded data"""
-        buffer = io.BytesIO()
-        try:
-            # Capture to memory
-            self.camera.capture_file(buffer, format='jpeg')
-            buffer.seek(0)
+        with ENCODE_TIME.time(source='stream'):
+            return self._render_frame_data(consumer)
 
-            # Process with PIL if rotation needed
-            if self.settings['rotation'] != 0:
-                with Image.open(buffer) as img:
-                    img = img.rotate(self.settings['rotation'])
-                    buffer.seek(0)
-                    buffer.truncate()
-                    img.save(buffer, format='JPEG', quality=85)
+    def _render_frame_data(self, consumer):
+        return pooled_frame_data(lambda buffer: self._render_frame(buffer, consumer))
 
-            buffer.seek(0)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+    def _render_frame(self, buffer, consumer):
+        quality = governor.jpeg_quality('live')
+        rotation = self.settings['rotation']
+        if not rotation:
+            self._capture_jpeg(consumer, buffer, quality=quality)
+            return
+        # Rotate the raw frame and encode once, rather than decoding
+        # and re-encoding a JPEG
+        img = Image.fromarray(self.capture_array(consumer)).rotate(rotation)
+        img.save(buffer, format='JPEG', quality=quality)
 
-        except Exception as e:
-            logger.error(f"Error capturing frame: {e}")
-            return None
-        finally:
-            buffer.close()
+    def capture_file(self, filename, consumer='still'):
+        with ENCODE_TIME.time(source='still'):
+            return self._render_capture(filename, consumer)
 
-    def capture_file(self, filename):
+    def _render_capture(self, filename, consumer):
         try:
             # Always capture to memory first for consistent rotation handling
             stream = io.BytesIO()
-            self.camera.capture_file(stream, format='jpeg')
+            self._capture_jpeg(consumer, stream, quality=95)
             stream.seek(0)
 
             # Open with PIL for rotation
             with Image.open(stream) as img:
                 # Apply rotation if needed
                 if self.settings['rotation'] != 0:
-                    logger.info(f"Rotating image by {self.settings['rotation']} degrees")
+                    logger.debug(f"Rotating image by {self.settings['rotation']} degrees")
                     img = img.rotate(self.settings['rotation'])
 
                 # Save the final image
-                img.save(filename, 'JPEG', quality=85)
-                logger.info(f"Captured and saved image to {filename}")
+                img.save(filename, 'JPEG', quality=capture_quality(consumer, 85))
+                logger.debug(f"Captured and saved image to {filename}")
 
         except Exception as e:
             logger.error(f"Error in PiCamera capture: {e}")
@@ -352,20 +1067,13 @@ class PiCamera2Wrapper:
             logger.info("Fallback: Direct capture successful")
 
     def get_status(self):
-        return {
-            'running': self.is_running,
-            'settings': self.settings
-        }
+        return camera_status(settings_store.snapshot())
 
     def update_settings(self, new_settings):
         try:
-            for key, value in new_settings.items():
-                if key in self.settings:
-                    self.settings[key] = value
-                    if key == 'rotation':
-                        self.settings['rotation'] = value % 360
-                        logger.info(f"Updated PiCamera rotation to {self.settings['rotation']} degrees")
-            return self.settings
+            _profile_update(self, new_settings)
+            _night_update(self, new_settings)
+            return _settings_update(self, new_settings)
         except Exception as e:
             logger.error(f"Error updating PiCamera settings: {e}")
             raise
@@ -394,12 +1102,8 @@ def initialize_camera():
                 cameras = picam.global_camera_info()
                 logger.info(f"Available cameras: {cameras}")
 
-                # Create camera configuration
-                camera_config = picam.create_still_configuration(
-                    main={"size": (640, 480)},
-                    lores={"size": (320, 240)},
-                    display="lores"
-                )
+                # Create camera configuration from the default capture profile
+                camera_config = build_configuration(picam, DEFAULT_PROFILE)
                 logger.info(f"Created camera configuration: {camera_config}")
 
                 picam.configure(camera_config)
@@ -427,8 +1131,61 @@ def initialize_camera():
         logger.error(f"Unexpected error in camera initialization: {e}")
         return MockCamera()
 
+def restore_settings(camera, saved):
+    """Re-apply the camera settings saved by the previous run"""
+    settings = saved.section('camera')
+    for key in TRANSIENT_SETTINGS['camera']:
+        settings.pop(key, None)
+    if settings['profile'] == camera.profile:
+        settings.pop('resolution')
+    elif settings['profile'] not in CAPTURE_PROFILES:
+        # Custom profiles are rebuilt from the saved resolution
+        settings.pop('profile')
+    try:
+        camera.update_settings(settings)
+    except Exception as e:
+        logger.error(f"Could not restore saved camera settings: {e}")
+
 # Initialize camera
+saved_settings = settings_store.snapshot()
 camera = initialize_camera()
+restore_settings(camera, saved_settings)
+
+# Night stacks are combined and encoded here, off the capture thread
+night_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='night-stack')
+
+def _store_night_stack(arrays, rotation):
+    """Stack a night burst and store it as one scheduled capture"""
+    try:
+        with ENCODE_TIME.time(source='night_stack'):
+            jpeg = encode_frame(stack_frames(arrays, STACK_METHOD), rotation, governor.jpeg_quality('scheduled'))
+        temp_path = UPLOAD_FOLDER / f"temp_night_{time.time()}.jpg"
+        temp_path.write_bytes(jpeg)
+        final_path = organize_image(temp_path, is_scheduled=True, extra={
+            'night': True,
+            'stacked': len(arrays),
+            'stack_method': STACK_METHOD
+        })
+        temp_path.unlink()
+        logger.debug(f"Night stack of {len(arrays)} frames saved to {final_path}")
+        return final_path
+    except Exception as e:
+        logger.error(f"Error storing night stack: {e}")
+        return None
+
+def capture_night_stack(camera):
+    """Capture a burst at night exposure and hand it to the stacking worker"""
+    with CAPTURE_LATENCY.time(type='scheduled'):
+        frames = camera.capture_burst(STACK_FRAMES)
+    rotation = camera.get_status()['settings'].get('rotation', 0)
+    return night_pool.submit(_store_night_stack, [frame['array'] for frame in frames], rotation)
+
+def schedule_settings():
+    """Current scheduled capture settings"""
+    return settings_store.snapshot().section('schedule')
+
+# Meters lores luminance and flips the camera into night exposure
+night_controller = NightModeController(camera)
 
 @app.route('/')
 def index():
@@ -442,43 +1199,85 @@ def live_feed():
     return render_template('live.html')
 
 @app.route('/capture')
+@admitted('capture')
 def capture_image():
     """Capture an image and return it."""
     if not camera:
         return jsonify({'status': 'error', 'message': 'Camera not initialized'}), 500
 
     try:
-        logger.info("Attempting to capture image")
-        # Capture to temporary location first
-        temp_path = UPLOAD_FOLDER / f"temp_{time.time()}.jpg"
-        camera.capture_file(str(temp_path))
+        logger.debug("Attempting to capture image")
+        with CAPTURE_LATENCY.time(type='manual'):
+            # Capture to temporary location first
+            temp_path = UPLOAD_FOLDER / f"temp_{time.time()}.jpg"
+            camera.capture_file(str(temp_path))
 
-        # Organize the image
-        final_path = organize_image(temp_path)
+            # Organize the image
+            final_path = organize_image(temp_path)
 
-        # Clean up temp file
-        temp_path.unlink()
+            # Clean up temp file
+            temp_path.unlink()
 
-        logger.info(f"Successfully captured image to {final_path}")
-        logger.info("Image captured successfully")
+        logger.debug(f"Successfully captured image to {final_path}")
         return send_file(str(final_path), mimetype='image/jpeg')
     except Exception as e:
         logger.error(f"Error capturing image: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/status')
-def get_status():
-    """Get camera status."""
+@app.route('/capture/burst', methods=['POST'])
+@admitted('capture')
+def capture_burst():
+    """Capture a burst (or exposure bracket) and store it as one batch"""
     if not camera:
         return jsonify({'status': 'error', 'message': 'Camera not initialized'}), 500
 
+    data = request.get_json(silent=True) or {}
+    try:
+        bracket = [float(ev) for ev in data.get('bracket') or []]
+        count = len(bracket) if bracket else int(data.get('count', 5))
+        fuse = bool(data.get('fuse', bool(bracket)))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'count must be an integer and bracket a list of EV offsets'}), 400
+    if not 1 <= count <= MAX_BURST_FRAMES:
+        return jsonify({'status': 'error', 'message': f'count must be between 1 and {MAX_BURST_FRAMES}'}), 400
+    if any(abs(ev) > 4 for ev in bracket):
+        return jsonify({'status': 'error', 'message': 'bracket offsets must be within +/-4 EV'}), 400
+
     try:
-        status_data = camera.get_status()
-        return jsonify({'status': 'ok', 'data': status_data})
+        with CAPTURE_LATENCY.time(type='burst'):
+            frames = camera.capture_burst(count, exposures=bracket or None)
+            rotation = camera.get_status()['settings'].get('rotation', 0)
+            with ENCODE_TIME.time(source='burst'):
+                fused = encode_frame(exposure_fusion([f['array'] for f in frames]), rotation) if fuse else None
+                for frame in frames:
+                    frame['jpeg'] = encode_frame(frame.pop('array'), rotation)
+            burst_id, entries = store_burst(frames, fused)
+        return jsonify({
+            'status': 'ok',
+            'data': {
+                'burst_id': burst_id,
+                'images': {path: dict(entry, url=media_url(entry['sha256'])) for path, entry in entries.items()}
+            }
+        })
     except Exception as e:
-        logger.error(f"Error getting status: {e}")
+        logger.error(f"Error capturing burst: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/status')
+def get_status():
+    """Get camera status."""
+    if not camera:
+        return jsonify({'status': 'error', 'message': 'Camera not initialized'}), 500
+
+    # Status only changes with the settings version: the body is serialized
+    # once per snapshot, and pollers holding the current ETag get a 304
+    snapshot = settings_store.snapshot()
+    body = snapshot.derived('status_json', lambda s: json.dumps({'status': 'ok', 'data': camera_status(s)}))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/settings', methods=['GET', 'POST'])
 def camera_settings():
     """Get or update camera settings."""
@@ -501,6 +1300,47 @@ def camera_settings():
             logger.error(f"Error getting settings: {e}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/night')
+def night_status():
+    """Report night mode state and the latest scene luminance reading"""
+    return jsonify({'status': 'ok', 'data': night_controller.status()})
+
+@app.route('/profiles')
+def list_profiles():
+    """List capture profiles and which stream each consumer is served from"""
+    profiles = dict(CAPTURE_PROFILES)
+    # A custom profile belongs to the camera using it, so list it only while active
+    if camera.profile == CUSTOM_PROFILE:
+        profiles[CUSTOM_PROFILE] = camera.profile_config
+    return jsonify({
+        'status': 'ok',
+        'data': {
+            'active': camera.profile,
+            'profiles': {
+                name: dict(profile, streams=stream_sizes(profile, camera.sensor_resolution))
+                for name, profile in profiles.items()
+            },
+            'consumers': {
+                consumer: select_stream(camera.profile_config, consumer, camera.sensor_resolution)
+                for consumer in CONSUMERS
+            }
+        }
+    })
+
+@app.route('/profile', methods=['POST'])
+def set_profile():
+    """Switch the active capture profile at runtime"""
+    data = request.get_json(silent=True) or {}
+    name = data.get('profile')
+    if name not in CAPTURE_PROFILES:
+        return jsonify({'status': 'error', 'message': f"Unknown capture profile: {name}"}), 400
+    try:
+        camera.set_profile(name)
+        return jsonify({'status': 'ok', 'data': camera.get_status()['settings']})
+    except Exception as e:
+        logger.error(f"Error switching capture profile: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/rotate', methods=['POST'])
 def rotate_camera():
     """Rotate the camera view 90 degrees clockwise."""
@@ -543,10 +1383,7 @@ def set_schedule():
         return jsonify({
             'status': 'ok',
             'message': message,
-            'settings': {
-                'interval': CAPTURE_SETTINGS['interval'],
-                'is_scheduled': CAPTURE_SETTINGS['is_scheduled']
-            }
+            'settings': schedule_settings()
         })
     except Exception as e:
         logger.error(f"Error setting schedule: {e}")
@@ -557,21 +1394,204 @@ def get_schedule_status():
     """Get current schedule settings"""
     return jsonify({
         'status': 'ok',
-        'settings': {
-            'interval': CAPTURE_SETTINGS['interval'],
-            'is_scheduled': CAPTURE_SETTINGS['is_scheduled']
-        }
+        'settings': schedule_settings()
     })
 
+@app.route('/events')
+def event_stream():
+    """Push status, schedule and new-capture changes as Server-Sent Events"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(event_bus.stream(last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/images')
 def list_images():
     """List all captured images with metadata"""
+    refresh_media_index()
     metadata = load_metadata()
+    for info in metadata.values():
+        if info.get('sha256'):
+            info['url'] = media_url(info['sha256'])
     return jsonify({
         'status': 'ok',
         'data': metadata
     })
 
+@app.route('/images/search')
+def search_images():
+    """Query captures by time, type, size, brightness, motion, day/night or similarity"""
+    args = request.args
+    try:
+        night = args.get('night')
+        if night is not None:
+            night = night.lower() in ('1', 'true', 'yes', 'night')
+        results = image_index.search(
+            start=args.get('start'),
+            end=args.get('end'),
+            capture_type=args.get('type'),
+            min_size=args.get('min_size', type=int),
+            max_size=args.get('max_size', type=int),
+            min_brightness=args.get('min_brightness', type=float),
+            max_brightness=args.get('max_brightness', type=float),
+            min_motion=args.get('min_motion', type=float),
+            max_motion=args.get('max_motion', type=float),
+            night=night,
+            similar_to=args.get('similar_to'),
+            max_distance=args.get('max_distance', 10, type=int),
+            limit=args.get('limit', 100, type=int),
+            offset=args.get('offset', 0, type=int),
+            newest_first=args.get('order', 'desc') != 'asc'
+        )
+    except KeyError as e:
+        return jsonify({'status': 'error', 'message': str(e.args[0])}), 404
+    except Exception as e:
+        logger.error(f"Error searching images: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    for result in results:
+        if result.get('sha256'):
+            result['url'] = media_url(result['sha256'])
+    return jsonify({
+        'status': 'ok',
+        'count': len(results),
+        'data': results
+    })
+
+@app.route('/detections')
+def list_detections():
+    """Recent detections, newest first, optionally for one label"""
+    label = request.args.get('label')
+    limit = request.args.get('limit', 50, type=int)
+    recent = list(detector.recent) if detector else []
+    if label:
+        recent = [r for r in recent if any(d['label'] == label for d in r['detections'])]
+    return jsonify({
+        'status': 'ok',
+        'enabled': detector is not None,
+        'pipeline': detector.status() if detector else None,
+        'triggers': detection_triggers.rules,
+        'data': recent[::-1][:max(0, limit)]
+    })
+
+@app.route('/detections/triggers', methods=['POST'])
+def set_detection_triggers():
+    """Replace the detection trigger rules"""
+    rules = (request.get_json(silent=True) or {}).get('triggers')
+    if not isinstance(rules, list):
+        return jsonify({'status': 'error', 'message': 'triggers must be a list of rules'}), 400
+    try:
+        rules = [{
+            'labels': [str(label) for label in rule['labels']],
+            'min_score': float(rule.get('min_score', 0.5)),
+            'actions': list(rule['actions']),
+            'cooldown': float(rule.get('cooldown', 60))
+        } for rule in rules]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'each rule needs labels, actions, and numeric min_score/cooldown'}), 400
+    unknown = {action for rule in rules for action in rule['actions']} - set(TRIGGER_ACTIONS)
+    if unknown:
+        return jsonify({'status': 'error', 'message': f"Unknown actions: {', '.join(sorted(unknown))}"}), 400
+
+    global detection_triggers
+    detection_triggers = TriggerRules(rules, TRIGGER_ACTIONS)
+    return jsonify({'status': 'ok', 'triggers': detection_triggers.rules})
+
+@app.route('/export')
+def export_images():
+    """Stream a zip or tar of the captures matching a catalog query"""
+    try:
+        query = normalize_query(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    # The slot is held until the whole archive has been sent
+    token = admission.acquire('export')
+    try:
+        export = ExportStream(catalog.select_entries(load_metadata(), query), query)
+    except Exception as e:
+        admission.release(token)
+        logger.error(f"Error preparing export: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    logger.info(f"Exporting {len(export.files)} images as {query['format']}")
+    filename = f"ranchpi_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{query['format']}"
+    response = Response(iter(export), mimetype=EXPORT_FORMATS[query['format']])
+    response.call_on_close(lambda: admission.release(token))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/timelapse', methods=['POST'])
+def create_timelapse():
+    """Start (or reuse) a time-lapse render over a range of the catalog"""
+    try:
+        job = timelapse_builder.submit(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except QueueFull as e:
+        API_REJECTIONS.inc(route='create_timelapse', reason='admission')
+        return retry_response(str(e), 503, TIMELAPSE_RETRY_SECONDS)
+    except Exception as e:
+        logger.error(f"Error creating time-lapse: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify({'status': 'ok', 'data': _timelapse_view(job)}), (200 if job['state'] == 'done' else 202)
+
+@app.route('/timelapse/<job_id>')
+def timelapse_status(job_id):
+    """Report progress of a time-lapse job"""
+    job = timelapse_builder.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown time-lapse job'}), 404
+    return jsonify({'status': 'ok', 'data': _timelapse_view(job)})
+
+@app.route('/timelapse/<job_id>/download')
+def download_timelapse(job_id):
+    """Download a finished time-lapse"""
+    job = timelapse_builder.get(job_id)
+    if not job or job['state'] != 'done':
+        return jsonify({'status': 'error', 'message': 'Time-lapse not ready'}), 404
+    fmt = job['params']['format']
+    output = timelapse_builder.output_path(job_id, fmt).resolve()
+    return send_file(str(output), mimetype=TIMELAPSE_FORMATS[fmt],
+                     as_attachment=True, download_name=f"timelapse_{job_id}.{fmt}")
+
+def _timelapse_view(job):
+    """Shape a time-lapse job for JSON responses"""
+    view = dict(job)
+    total = job.get('frames_total')
+    view['progress'] = (job.get('frames_done', 0) / total) if total else (1.0 if job['state'] == 'done' else 0.0)
+    if job['state'] == 'done':
+        view['download_url'] = f"/timelapse/{job['id']}/download"
+    return view
+
+@app.route('/media/<digest>.jpg')
+def serve_media(digest):
+    """Serve a stored capture by content hash with immutable caching"""
+    if not MEDIA_DIGEST_PATTERN.match(digest):
+        return jsonify({'status': 'error', 'message': 'Invalid image address'}), 404
+
+    path = _media_index.get(digest)
+    if path is None:
+        refresh_media_index()
+        path = _media_index.get(digest)
+    if path is None or not Path(path).exists():
+        return jsonify({'status': 'error', 'message': 'Image not found'}), 404
+
+    # conditional=True answers If-None-Match with 304 and Range with 206;
+    # the file body goes out through wsgi.file_wrapper (sendfile) when the
+    # server provides one
+    response = send_file(
+        str(Path(path).resolve()),
+        mimetype='image/jpeg',
+        etag=digest,
+        conditional=True,
+        max_age=MEDIA_CACHE_SECONDS
+    )
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_CACHE_SECONDS}, immutable'
+    return response
+
 @app.route('/devices')
 def list_devices():
     """List all connected devices"""
@@ -581,18 +1601,95 @@ def list_devices():
         'data': devices
     })
 
+@app.route('/sync/manifest')
+def sync_manifest():
+    """Per-month [count, hash] summaries of the catalog, where a sync starts"""
+    manifest, _ = replicator.manifest()
+    return jsonify({
+        'status': 'ok',
+        'data': {'months': manifest.months(), 'items': len(manifest), 'leaf_size': LEAF_SIZE}
+    })
+
+@app.route('/sync/ranges', methods=['POST'])
+def sync_ranges():
+    """Child summaries, or the captures themselves, for [month, prefix] ranges"""
+    data = request.get_json(silent=True) or {}
+    try:
+        ranges = [(str(month), str(prefix)) for month, prefix in data.get('ranges') or []]
+        answers = replicator.answer_ranges(ranges)
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': f"ranges must be [month, hex prefix] pairs: {e}"}), 400
+    return jsonify({'status': 'ok', 'data': answers})
+
+@app.route('/sync/entries', methods=['POST'])
+def sync_entries():
+    """Catalog entries for the keys a peer is missing"""
+    data = request.get_json(silent=True) or {}
+    keys = data.get('keys') or []
+    if not isinstance(keys, list):
+        return jsonify({'status': 'error', 'message': 'keys must be a list'}), 400
+    try:
+        entries = replicator.entries([str(key) for key in keys])
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'ok', 'data': entries})
+
+@app.route('/sync/pull', methods=['POST'])
+def sync_pull():
+    """Start copying the captures this node lacks from another node"""
+    data = request.get_json(silent=True) or {}
+    peer = data.get('peer')
+    if not isinstance(peer, str) or not peer.startswith(('http://', 'https://')):
+        return jsonify({'status': 'error', 'message': 'peer must be the http(s) base URL of another node'}), 400
+    try:
+        replicator.start(peer)
+    except SyncBusy as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    return jsonify({'status': 'ok', 'data': replicator.status()}), 202
+
+@app.route('/sync/status')
+def sync_status():
+    """Whether a pull is running and how the last one went"""
+    return jsonify({'status': 'ok', 'data': replicator.status()})
+
+@app.route('/metrics')
+def export_metrics():
+    """Expose internal metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/governor')
+def governor_status():
+    """Report resource readings, the governor level, per-class budgets and frame memory"""
+    return jsonify({'status': 'ok', 'data': dict(governor.status(), admission=admission.status(),
+                                                 frame_memory=frame_pool.status())})
+
 @app.route('/stream/status')
 def stream_status():
     """Get WebSocket stream server details"""
     return jsonify({
         'status': 'ok',
-        'stream_url': f'ws://{request.host.split(":")[0]}:6790'
+        'stream_url': f'ws://{request.host.split(":")[0]}:6790',
+        'fps': governor.decision('live')['fps']
     })
 
 # Modify main section to run both Flask and WebSocket server
 if __name__ == '__main__':
     logger.info("Starting WebSocket server and Flask application")
 
+    # Recover from an unclean shutdown, then bring the search index in line:
+    # entries recovery dropped leave it, anything not indexed yet is queued
+    image_index.backfill(recover_metadata())
+
+    # Resume the capture schedule saved by the previous run
+    saved_schedule = settings_store.snapshot()['schedule']
+    if saved_schedule['is_scheduled'] and hasattr(camera, 'start_scheduled_capture'):
+        camera.start_scheduled_capture(saved_schedule['interval'])
+
+    night_controller.start()
+    governor.start()
+    if detection_sampler:
+        detection_sampler.start()
+
     # Create event loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -602,4 +1699,4 @@ if __name__ == '__main__':
 
     # Run Flask app
     from werkzeug.serving import run_simple
-    run_simple('0.0.0.0', 5000, app, use_reloader=False, threaded=True)
\ No newline at end of file
+    run_simple('0.0.0.0', HTTP_PORT, app, use_reloader=False, threaded=True)
\ No newline at end of file
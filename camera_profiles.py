@@ -0,0 +1,142 @@
+import numpy as np
+
+# Sensor size assumed when the real one is unknown (MockCamera, HQ camera default)
+DEFAULT_SENSOR_RESOLUTION = (4056, 3040)
+
+DEFAULT_PROFILE = 'vga'
+
+# Named sensor configurations. 'main' is the full-quality output, 'lores' a
+# cheap YUV420 side stream produced by the ISP at the same time. A main size
+# of None means the full sensor resolution. 'mode' picks Picamera2's still or
+# video configuration (video keeps the frame rate up for streaming).
+CAPTURE_PROFILES = {
+    'full_still': {
+        'mode': 'still',
+        'main': None,
+        'lores': (640, 480),
+        'description': 'Full-sensor stills with a VGA preview stream'
+    },
+    'hd_stream': {
+        'mode': 'video',
+        'main': (1920, 1080),
+        'lores': (640, 360),
+        'description': '1080p main stream with a 360p side stream for live view'
+    },
+    'vga': {
+        'mode': 'still',
+        'main': (640, 480),
+        'lores': (320, 240),
+        'description': 'VGA stills, the original default'
+    },
+    'lores_analytics': {
+        'mode': 'video',
+        'main': (640, 480),
+        'lores': (160, 120),
+        'description': 'Small frames for motion and scene analysis'
+    }
+}
+
+# Name reported for a profile built by custom_profile(); never stored in
+# CAPTURE_PROFILES, so each camera keeps its own
+CUSTOM_PROFILE = 'custom'
+
+# Smallest frame each consumer can work with; None means it always wants
+# the full-quality main stream
+CONSUMERS = {
+    'still': None,
+    'scheduled': None,
+    'stream': (640, 360),
+    'thumbnail': (320, 180),
+    'detection': (320, 180),
+    'motion': (160, 120)
+}
+
+
+def resolve_profile(profile):
+    """(name, profile dict) for a profile name or a custom_profile() dict"""
+    if isinstance(profile, dict):
+        return CUSTOM_PROFILE, profile
+    if profile not in CAPTURE_PROFILES:
+        raise ValueError(f"Unknown capture profile: {profile}")
+    return profile, CAPTURE_PROFILES[profile]
+
+
+def main_size(profile, sensor_resolution=DEFAULT_SENSOR_RESOLUTION):
+    """Resolve the main stream size of a profile (a name or a profile dict)"""
+    size = resolve_profile(profile)[1]['main']
+    return tuple(size) if size else tuple(sensor_resolution)
+
+
+def stream_sizes(profile, sensor_resolution=DEFAULT_SENSOR_RESOLUTION):
+    """Return {'main': (w, h), 'lores': (w, h)} for a profile"""
+    return {
+        'main': main_size(profile, sensor_resolution),
+        'lores': tuple(resolve_profile(profile)[1]['lores'])
+    }
+
+
+def select_stream(profile, consumer, sensor_resolution=DEFAULT_SENSOR_RESOLUTION):
+    """Pick the cheapest stream of a profile that satisfies a consumer"""
+    if consumer not in CONSUMERS:
+        raise ValueError(f"Unknown consumer: {consumer}")
+    needed = CONSUMERS[consumer]
+    if needed is None:
+        return 'main'
+    sizes = stream_sizes(profile, sensor_resolution)
+    for name in sorted(sizes, key=lambda n: sizes[n][0] * sizes[n][1]):
+        width, height = sizes[name]
+        if width >= needed[0] and height >= needed[1]:
+            return name
+    return 'main'
+
+
+def custom_profile(resolution):
+    """Profile dict for an arbitrary main resolution, for set_profile()"""
+    width, height = (int(v) for v in resolution)
+    if width < 64 or height < 64:
+        raise ValueError("Resolution must be at least 64x64")
+    # Keep a ~320px wide side stream with the same aspect ratio, even-sized for YUV420
+    scale = min(1.0, 320 / width)
+    lores = (max(64, int(width * scale) // 2 * 2), max(64, int(height * scale) // 2 * 2))
+    return {
+        'mode': 'still',
+        'main': (width, height),
+        'lores': lores,
+        'description': f'Custom {width}x{height}'
+    }
+
+
+def build_configuration(picam, profile):
+    """Create a Picamera2 configuration for a profile (a name or a profile dict)"""
+    sizes = stream_sizes(profile, picam.sensor_resolution)
+    profile = resolve_profile(profile)[1]
+    create = picam.create_still_configuration if profile['mode'] == 'still' else picam.create_video_configuration
+    return create(
+        main={"size": sizes['main']},
+        lores={"size": sizes['lores']},
+        display="lores"
+    )
+
+
+def yuv420_luma(array, size):
+    """Y plane of a YUV420 lores buffer as a (height, width) uint8 array"""
+    width, height = size
+    return array[:height, :width]
+
+
+def yuv420_to_rgb(array, size):
+    """Convert a planar YUV420 lores buffer to an RGB uint8 array (BT.601)"""
+    width, height = size
+    stride = array.shape[1]
+    y = array[:height, :width].astype(np.float32)
+    # U and V are quarter-size planes packed below Y at half the row stride
+    chroma = array[height:height + height // 2].reshape(-1)
+    u = chroma[:(height // 2) * (stride // 2)].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = chroma[(height // 2) * (stride // 2):].reshape(height // 2, stride // 2)[:, :width // 2]
+    u = u.repeat(2, axis=0).repeat(2, axis=1).astype(np.float32) - 128.0
+    v = v.repeat(2, axis=0).repeat(2, axis=1).astype(np.float32) - 128.0
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = y + 1.402 * v
+    rgb[..., 1] = y - 0.344136 * u - 0.714136 * v
+    rgb[..., 2] = y + 1.772 * u
+    return np.clip(rgb, 0, 255).astype(np.uint8)
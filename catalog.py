@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Journal size at which the snapshot is rewritten and the journal dropped
+CHECKPOINT_BYTES = 256 * 1024
+
+# Names written by organize_image and store_burst
+CAPTURE_NAME = re.compile(r'^(capture|scheduled)_(\d{8}_\d{6})\.jpg$')
+BURST_NAME = re.compile(r'^burst_(\d{8}_\d{6}_\d{6})_(\d+|fused)\.jpg$')
+
+# Values of an entry's 'type'
+CAPTURE_TYPES = ('manual', 'scheduled', 'burst')
+
+
+def journal_path(metadata_file):
+    return Path(metadata_file).with_suffix('.journal')
+
+
+def scan_state_path(metadata_file):
+    return Path(metadata_file).with_suffix('.scan.json')
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data, indent=2):
+    """Replace a JSON file so readers see either the old or the new version
+
+    The data goes to a temporary file in the same directory, is fsynced,
+    renamed over the target, and the directory entry is fsynced too.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    _fsync_dir(path.parent)
+
+
+def append_journal(metadata_file, puts=None, deletes=()):
+    """Durably record catalog changes; returns the journal size in bytes"""
+    lines = [json.dumps({'op': 'put', 'path': path, 'entry': entry}) for path, entry in (puts or {}).items()]
+    lines += [json.dumps({'op': 'delete', 'path': path}) for path in deletes]
+    if not lines:
+        return 0
+    journal = journal_path(metadata_file)
+    with open(journal, 'a') as f:
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def write_snapshot(metadata_file, metadata):
+    """Atomically rewrite the snapshot and drop the journal it now contains"""
+    atomic_write_json(metadata_file, metadata)
+    journal = journal_path(metadata_file)
+    if journal.exists():
+        journal.unlink()
+        _fsync_dir(journal.parent)
+
+
+def read_snapshot(metadata_file):
+    """Load the JSON snapshot, tolerating a file truncated by a crash"""
+    metadata_file = Path(metadata_file)
+    if not metadata_file.exists():
+        return {}
+    try:
+        with open(metadata_file, 'r') as f:
+            return json.load(f)
+    except ValueError as e:
+        logger.error(f"Catalog snapshot {metadata_file} is damaged ({e}); recovering from journal and disk")
+        return {}
+
+
+def replay_journal(metadata_file, metadata):
+    """Apply journal records on top of a snapshot; a torn last line is ignored"""
+    journal = journal_path(metadata_file)
+    if not journal.exists():
+        return 0
+    applied = 0
+    with open(journal, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('op') == 'put':
+                metadata[record['path']] = record['entry']
+            elif record.get('op') == 'delete':
+                metadata.pop(record['path'], None)
+            applied += 1
+    return applied
+
+
+def load(metadata_file):
+    """Current catalog: the snapshot with the journal replayed over it"""
+    metadata = read_snapshot(metadata_file)
+    replay_journal(metadata_file, metadata)
+    return metadata
+
+
+def signature(metadata_file):
+    """Cheap value that changes whenever the catalog does"""
+    parts = []
+    for path in (Path(metadata_file), journal_path(metadata_file)):
+        try:
+            stat = path.stat()
+            parts.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            parts.append(None)
+    return tuple(parts)
+
+
+def entry_from_file(path):
+    """Rebuild a catalog entry for a stored capture from its name and stat"""
+    path = Path(path)
+    stat = path.stat()
+    entry = {'size': stat.st_size}
+    capture = CAPTURE_NAME.match(path.name)
+    burst = BURST_NAME.match(path.name)
+    timestamp = None
+    if capture:
+        entry['type'] = 'scheduled' if capture.group(1) == 'scheduled' else 'manual'
+        timestamp = datetime.strptime(capture.group(2), '%Y%m%d_%H%M%S')
+    elif burst:
+        entry['type'] = 'burst'
+        entry['burst_id'] = burst.group(1)
+        if burst.group(2) == 'fused':
+            entry['fused'] = True
+        else:
+            entry['index'] = int(burst.group(2))
+        timestamp = datetime.strptime(burst.group(1), '%Y%m%d_%H%M%S_%f')
+    else:
+        entry['type'] = 'manual'
+    if timestamp is None:
+        timestamp = datetime.fromtimestamp(stat.st_mtime)
+    entry['timestamp'] = timestamp.isoformat()
+    # Key order matches entries written at capture time
+    return {key: entry[key] for key in ('timestamp', 'type', 'size', 'burst_id', 'index', 'fused') if key in entry}
+
+
+def reconcile(metadata_file, images_root, metadata):
+    """Bring the catalog in line with the files under images_root
+
+    Only month directories whose mtime or file count changed since the last
+    scan are listed, so a restart after a clean shutdown is nearly free.
+    Returns (added, removed) path lists; metadata is updated in place.
+    """
+    images_root = Path(images_root)
+    state_file = scan_state_path(metadata_file)
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    by_dir = {}
+    for path in metadata:
+        by_dir.setdefault(str(Path(path).parent), set()).add(path)
+
+    added, removed = [], []
+    new_state = {}
+    directories = sorted(p for p in images_root.iterdir() if p.is_dir()) if images_root.exists() else []
+    for directory in directories:
+        key = str(directory)
+        known = by_dir.pop(key, set())
+        mtime = directory.stat().st_mtime_ns
+        if state.get(key) == [mtime, len(known)]:
+            new_state[key] = state[key]
+            continue
+        on_disk = {str(p) for p in directory.iterdir() if p.suffix.lower() == '.jpg' and p.is_file()}
+        for path in sorted(on_disk - known):
+            metadata[path] = entry_from_file(path)
+            added.append(path)
+        for path in sorted(known - on_disk):
+            del metadata[path]
+            removed.append(path)
+        new_state[key] = [mtime, len(on_disk)]
+
+    # Entries whose whole month directory has gone
+    for paths in by_dir.values():
+        for path in sorted(paths):
+            if str(Path(path)).startswith(str(images_root)) and not Path(path).exists():
+                del metadata[path]
+                removed.append(path)
+
+    if new_state != state:
+        atomic_write_json(state_file, new_state)
+    return added, removed
+
+
+def recover(metadata_file, images_root):
+    """Startup recovery: replay the journal, reconcile with disk, checkpoint"""
+    metadata = read_snapshot(metadata_file)
+    replayed = replay_journal(metadata_file, metadata)
+    added, removed = reconcile(metadata_file, images_root, metadata)
+    if replayed or added or removed or not Path(metadata_file).exists():
+        write_snapshot(metadata_file, metadata)
+    logger.info(f"Catalog recovered: {len(metadata)} entries, {replayed} journal records replayed, "
+                f"{len(added)} files added, {len(removed)} missing files dropped")
+    return metadata
+
+
+def parse_time(value, name):
+    """datetime for an ISO 8601 query bound, or None when it is not given"""
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+
+
+def normalize_range(params):
+    """Validate the start, end and type of a catalog query (time-lapse, export)"""
+    start = parse_time(params.get('start'), 'start')
+    end = parse_time(params.get('end'), 'end')
+    if start and end and end < start:
+        raise ValueError("end must not be before start")
+    query = {
+        'start': start.isoformat() if start else None,
+        'end': end.isoformat() if end else None,
+        'type': params.get('type') or None
+    }
+    if query['type'] not in (None,) + CAPTURE_TYPES:
+        raise ValueError("type must be 'manual', 'scheduled' or 'burst'")
+    return query
+
+
+def select_entries(metadata, query):
+    """(path, entry) pairs matching a normalize_range() query, oldest first"""
+    entries = []
+    for path, info in metadata.items():
+        timestamp = info.get('timestamp', '')
+        if query['start'] and timestamp < query['start']:
+            continue
+        if query['end'] and timestamp > query['end']:
+            continue
+        if query['type'] and info.get('type') != query['type']:
+            continue
+        entries.append((timestamp, path, info))
+    entries.sort(key=lambda item: item[:2])
+    return [(path, info) for _, path, info in entries]
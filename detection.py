@@ -0,0 +1,369 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+from PIL import Image
+
+from metrics import DETECTIONS_TOTAL, FRAMES_DROPPED_TOTAL, INFERENCE_TIME, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Frames per model invocation, and how long the first frame of a partial
+# batch may wait for company
+BATCH_SIZE = 4
+MAX_BATCH_WAIT = 0.5
+# Frames waiting for inference; the oldest are dropped beyond this
+MAX_QUEUE = 16
+# Recent detections kept in memory for /detections
+HISTORY = 200
+# Seconds between lores frames sampled from the live camera
+SAMPLE_INTERVAL_SECONDS = 2.0
+
+
+def load_labels(path):
+    """One label per line, as shipped with most detection models"""
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class StubBackend:
+    """NumPy-only detector for development and tests.
+
+    Splits the frame into a coarse grid and reports cells whose brightness
+    stands out from the frame median as an 'object'. It has no idea what
+    anything is, but exercises batching, storage and triggers end to end.
+    """
+    name = 'stub'
+    input_size = (160, 120)
+
+    def __init__(self, labels=None, threshold=60, grid=(8, 6), **options):
+        self.labels = labels or ['object']
+        self.threshold = threshold
+        self.grid = grid
+
+    def infer(self, batch):
+        columns, rows = self.grid
+        luma = batch.astype(np.float32).mean(axis=3)
+        count, height, width = luma.shape
+        cells = luma[:, :height // rows * rows, :width // columns * columns]
+        cells = cells.reshape(count, rows, height // rows, columns, width // columns).mean(axis=(2, 4))
+        results = []
+        for frame_cells in cells:
+            deviation = np.abs(frame_cells - np.median(frame_cells))
+            detections = []
+            for row, column in zip(*np.nonzero(deviation > self.threshold)):
+                detections.append({
+                    'label': self.labels[0],
+                    'score': round(float(min(1.0, deviation[row, column] / 255.0 + 0.5)), 3),
+                    'box': [round(v, 3) for v in (column / columns, row / rows, (column + 1) / columns, (row + 1) / rows)]
+                })
+            results.append(detections)
+        return results
+
+
+def _ssd_results(boxes, classes, scores, labels, threshold):
+    """Turn SSD-style post-processed outputs into detection dicts"""
+    results = []
+    for frame_boxes, frame_classes, frame_scores in zip(boxes, classes, scores):
+        detections = []
+        for box, cls, score in zip(frame_boxes, frame_classes, frame_scores):
+            if score < threshold:
+                continue
+            cls = int(cls)
+            # Boxes come as normalized (ymin, xmin, ymax, xmax)
+            ymin, xmin, ymax, xmax = (round(float(np.clip(v, 0.0, 1.0)), 3) for v in box)
+            detections.append({
+                'label': labels[cls] if 0 <= cls < len(labels) else str(cls),
+                'score': round(float(score), 3),
+                'box': [xmin, ymin, xmax, ymax]
+            })
+        results.append(detections)
+    return results
+
+
+class OnnxBackend:
+    """ONNX Runtime backend for SSD-style models with post-processed outputs
+
+    The model takes a uint8 NHWC batch (or float32 if its input says so) and
+    returns boxes, classes and scores; output_names picks them by name when
+    the model's own order differs.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path, labels, input_size=(300, 300), score_threshold=0.5,
+                 output_names=None, threads=2, **options):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(model_path), session_options,
+                                                    providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.float_input = 'float' in model_input.type
+        self.output_names = output_names or [output.name for output in self.session.get_outputs()[:3]]
+        self.input_size = tuple(input_size)
+        self.labels = labels
+        self.score_threshold = score_threshold
+
+    def infer(self, batch):
+        feed = batch.astype(np.float32) / 255.0 if self.float_input else batch
+        boxes, classes, scores = self.session.run(self.output_names, {self.input_name: feed})
+        return _ssd_results(boxes, classes, scores, self.labels, self.score_threshold)
+
+
+class TFLiteBackend:
+    """TensorFlow Lite backend for SSD models using the detection post-process op"""
+    name = 'tflite'
+
+    def __init__(self, model_path, labels, score_threshold=0.5, threads=2, **options):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.outputs = self.interpreter.get_output_details()
+        _, height, width, _ = self.input['shape']
+        self.input_size = (int(width), int(height))
+        self.batch_capacity = 1
+        self.labels = labels
+        self.score_threshold = score_threshold
+
+    def _resize(self, count):
+        """Grow the input tensor to the batch size; not every model allows it"""
+        if count == self.batch_capacity:
+            return True
+        try:
+            self.interpreter.resize_tensor_input(self.input['index'], [count, self.input_size[1], self.input_size[0], 3])
+            self.interpreter.allocate_tensors()
+            self.outputs = self.interpreter.get_output_details()
+            self.batch_capacity = count
+            return True
+        except (RuntimeError, ValueError):
+            return False
+
+    def _run(self, batch):
+        feed = batch if self.input['dtype'] == np.uint8 else (batch.astype(np.float32) / 127.5 - 1.0)
+        self.interpreter.set_tensor(self.input['index'], feed.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        boxes, classes, scores = (self.interpreter.get_tensor(self.outputs[i]['index']) for i in range(3))
+        return _ssd_results(boxes, classes, scores, self.labels, self.score_threshold)
+
+    def infer(self, batch):
+        if self._resize(len(batch)):
+            return self._run(batch)
+        # Fixed batch-1 model: still amortizes queueing and preprocessing
+        self._resize(1)
+        return [self._run(frame[None])[0] for frame in batch]
+
+
+BACKENDS = {
+    'stub': StubBackend,
+    'onnx': OnnxBackend,
+    'tflite': TFLiteBackend
+}
+
+
+def load_backend(name, model_path=None, labels_path=None, **options):
+    """Build a backend by name; model backends need a model and label file"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detection backend: {name}")
+    if name == 'stub':
+        return StubBackend(**options)
+    if not model_path:
+        raise ValueError(f"The {name} backend needs a model file")
+    labels = load_labels(labels_path) if labels_path else []
+    return BACKENDS[name](model_path, labels, **options)
+
+
+class TriggerRules:
+    """Map detections to actions with a per-rule cooldown
+
+    Each rule is {'labels', 'min_score', 'actions', 'cooldown'}; actions name
+    callables in the actions dict and are called as action(item, detection).
+    Frames that came from a stored capture only raise actions listed in
+    capture_safe, so a triggered capture cannot trigger itself again.
+    """
+    def __init__(self, rules, actions, capture_safe=('alert',)):
+        self.rules = [dict(rule) for rule in rules]
+        self.actions = actions
+        self.capture_safe = set(capture_safe)
+        self._last_fired = {}
+
+    def evaluate(self, item, detections):
+        fired = []
+        now = time.monotonic()
+        for index, rule in enumerate(self.rules):
+            matches = [d for d in detections
+                       if d['label'] in rule['labels'] and d['score'] >= rule.get('min_score', 0.5)]
+            if not matches:
+                continue
+            if now - self._last_fired.get(index, float('-inf')) < rule.get('cooldown', 60):
+                continue
+            self._last_fired[index] = now
+            best = max(matches, key=lambda d: d['score'])
+            for action in rule['actions']:
+                if item['source'] == 'capture' and action not in self.capture_safe:
+                    continue
+                try:
+                    self.actions[action](item, best)
+                    fired.append(action)
+                except Exception as e:
+                    logger.error(f"Detection action {action} failed: {e}")
+        return fired
+
+
+class DetectionPipeline:
+    """Batch frames through a detection backend on a background thread.
+
+    submit() never blocks: when the queue is full the oldest frame is dropped,
+    since a fresh frame is worth more than a stale one. on_result is called
+    with (item, detections) for every processed frame. Inference runs inside
+    gate(), so a busy governor holds batches back and the queue sheds frames.
+    """
+    def __init__(self, backend, on_result=None, batch_size=BATCH_SIZE,
+                 max_queue=MAX_QUEUE, max_wait=MAX_BATCH_WAIT, gate=None):
+        self.backend = backend
+        self.on_result = on_result
+        self.gate = gate or nullcontext
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = deque(maxlen=max_queue)
+        self._condition = threading.Condition()
+        self._thread = None
+        self.recent = deque(maxlen=HISTORY)
+        self.processed = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def submit(self, source, array=None, path=None, entry=None):
+        """Queue a lores frame (array) or a stored capture (path and its catalog entry)"""
+        item = {'source': source, 'array': array, 'path': str(path) if path else None,
+                'entry': entry, 'time': time.time()}
+        with self._condition:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                FRAMES_DROPPED_TOTAL.inc(role='detection', peer='queue')
+            self._queue.append(item)
+            QUEUE_DEPTH.set(len(self._queue), queue='detection')
+            self._condition.notify()
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_loop, daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            # Give a partial batch a moment to fill up before running it
+            deadline = self._queue[0]['time'] + self.max_wait
+            while len(self._queue) < self.batch_size and time.time() < deadline:
+                self._condition.wait(deadline - time.time())
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            QUEUE_DEPTH.set(len(self._queue), queue='detection')
+            return batch
+
+    def _prepare(self, item):
+        size = self.backend.input_size
+        if item['array'] is not None:
+            img = Image.fromarray(item['array']).convert('RGB')
+        else:
+            with Image.open(item['path']) as stored:
+                # Decode the JPEG at reduced scale; the model needs few pixels
+                stored.draft('RGB', size)
+                img = stored.convert('RGB')
+        return np.asarray(img.resize(size, Image.BILINEAR), dtype=np.uint8)
+
+    def _worker_loop(self):
+        while True:
+            batch = self._next_batch()
+            frames, items = [], []
+            for item in batch:
+                try:
+                    frames.append(self._prepare(item))
+                    items.append(item)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable frame for detection: {e}")
+            if not frames:
+                continue
+            try:
+                with self.gate(), INFERENCE_TIME.time(backend=self.backend.name):
+                    results = self.backend.infer(np.stack(frames))
+            except Exception as e:
+                logger.error(f"Detection backend {self.backend.name} failed: {e}")
+                continue
+            self.batches += 1
+            for item, detections in zip(items, results):
+                self.processed += 1
+                item.pop('array', None)
+                for detection in detections:
+                    DETECTIONS_TOTAL.inc(label=detection['label'])
+                if detections:
+                    self.recent.append({'source': item['source'], 'path': item['path'],
+                                        'time': item['time'], 'detections': detections})
+                if self.on_result:
+                    try:
+                        self.on_result(item, detections)
+                    except Exception as e:
+                        logger.error(f"Error handling detections: {e}")
+
+    def status(self):
+        with self._condition:
+            queued = len(self._queue)
+        return {
+            'backend': self.backend.name,
+            'input_size': list(self.backend.input_size),
+            'batch_size': self.batch_size,
+            'queued': queued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'batches': self.batches
+        }
+
+
+class FrameSampler:
+    """Feed lores frames from grab() into a pipeline every interval seconds
+
+    should_sample() is consulted before each grab so callers can pause
+    sampling, e.g. while the resource governor has no headroom.
+    """
+    def __init__(self, grab, pipeline, interval=SAMPLE_INTERVAL_SECONDS, should_sample=None):
+        self.grab = grab
+        self.pipeline = pipeline
+        self.interval = interval
+        self.should_sample = should_sample
+        self.skipped = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.should_sample and not self.should_sample():
+                self.skipped += 1
+                continue
+            try:
+                self.pipeline.submit('lores', array=self.grab())
+            except Exception as e:
+                logger.error(f"Detection sampling failed: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from collections import deque
+
+from metrics import QUEUE_DEPTH
+
+# Seconds between SSE comment lines that keep idle proxies from closing the stream
+KEEPALIVE_SECONDS = 15
+
+
+class EventBus:
+    """In-process change feed served to browsers as Server-Sent Events.
+
+    Event ids are "<epoch>:<sequence>". The epoch changes on every restart, so a
+    client resuming with an id from a previous process, or one that has fallen
+    out of the replay buffer, is sent a 'reset' event telling it to refetch.
+    """
+    def __init__(self, history=256):
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._events = deque(maxlen=history)
+        self._sequence = 0
+        self._last_payload = {}
+        self._condition = threading.Condition()
+        self._subscribers = 0
+
+    def publish(self, event_type, data, only_if_changed=False):
+        """Record an event and wake every waiting stream"""
+        payload = json.dumps(data, sort_keys=True, default=str)
+        with self._condition:
+            if only_if_changed and self._last_payload.get(event_type) == payload:
+                return None
+            self._last_payload[event_type] = payload
+            self._sequence += 1
+            self._events.append((self._sequence, event_type, payload))
+            self._condition.notify_all()
+            return self._sequence
+
+    def _parse_id(self, last_event_id):
+        """Return the sequence to resume after, or None if replay is impossible"""
+        if not last_event_id:
+            return self._sequence
+        epoch, _, sequence = last_event_id.partition(':')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        oldest = self._events[0][0] if self._events else self._sequence + 1
+        if sequence > self._sequence or sequence < oldest - 1:
+            return None
+        return sequence
+
+    def _format(self, sequence, event_type, payload):
+        return f"id: {self.epoch}:{sequence}\nevent: {event_type}\ndata: {payload}\n\n"
+
+    def stream(self, last_event_id=None, keepalive=KEEPALIVE_SECONDS):
+        """Generate SSE text for one client, replaying anything it missed"""
+        with self._condition:
+            position = self._parse_id(last_event_id)
+            reset = position is None
+            if reset:
+                position = self._sequence
+            self._subscribers += 1
+            QUEUE_DEPTH.set(self._subscribers, queue='event_subscribers')
+        try:
+            # Tell EventSource to wait 3s before reconnecting after a drop
+            yield "retry: 3000\n\n"
+            if reset:
+                yield self._format(position, 'reset', '{}')
+            while True:
+                with self._condition:
+                    if self._sequence == position:
+                        self._condition.wait(keepalive)
+                    pending = [event for event in self._events if event[0] > position]
+                if not pending:
+                    yield ": keep-alive\n\n"
+                    continue
+                for sequence, event_type, payload in pending:
+                    position = sequence
+                    yield self._format(sequence, event_type, payload)
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+                QUEUE_DEPTH.set(self._subscribers, queue='event_subscribers')
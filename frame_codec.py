@@ -0,0 +1,180 @@
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+# Tiles are compared and sent on this grid (a multiple of the 8px JPEG block)
+TILE_SIZE = 32
+# Frames between periodic keyframes, so a lost delta is repaired eventually
+KEYFRAME_INTERVAL = 60
+# Mean absolute luma difference (0-255) at which a tile counts as changed;
+# above sensor noise and JPEG ringing, below a cow walking through
+CHANGE_THRESHOLD = 6.0
+# Small sharp changes (a clock, a distant animal) barely move a tile's mean,
+# so a tile also counts as changed once this many pixels moved this far
+PIXEL_THRESHOLD = 40
+MIN_CHANGED_PIXELS = 8
+# Past this share of changed tiles a keyframe costs less than the tiles
+MAX_DELTA_FRACTION = 0.6
+TILE_QUALITY = 75
+
+
+def encode_jpeg(array, quality=TILE_QUALITY, target=None):
+    """JPEG bytes for an RGB array, or written into target (a file-like such as a pooled buffer)"""
+    # Optimized Huffman tables shrink link JPEGs by a fifth or more, more
+    # than deflating them afterwards would, for one extra pass
+    buffer = target if target is not None else io.BytesIO()
+    Image.fromarray(array).save(buffer, format='JPEG', quality=quality, optimize=True)
+    return target if target is not None else buffer.getvalue()
+
+
+def decode_jpeg(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert('RGB'))
+
+
+def _luma(array):
+    """Integer Rec. 601 luma, enough to spot changes"""
+    rgb = array.astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.int16)
+
+
+def changed_tiles(reference, frame, tile=TILE_SIZE, threshold=CHANGE_THRESHOLD):
+    """Boolean (rows, columns) mask of tiles that differ visibly from the reference"""
+    diff = np.abs(_luma(frame) - _luma(reference))
+    height, width = diff.shape
+    rows, columns = -(-height // tile), -(-width // tile)
+    padding = ((0, rows * tile - height), (0, columns * tile - width))
+
+    def per_tile(values):
+        return np.pad(values, padding).reshape(rows, tile, columns, tile).sum(axis=(1, 3), dtype=np.int64)
+
+    # Edge tiles are partial; average over the pixels they really have
+    means = per_tile(diff) / per_tile(np.ones_like(diff))
+    return (means > threshold) | (per_tile(diff > PIXEL_THRESHOLD) >= MIN_CHANGED_PIXELS)
+
+
+def tile_runs(mask, tile, width, height):
+    """Merge horizontally adjacent changed tiles into (x, y, w, h) rectangles
+
+    One JPEG per run instead of per tile saves repeating the JPEG headers.
+    """
+    runs = []
+    for row, cells in enumerate(mask):
+        column = 0
+        while column < len(cells):
+            if not cells[column]:
+                column += 1
+                continue
+            start = column
+            while column < len(cells) and cells[column]:
+                column += 1
+            x, y = start * tile, row * tile
+            runs.append((x, y, min(column * tile, width) - x, min(tile, height - y)))
+    return runs
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def split_blobs(message):
+    """Separate a codec message into a JSON-safe skeleton and its JPEG bytes"""
+    if message['kind'] == 'key':
+        return {k: v for k, v in message.items() if k != 'jpeg'}, [message['jpeg']]
+    return dict(message, tiles=[[x, y] for x, y, _ in message['tiles']]), [data for _, _, data in message['tiles']]
+
+
+def join_blobs(skeleton, blobs, transform=None):
+    """Inverse of split_blobs, optionally transforming each JPEG"""
+    transform = transform or (lambda data: data)
+    if skeleton['kind'] == 'key':
+        return dict(skeleton, jpeg=transform(blobs[0]))
+    return dict(skeleton, tiles=[[x, y, transform(data)] for (x, y), data in zip(skeleton['tiles'], blobs)])
+
+
+def to_json(message):
+    """The message with its JPEGs base64-encoded, for JSON transport and viewers"""
+    return join_blobs(*split_blobs(message), transform=_b64)
+
+
+class TileEncoder:
+    """Encode a frame sequence as keyframes plus changed-tile deltas.
+
+    Tiles are compared against what the receiver was last sent for that
+    spot, not the previous frame, so slow drifts (clouds, dusk) still get
+    sent once they add up. encode() returns None when nothing changed;
+    JPEGs in the returned message are bytes (see to_json).
+    """
+    def __init__(self, tile=TILE_SIZE, keyframe_interval=KEYFRAME_INTERVAL,
+                 threshold=CHANGE_THRESHOLD, quality=TILE_QUALITY):
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.threshold = threshold
+        self.quality = quality
+        self.reference = None
+        self.seq = 0
+        self.key_seq = None
+        self._since_key = 0
+        self._force = True
+        self.stats = {'keyframes': 0, 'deltas': 0, 'skipped': 0, 'tiles': 0}
+
+    def force_keyframe(self):
+        """Send a keyframe next, e.g. when a new subscriber joins"""
+        self._force = True
+
+    def _keyframe(self, frame, quality):
+        self.reference = frame.copy()
+        self.key_seq = self.seq
+        self._since_key = 0
+        self._force = False
+        self.stats['keyframes'] += 1
+        height, width = frame.shape[:2]
+        return {'kind': 'key', 'seq': self.seq, 'key': self.seq, 'width': width, 'height': height,
+                'jpeg': encode_jpeg(frame, quality)}
+
+    def encode(self, frame, quality=None):
+        quality = quality or self.quality
+        self.seq += 1
+        if (self._force or self.reference is None or frame.shape != self.reference.shape
+                or self._since_key >= self.keyframe_interval):
+            return self._keyframe(frame, quality)
+
+        mask = changed_tiles(self.reference, frame, self.tile, self.threshold)
+        if mask.mean() > MAX_DELTA_FRACTION:
+            return self._keyframe(frame, quality)
+        self._since_key += 1
+        if not mask.any():
+            self.stats['skipped'] += 1
+            return None
+
+        height, width = frame.shape[:2]
+        tiles = []
+        for x, y, w, h in tile_runs(mask, self.tile, width, height):
+            region = frame[y:y + h, x:x + w]
+            tiles.append([x, y, encode_jpeg(np.ascontiguousarray(region), quality)])
+            self.reference[y:y + h, x:x + w] = region
+        self.stats['deltas'] += 1
+        self.stats['tiles'] += int(mask.sum())
+        return {'kind': 'delta', 'seq': self.seq, 'key': self.key_seq, 'tiles': tiles}
+
+
+class TileDecoder:
+    """Composite keyframes and deltas back into full frames"""
+    def __init__(self):
+        self.frame = None
+        self.key_seq = None
+
+    def apply(self, message):
+        """Return the updated frame, or None while waiting for a keyframe"""
+        if message['kind'] == 'key':
+            self.frame = decode_jpeg(message['jpeg']).copy()
+            self.key_seq = message['key']
+            return self.frame
+        if self.frame is None or message['key'] != self.key_seq:
+            return None
+        for x, y, data in message['tiles']:
+            region = decode_jpeg(data)
+            self.frame[y:y + region.shape[0], x:x + region.shape[1]] = region
+        return self.frame
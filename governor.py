@@ -0,0 +1,290 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import CPU_LOAD, GOVERNOR_LEVEL, SOC_TEMPERATURE
+
+logger = logging.getLogger(__name__)
+
+# Highest priority first: scheduled captures are never degraded, live
+# viewing is reduced next, thumbnails/indexing/time-lapse/sync go first
+PRIORITY_CLASSES = ('scheduled', 'live', 'background')
+
+LEVELS = ('normal', 'constrained', 'critical')
+
+# Thresholds for entering each level
+CONSTRAINED_TEMPERATURE = 70.0
+CRITICAL_TEMPERATURE = 80.0
+CONSTRAINED_LOAD = 0.85
+CRITICAL_LOAD = 0.97
+CONSTRAINED_BATTERY = 40
+CRITICAL_BATTERY = 15
+
+# Calmer readings in a row before stepping back down one level
+RELAX_READINGS = 3
+
+POLL_SECONDS = 5
+
+# What each priority class gets at each level
+POLICIES = {
+    'normal': {
+        'scheduled': {'allowed': True, 'jpeg_quality': 95},
+        'live': {'fps': 10, 'jpeg_quality': 85},
+        'background': {'concurrency': os.cpu_count() or 1, 'sync_interval_seconds': 300}
+    },
+    'constrained': {
+        'scheduled': {'allowed': True, 'jpeg_quality': 95},
+        'live': {'fps': 5, 'jpeg_quality': 75},
+        'background': {'concurrency': 1, 'sync_interval_seconds': 1800}
+    },
+    'critical': {
+        'scheduled': {'allowed': True, 'jpeg_quality': 90},
+        'live': {'fps': 1, 'jpeg_quality': 60},
+        # Background work waits and sync is deferred until things recover
+        'background': {'concurrency': 0, 'sync_interval_seconds': None}
+    }
+}
+
+# Bits of the firmware's get_throttled value
+THROTTLE_FLAGS = {
+    'under_voltage': 0x1,
+    'frequency_capped': 0x2,
+    'throttled': 0x4,
+    'soft_temperature_limit': 0x8
+}
+
+
+class GateTimeout(Exception):
+    """Raised by Governor.gate when no slot frees up within the timeout"""
+
+
+class SystemSensors:
+    """Read load, SoC temperature, throttling and battery state from procfs/sysfs
+
+    root defaults to '/', but can point at a directory tree laid out the same
+    way so tests and development machines can fake any condition.
+    """
+    THERMAL_ZONE = 'sys/class/thermal/thermal_zone0/temp'
+    THROTTLED = 'sys/devices/platform/soc/soc:firmware/get_throttled'
+    POWER_SUPPLY = 'sys/class/power_supply'
+
+    def __init__(self, root='/'):
+        self.root = Path(root)
+        self._last_cpu = None
+
+    def _read(self, relative):
+        try:
+            return (self.root / relative).read_text().strip()
+        except OSError:
+            return None
+
+    def cpu_load(self):
+        """CPU utilization 0-1 since the previous call, from /proc/stat"""
+        text = self._read('proc/stat')
+        if text:
+            fields = [int(v) for v in text.splitlines()[0].split()[1:]]
+            idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+            total = sum(fields)
+            previous, self._last_cpu = self._last_cpu, (idle, total)
+            if previous and total > previous[1]:
+                return 1.0 - (idle - previous[0]) / (total - previous[1])
+        # First sample (or no /proc/stat): fall back to the 1-minute load average
+        loadavg = self._read('proc/loadavg')
+        if loadavg:
+            return min(1.0, float(loadavg.split()[0]) / (os.cpu_count() or 1))
+        return None
+
+    def temperature(self):
+        """SoC temperature in degrees Celsius"""
+        value = self._read(self.THERMAL_ZONE)
+        return int(value) / 1000.0 if value else None
+
+    def throttle_state(self):
+        """Decoded firmware throttle flags (current conditions only)"""
+        value = self._read(self.THROTTLED)
+        if value is None:
+            return None
+        raw = int(value, 16)
+        state = {name: bool(raw & bit) for name, bit in THROTTLE_FLAGS.items()}
+        state['raw'] = value
+        return state
+
+    def battery(self):
+        """Charge of the first battery-type power supply, e.g. a UPS or solar HAT"""
+        supplies = self.root / self.POWER_SUPPLY
+        if not supplies.is_dir():
+            return None
+        for supply in sorted(supplies.iterdir()):
+            if self._read(supply / 'type') != 'Battery':
+                continue
+            capacity = self._read(supply / 'capacity')
+            return {
+                'capacity': int(capacity) if capacity else None,
+                'discharging': self._read(supply / 'status') == 'Discharging'
+            }
+        return None
+
+    def read(self):
+        return {
+            'cpu_load': self.cpu_load(),
+            'temperature': self.temperature(),
+            'throttle': self.throttle_state(),
+            'battery': self.battery(),
+            'time': time.time()
+        }
+
+
+def classify(readings):
+    """Return (level, reasons) for one set of sensor readings"""
+    critical, constrained = [], []
+    temperature = readings.get('temperature')
+    if temperature is not None:
+        if temperature >= CRITICAL_TEMPERATURE:
+            critical.append(f"temperature {temperature:.1f}C")
+        elif temperature >= CONSTRAINED_TEMPERATURE:
+            constrained.append(f"temperature {temperature:.1f}C")
+    load = readings.get('cpu_load')
+    if load is not None:
+        if load >= CRITICAL_LOAD:
+            critical.append(f"cpu load {load:.2f}")
+        elif load >= CONSTRAINED_LOAD:
+            constrained.append(f"cpu load {load:.2f}")
+    throttle = readings.get('throttle') or {}
+    if throttle.get('under_voltage'):
+        critical.append("under-voltage")
+    for flag in ('frequency_capped', 'throttled', 'soft_temperature_limit'):
+        if throttle.get(flag):
+            constrained.append(flag.replace('_', ' '))
+    battery = readings.get('battery') or {}
+    if battery.get('discharging') and battery.get('capacity') is not None:
+        if battery['capacity'] <= CRITICAL_BATTERY:
+            critical.append(f"battery {battery['capacity']}%")
+        elif battery['capacity'] <= CONSTRAINED_BATTERY:
+            constrained.append(f"battery {battery['capacity']}%")
+    if critical:
+        return 'critical', critical + constrained
+    if constrained:
+        return 'constrained', constrained
+    return 'normal', []
+
+
+class Governor:
+    """Turn sensor readings into per-priority-class budgets.
+
+    Levels go up immediately and come down one step at a time after
+    RELAX_READINGS calmer readings. Background work takes a slot from
+    gate('background'), which blocks while the level allows no background
+    concurrency.
+    """
+    def __init__(self, sensors=None, on_change=None, interval=POLL_SECONDS):
+        self.sensors = sensors or SystemSensors()
+        self.on_change = on_change
+        self.interval = interval
+        self.level = 'normal'
+        self.reasons = []
+        self.readings = {}
+        self._calm = 0
+        self._running = {cls: 0 for cls in PRIORITY_CLASSES}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def decision(self, priority_class):
+        return dict(POLICIES[self.level][priority_class])
+
+    def jpeg_quality(self, priority_class):
+        return POLICIES[self.level][priority_class]['jpeg_quality']
+
+    def update(self, readings=None):
+        """Read the sensors (or use readings) and pick a level; returns True on change"""
+        readings = readings if readings is not None else self.sensors.read()
+        level, reasons = classify(readings)
+        with self._condition:
+            self.readings = readings
+            current = LEVELS.index(self.level)
+            target = LEVELS.index(level)
+            if target > current:
+                self._calm = 0
+            elif target < current:
+                self._calm += 1
+                if self._calm >= RELAX_READINGS:
+                    self._calm = 0
+                    target = current - 1
+                else:
+                    target = current
+            else:
+                self._calm = 0
+            changed = target != current
+            self.level = LEVELS[target]
+            self.reasons = reasons
+            # Waiting background work may be allowed to run now
+            self._condition.notify_all()
+
+        if readings.get('cpu_load') is not None:
+            CPU_LOAD.set(readings['cpu_load'])
+        if readings.get('temperature') is not None:
+            SOC_TEMPERATURE.set(readings['temperature'])
+        GOVERNOR_LEVEL.set(target)
+        if changed:
+            logger.info(f"Governor level {self.level}: {', '.join(reasons) or 'recovered'}")
+            if self.on_change:
+                self.on_change(self.status())
+        return changed
+
+    @contextmanager
+    def gate(self, priority_class='background', timeout=None):
+        """Hold a concurrency slot for the class, waiting while none are free
+
+        Yields the class's current concurrency so callers can size pools.
+        A critical level allows no background work at all, so callers that
+        must not wait indefinitely pass a timeout and get GateTimeout.
+        """
+        if priority_class != 'background':
+            yield None
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while self._running[priority_class] >= POLICIES[self.level][priority_class]['concurrency']:
+                wait = self.interval
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        raise GateTimeout(f"No {priority_class} slot within {timeout}s (governor {self.level})")
+                self._condition.wait(wait)
+            self._running[priority_class] += 1
+            limit = POLICIES[self.level][priority_class]['concurrency']
+        try:
+            yield limit
+        finally:
+            with self._condition:
+                self._running[priority_class] -= 1
+                self._condition.notify_all()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"Governor update failed: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        with self._condition:
+            return {
+                'level': self.level,
+                'reasons': list(self.reasons),
+                'readings': self.readings,
+                'running': dict(self._running),
+                'decisions': {cls: self.decision(cls) for cls in PRIORITY_CLASSES}
+            }
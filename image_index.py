@@ -0,0 +1,272 @@
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Size of the luma thumbnail kept per capture for motion scoring
+THUMB_SIZE = (32, 24)
+
+# Mean luma (0-255) below which a frame is treated as night
+NIGHT_BRIGHTNESS = 50
+# Near-greyscale frames this dark are IR night shots even with IR lighting
+IR_CHROMA = 2.0
+IR_BRIGHTNESS = 110
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT,
+    timestamp TEXT NOT NULL,
+    type TEXT,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER,
+    brightness REAL,
+    motion REAL,
+    is_night INTEGER,
+    phash INTEGER,
+    thumb BLOB
+);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures(timestamp);
+CREATE INDEX IF NOT EXISTS captures_type_timestamp ON captures(type, timestamp);
+CREATE INDEX IF NOT EXISTS captures_sha256 ON captures(sha256);
+"""
+
+RESULT_COLUMNS = ('path', 'sha256', 'timestamp', 'type', 'size', 'width', 'height',
+                  'brightness', 'motion', 'is_night', 'phash')
+
+MAX_RESULTS = 1000
+
+
+def _to_signed(value):
+    """Store a 64-bit hash in SQLite's signed INTEGER"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def difference_hash(luma):
+    """64-bit dHash of a 2D luma array: compares horizontally adjacent pixels"""
+    small = np.asarray(Image.fromarray(luma).resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def compute_features(path):
+    """Decode a stored JPEG at reduced scale and derive its search features"""
+    with Image.open(path) as img:
+        width, height = img.size
+        # Let libjpeg decode at 1/2..1/8 scale; features need very few pixels
+        img.draft('RGB', (THUMB_SIZE[0] * 4, THUMB_SIZE[1] * 4))
+        small = img.convert('RGB').resize((64, 48), Image.BILINEAR)
+    rgb = np.asarray(small, dtype=np.float32)
+    luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    brightness = float(luma.mean())
+    chroma = float(np.abs(rgb - rgb.mean(axis=2, keepdims=True)).mean())
+    luma8 = np.clip(luma, 0, 255).astype(np.uint8)
+    thumb = np.asarray(Image.fromarray(luma8).resize(THUMB_SIZE, Image.BILINEAR), dtype=np.uint8)
+    return {
+        'width': width,
+        'height': height,
+        'brightness': brightness,
+        'is_night': brightness < NIGHT_BRIGHTNESS or (chroma < IR_CHROMA and brightness < IR_BRIGHTNESS),
+        'phash': difference_hash(luma8),
+        'thumb': thumb.tobytes()
+    }
+
+
+def motion_score(thumb, previous_thumb):
+    """Mean absolute luma change between two thumbnails, 0 (static) to 1"""
+    if thumb is None or previous_thumb is None:
+        return None
+    a = np.frombuffer(thumb, dtype=np.uint8).astype(np.int16)
+    b = np.frombuffer(previous_thumb, dtype=np.uint8).astype(np.int16)
+    if a.shape != b.shape:
+        return None
+    return float(np.abs(a - b).mean() / 255.0)
+
+
+class ImageIndex:
+    """Feature index over the capture catalog, backed by SQLite.
+
+    Features are computed once per capture in a small background pool and
+    written through a single connection. Perceptual hashes are mirrored in a
+    NumPy array so similarity queries are a vectorised XOR + popcount.
+    """
+    def __init__(self, db_path, workers=2, gate=None):
+        self.db_path = Path(db_path)
+        # Optional context manager factory held while features are computed
+        self.gate = gate or nullcontext
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-index')
+        self._hash_paths = []
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._hashes_dirty = True
+
+    def submit(self, path, entry):
+        """Queue a newly stored capture for feature extraction"""
+        return self._pool.submit(self._ingest, str(path), dict(entry))
+
+    def backfill(self, metadata):
+        """Queue catalog entries that are not indexed yet; returns how many
+
+        Indexed captures the catalog no longer has (dropped by recovery or
+        deleted) are removed, so searches stop returning them.
+        """
+        with self._lock:
+            indexed = {row[0] for row in self._db.execute('SELECT path FROM captures')}
+        stale = indexed.difference(metadata)
+        if stale:
+            self.remove(stale)
+            logger.info(f"Removed {len(stale)} captures no longer in the catalog from the index")
+        missing = [(path, entry) for path, entry in metadata.items() if path not in indexed]
+        for path, entry in missing:
+            self.submit(path, entry)
+        if missing:
+            logger.info(f"Indexing {len(missing)} captures in the background")
+        return len(missing)
+
+    def remove(self, paths):
+        """Forget captures that left the catalog"""
+        with self._lock:
+            self._db.executemany('DELETE FROM captures WHERE path = ?', [(str(p),) for p in paths])
+            self._db.commit()
+            self._hashes_dirty = True
+
+    def _ingest(self, path, entry):
+        try:
+            with self.gate():
+                features = compute_features(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not index {path}: {e}")
+            return None
+        self.add(path, entry, features)
+        return features
+
+    def add(self, path, entry, features):
+        """Write precomputed features for a capture and rescore its neighbour"""
+        timestamp = entry.get('timestamp', '')
+        with self._lock:
+            previous = self._db.execute(
+                'SELECT thumb FROM captures WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1',
+                (timestamp,)).fetchone()
+            following = self._db.execute(
+                'SELECT path, thumb FROM captures WHERE timestamp > ? ORDER BY timestamp ASC LIMIT 1',
+                (timestamp,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO captures '
+                '(path, sha256, timestamp, type, size, width, height, brightness, motion, is_night, phash, thumb) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, entry.get('sha256'), timestamp, entry.get('type'), entry.get('size'),
+                 features['width'], features['height'], features['brightness'],
+                 motion_score(features['thumb'], previous['thumb'] if previous else None),
+                 int(features['is_night']), _to_signed(features['phash']), features['thumb']))
+            # A backfilled frame changes the motion score of the one after it
+            if following:
+                self._db.execute('UPDATE captures SET motion = ? WHERE path = ?',
+                                 (motion_score(following['thumb'], features['thumb']), following['path']))
+            self._db.commit()
+            self._hashes_dirty = True
+
+    def _hash_table(self):
+        with self._lock:
+            if self._hashes_dirty:
+                rows = self._db.execute('SELECT path, phash FROM captures WHERE phash IS NOT NULL').fetchall()
+                self._hash_paths = [row[0] for row in rows]
+                self._hashes = np.array([_to_unsigned(row[1]) for row in rows], dtype=np.uint64)
+                self._hashes_dirty = False
+            return self._hash_paths, self._hashes
+
+    def lookup_hash(self, reference):
+        """Perceptual hash of a capture given its sha256 or stored path"""
+        with self._lock:
+            row = self._db.execute('SELECT phash FROM captures WHERE sha256 = ? OR path = ? LIMIT 1',
+                                   (reference, reference)).fetchone()
+        return _to_unsigned(row[0]) if row else None
+
+    def similar(self, phash, max_distance):
+        """Return [(path, distance)] within max_distance bits, closest first"""
+        paths, hashes = self._hash_table()
+        if not paths:
+            return []
+        distances = np.bitwise_count(hashes ^ np.uint64(phash))
+        matches = np.nonzero(distances <= max_distance)[0]
+        order = matches[np.argsort(distances[matches], kind='stable')]
+        return [(paths[i], int(distances[i])) for i in order]
+
+    def search(self, start=None, end=None, capture_type=None, min_size=None, max_size=None,
+               min_brightness=None, max_brightness=None, min_motion=None, max_motion=None,
+               night=None, similar_to=None, max_distance=10, limit=100, offset=0, newest_first=True):
+        """Query captures by time, type, size and derived features"""
+        clauses = []
+        params = []
+        for column, op, value in (
+            ('timestamp', '>=', start), ('timestamp', '<=', end), ('type', '=', capture_type),
+            ('size', '>=', min_size), ('size', '<=', max_size),
+            ('brightness', '>=', min_brightness), ('brightness', '<=', max_brightness),
+            ('motion', '>=', min_motion), ('motion', '<=', max_motion)
+        ):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if night is not None:
+            clauses.append('is_night = ?')
+            params.append(int(bool(night)))
+        limit = max(1, min(int(limit), MAX_RESULTS))
+        columns = ', '.join(RESULT_COLUMNS)
+
+        if similar_to is not None:
+            phash = self.lookup_hash(similar_to)
+            if phash is None:
+                raise KeyError(f"No indexed capture matches {similar_to}")
+            candidates = self.similar(phash, max_distance)
+            # Page over the filtered matches, as OFFSET does on the normal path
+            offset = max(0, int(offset))
+            results = []
+            # Apply the remaining filters to candidates in distance order
+            for chunk_start in range(0, len(candidates), 500):
+                chunk = dict(candidates[chunk_start:chunk_start + 500])
+                where = ' AND '.join(clauses + [f"path IN ({','.join('?' * len(chunk))})"])
+                with self._lock:
+                    rows = self._db.execute(f"SELECT {columns} FROM captures WHERE {where}",
+                                            params + list(chunk)).fetchall()
+                found = {row['path']: self._row(row, distance=chunk[row['path']]) for row in rows}
+                results.extend(found[path] for path in chunk if path in found)
+                if len(results) >= offset + limit:
+                    break
+            return results[offset:offset + limit]
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        order = 'DESC' if newest_first else 'ASC'
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {columns} FROM captures {where} ORDER BY timestamp {order} LIMIT ? OFFSET ?",
+                params + [limit, int(offset)]).fetchall()
+        return [self._row(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM captures').fetchone()[0]
+
+    def _row(self, row, distance=None):
+        result = {column: row[column] for column in RESULT_COLUMNS}
+        result['phash'] = format(_to_unsigned(row['phash']), '016x') if row['phash'] is not None else None
+        result['is_night'] = bool(row['is_night'])
+        if distance is not None:
+            result['distance'] = distance
+        return result
@@ -0,0 +1,178 @@
+import numpy as np
+
+# 5-tap binomial kernel used for the Gaussian/Laplacian pyramids
+_KERNEL = np.array([1, 4, 6, 4, 1], dtype=np.float32) / 16.0
+
+
+def _blur(image):
+    """Separable 5-tap blur with edge padding, for 2D or 3D float arrays"""
+    pad = [(2, 2), (2, 2)] + [(0, 0)] * (image.ndim - 2)
+    padded = np.pad(image, pad, mode='edge')
+    rows = sum(_KERNEL[i] * padded[i:i + image.shape[0]] for i in range(5))
+    return sum(_KERNEL[i] * rows[:, i:i + image.shape[1]] for i in range(5))
+
+
+def _downsample(image):
+    return _blur(image)[::2, ::2]
+
+
+def _upsample(image, shape):
+    up = image.repeat(2, axis=0).repeat(2, axis=1)[:shape[0], :shape[1]]
+    return _blur(up)
+
+
+def _gaussian_pyramid(image, levels):
+    pyramid = [image]
+    for _ in range(levels - 1):
+        pyramid.append(_downsample(pyramid[-1]))
+    return pyramid
+
+
+def _laplacian_pyramid(image, levels):
+    gaussian = _gaussian_pyramid(image, levels)
+    pyramid = [
+        gaussian[i] - _upsample(gaussian[i + 1], gaussian[i].shape)
+        for i in range(levels - 1)
+    ]
+    pyramid.append(gaussian[-1])
+    return pyramid
+
+
+def exposure_fusion(frames, contrast_weight=1.0, saturation_weight=1.0, exposure_weight=1.0, sigma=0.2):
+    """Merge an exposure-bracketed burst into one image (Mertens et al.)
+
+    frames is a sequence of equally sized RGB uint8 arrays. Each pixel is
+    weighted by local contrast, colour saturation and how close it is to
+    mid-grey, and the weighted frames are blended across a Laplacian pyramid
+    so the transitions between exposures do not show seams.
+    """
+    images = [np.asarray(frame, dtype=np.float32) / 255.0 for frame in frames]
+    if not images:
+        raise ValueError("exposure_fusion needs at least one frame")
+    if len(images) == 1:
+        return np.asarray(frames[0], dtype=np.uint8)
+    shape = images[0].shape
+    if any(image.shape != shape for image in images):
+        raise ValueError("All bracketed frames must have the same shape")
+
+    weights = []
+    for image in images:
+        grey = image.mean(axis=2)
+        # Absolute discrete Laplacian as the contrast measure
+        padded = np.pad(grey, 1, mode='edge')
+        laplacian = np.abs(
+            padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:] - 4 * grey
+        )
+        saturation = image.std(axis=2)
+        exposedness = np.exp(-((image - 0.5) ** 2) / (2 * sigma ** 2)).prod(axis=2)
+        weights.append(
+            (laplacian ** contrast_weight)
+            * (saturation ** saturation_weight)
+            * (exposedness ** exposure_weight)
+            + 1e-12
+        )
+    total = sum(weights)
+    weights = [w / total for w in weights]
+
+    levels = max(1, int(np.log2(min(shape[0], shape[1]))) - 3)
+    blended = None
+    for image, weight in zip(images, weights):
+        image_pyramid = _laplacian_pyramid(image, levels)
+        weight_pyramid = _gaussian_pyramid(weight, levels)
+        contribution = [lap * w[..., None] for lap, w in zip(image_pyramid, weight_pyramid)]
+        blended = contribution if blended is None else [b + c for b, c in zip(blended, contribution)]
+
+    # Collapse the pyramid back into a single image
+    result = blended[-1]
+    for level in reversed(blended[:-1]):
+        result = level + _upsample(result, level.shape)
+    return np.clip(result * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+# Frames are aligned on a luma copy no larger than this on its short side
+ALIGN_SIZE = 256
+# Rows processed at a time when stacking, bounding temporary memory
+STACK_STRIP_ROWS = 64
+
+
+def _luma_thumbnail(frame):
+    """Block-averaged float32 luma of an RGB frame, and the scale factor used"""
+    frame = np.asarray(frame)
+    factor = max(1, min(frame.shape[0], frame.shape[1]) // ALIGN_SIZE)
+    height = frame.shape[0] // factor * factor
+    width = frame.shape[1] // factor * factor
+    luma = frame[:height, :width].astype(np.float32).mean(axis=2) if frame.ndim == 3 else frame[:height, :width].astype(np.float32)
+    return luma.reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3)), factor
+
+
+def estimate_shift(reference, image, max_shift=0.1):
+    """Translation (dy, dx) that moves image onto reference, by phase correlation
+
+    Both arguments are 2D float arrays of the same shape. Shifts larger than
+    max_shift of the frame size are treated as unreliable and return (0, 0).
+    """
+    spectrum = np.fft.rfft2(reference - reference.mean()) * np.conj(np.fft.rfft2(image - image.mean()))
+    spectrum /= np.abs(spectrum) + 1e-9
+    correlation = np.fft.irfft2(spectrum, s=reference.shape)
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    height, width = reference.shape
+    dy = dy - height if dy > height // 2 else dy
+    dx = dx - width if dx > width // 2 else dx
+    if abs(dy) > height * max_shift or abs(dx) > width * max_shift:
+        return 0, 0
+    return int(dy), int(dx)
+
+
+def _shift_slices(shift, length):
+    """(destination, source) slices that move one axis by shift pixels"""
+    if shift >= 0:
+        return slice(shift, length), slice(0, length - shift)
+    return slice(0, length + shift), slice(-shift, length)
+
+
+def stack_frames(frames, method='mean', align=True):
+    """Combine a burst of noisy low-light frames into one cleaner frame
+
+    Each frame is registered to the first by a global translation (camera
+    shake, wind) and the aligned frames are averaged, or median-combined to
+    also reject transient outliers such as insects or headlights. Pixels a
+    shifted frame does not cover are filled from the reference. Work is done
+    in horizontal strips so memory stays near the size of the input burst.
+    """
+    if method not in ('mean', 'median'):
+        raise ValueError("method must be 'mean' or 'median'")
+    frames = [np.asarray(frame) for frame in frames]
+    if not frames:
+        raise ValueError("stack_frames needs at least one frame")
+    reference = frames[0]
+    if any(frame.shape != reference.shape for frame in frames):
+        raise ValueError("All stacked frames must have the same shape")
+    if len(frames) == 1:
+        return reference.astype(np.uint8)
+
+    shifts = [(0, 0)] * len(frames)
+    if align:
+        reference_luma, factor = _luma_thumbnail(reference)
+        shifts = [(0, 0)] + [
+            tuple(v * factor for v in estimate_shift(reference_luma, _luma_thumbnail(frame)[0]))
+            for frame in frames[1:]
+        ]
+
+    height, width = reference.shape[:2]
+    result = np.empty(reference.shape, dtype=np.uint8)
+    for top in range(0, height, STACK_STRIP_ROWS):
+        bottom = min(height, top + STACK_STRIP_ROWS)
+        strips = []
+        for frame, (dy, dx) in zip(frames, shifts):
+            strip = reference[top:bottom].copy()
+            low, high = max(top, dy), min(bottom, height + dy)
+            if low < high:
+                columns, source_columns = _shift_slices(dx, width)
+                strip[low - top:high - top, columns] = frame[low - dy:high - dy, source_columns]
+            strips.append(strip)
+        if method == 'mean':
+            combined = np.add.reduce([s.astype(np.float32) for s in strips]) / len(strips)
+        else:
+            combined = np.median(np.stack(strips), axis=0)
+        result[top:bottom] = np.clip(combined + 0.5, 0, 255)
+    return result
@@ -0,0 +1,288 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, tuned for a Raspberry Pi: sub-millisecond
+# socket sends up to multi-second full-sensor captures
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    """Render a Prometheus label set such as {device="pi1",le="0.5"}"""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra)
+    if not pairs:
+        return ''
+    rendered = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + rendered + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for labelled metrics"""
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Drop a label set, e.g. when a viewer disconnects"""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}"
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. a queue depth"""
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        """Return a copy of the series as {'counts', 'sum', 'count'}"""
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            if series is None:
+                return {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            return {'counts': list(series['counts']), 'sum': series['sum'], 'count': series['count']}
+
+    def _render_samples(self, items):
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together by /metrics"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Capture and storage path
+CAPTURE_LATENCY = REGISTRY.histogram(
+    'ranchpi_capture_latency_seconds',
+    'End-to-end latency of a still capture including storage',
+    ['type'])
+ENCODE_TIME = REGISTRY.histogram(
+    'ranchpi_encode_seconds',
+    'Time spent capturing and encoding a frame to JPEG',
+    ['source'])
+DISK_WRITE_TIME = REGISTRY.histogram(
+    'ranchpi_disk_write_seconds',
+    'Time spent writing a capture into the storage tree')
+METADATA_COMMIT_TIME = REGISTRY.histogram(
+    'ranchpi_metadata_commit_seconds',
+    'Time spent persisting the image metadata catalog')
+CAPTURES_TOTAL = REGISTRY.counter(
+    'ranchpi_captures_total',
+    'Stored captures',
+    ['type'])
+CAPTURE_BYTES_TOTAL = REGISTRY.counter(
+    'ranchpi_capture_bytes_total',
+    'Bytes written to the storage tree',
+    ['type'])
+
+# WebSocket relay
+WS_SEND_LATENCY = REGISTRY.histogram(
+    'ranchpi_websocket_send_seconds',
+    'Latency of a single WebSocket send to a viewer')
+QUEUE_DEPTH = REGISTRY.gauge(
+    'ranchpi_queue_depth',
+    'Current depth of internal queues and connection sets',
+    ['queue'])
+FRAMES_TOTAL = REGISTRY.counter(
+    'ranchpi_frames_total',
+    'Frames received from devices or delivered to viewers',
+    ['role', 'peer'])
+FRAMES_DROPPED_TOTAL = REGISTRY.counter(
+    'ranchpi_frames_dropped_total',
+    'Frames discarded before delivery',
+    ['role', 'peer'])
+BYTES_TOTAL = REGISTRY.counter(
+    'ranchpi_bytes_total',
+    'Payload bytes received from devices or sent to viewers',
+    ['role', 'peer'])
+CONTROL_BYTES_TOTAL = REGISTRY.counter(
+    'ranchpi_control_bytes_total',
+    'Bytes of device control messages (handshake, info, heartbeats, requests) on the wire',
+    ['direction', 'format'])
+
+
+def forget_peer(role, peer):
+    """Remove the per-connection series of a peer that went away"""
+    for metric in (FRAMES_TOTAL, FRAMES_DROPPED_TOTAL, BYTES_TOTAL):
+        metric.remove(role=role, peer=peer)
+
+# Resource governor
+CPU_LOAD = REGISTRY.gauge(
+    'ranchpi_cpu_load_ratio',
+    'CPU utilization seen by the resource governor, 0-1')
+SOC_TEMPERATURE = REGISTRY.gauge(
+    'ranchpi_soc_temperature_celsius',
+    'SoC temperature seen by the resource governor')
+GOVERNOR_LEVEL = REGISTRY.gauge(
+    'ranchpi_governor_level',
+    'Resource governor level: 0 normal, 1 constrained, 2 critical')
+
+# Object detection
+INFERENCE_TIME = REGISTRY.histogram(
+    'ranchpi_inference_seconds',
+    'Time spent running one batch through the detection backend',
+    ['backend'])
+DETECTIONS_TOTAL = REGISTRY.counter(
+    'ranchpi_detections_total',
+    'Objects reported by the detection backend',
+    ['label'])
+
+# HTTP API protection
+API_REJECTIONS = REGISTRY.counter(
+    'ranchpi_http_rejections_total',
+    'Requests refused by rate limiting or admission control',
+    ['route', 'reason'])
+
+# Archive replication between nodes
+SYNC_BYTES_TOTAL = REGISTRY.counter(
+    'ranchpi_sync_bytes_total',
+    'Bytes received from peers while replicating, range summaries versus image data',
+    ['kind'])
+SYNC_ITEMS_TOTAL = REGISTRY.counter(
+    'ranchpi_sync_items_total',
+    'Captures copied from peers')
+
+# Frame memory
+FRAME_MEMORY_BYTES = REGISTRY.gauge(
+    'ranchpi_frame_memory_bytes',
+    'Frame buffer memory: in flight (counted against the budget) or idle in the pool',
+    ['state'])
@@ -6,7 +6,13 @@ import time
 import websockets
 import asyncio
 import json
+import base64
 from pathlib import Path
+from frame_codec import TileEncoder, encode_jpeg, split_blobs, to_json
+from protocol import HANDSHAKE_TIMEOUT, LEGACY_VERSION, PROTOCOL_VERSION, ControlCodec, frame_header, hello, pack_frame
+from buffers import BudgetExceeded, frame_budget, frame_pool
+from camera_profiles import CONSUMERS
+from governor import Governor
 
 # Configure logging
 logging.basicConfig(
@@ -15,8 +21,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How live frames go to the relay on each link: full JPEGs where bandwidth
+# is cheap, keyframes plus changed tiles over cellular
+STREAM_CODECS = {
+    'ethernet': 'jpeg',
+    'wifi': 'jpeg',
+    'cellular': 'tiles'
+}
+# Live rate and quality when no governor is given; with one they follow
+# its 'live' policy, so a hot or low-battery board streams less
+STREAM_FPS = 2
+STREAM_QUALITY = 85
+HEARTBEAT_SECONDS = 5
+
 class NetworkManager:
-    def __init__(self):
+    def __init__(self, frame_source=None, governor=None):
         self.connection_types = {
             'ethernet': {'priority': 1, 'interface': 'eth0'},
             'wifi': {'priority': 2, 'interface': 'wlan0'},
@@ -25,6 +44,15 @@ class NetworkManager:
         self.current_connection = None
         self.device_id = self._get_device_id()
         self.ws_connection = None
+        # Optional callable returning the current RGB frame to stream live
+        self.frame_source = frame_source
+        self.governor = governor
+        self.encoder = TileEncoder()
+        # Negotiated per connection; None means the version 1 JSON protocol
+        self.codec = None
+        self.relay_version = None
+        # Close started after a heartbeat or stream task failed (see _task_done)
+        self._closing = None
         
     def _get_device_id(self):
         """Generate or retrieve unique device ID"""
@@ -83,65 +111,195 @@ class NetworkManager:
                     logger.info(f"Switching to {connection_type} connection")
                     self.current_connection = connection_type
 
-                # Connect to WebSocket server
-                async with websockets.connect(server_url) as websocket:
+                # Connect to WebSocket server. Protocol version 2 compresses only
+                # control messages, so permessage-deflate (which would also
+                # recompress every JPEG) is offered only to version 1 relays
+                compression = 'deflate' if self.relay_version == LEGACY_VERSION else None
+                async with websockets.connect(server_url, compression=compression) as websocket:
                     self.ws_connection = websocket
                     logger.info(f"Connected to server via {connection_type}")
-                    
+                    self.codec = await self.negotiate(websocket)
+                    self.relay_version = PROTOCOL_VERSION if self.codec else LEGACY_VERSION
+
                     # Send initial device info
-                    await websocket.send(json.dumps({
+                    await self.send_control(websocket, {
                         'type': 'device_info',
                         'device_id': self.device_id,
                         'connection_type': connection_type
-                    }))
-
-                    # Handle WebSocket communication
-                    while True:
-                        try:
-                            # Send heartbeat
-                            await websocket.send(json.dumps({
-                                'type': 'heartbeat',
-                                'device_id': self.device_id,
-                                'connection_type': connection_type
-                            }))
-                            
-                            # Wait for commands
-                            message = await websocket.recv()
+                    })
+
+                    # The relay starts from nothing on a new connection
+                    self.encoder.force_keyframe()
+
+                    # Heartbeats and frames go out while commands come in
+                    tasks = [asyncio.create_task(self.send_heartbeats(websocket, connection_type))]
+                    if self.frame_source:
+                        tasks.append(asyncio.create_task(self.stream_frames(websocket, connection_type)))
+                    for task in tasks:
+                        task.add_done_callback(lambda task: self._task_done(task, websocket))
+                    try:
+                        async for message in websocket:
                             await self.handle_message(message)
-                            
-                            await asyncio.sleep(5)  # Heartbeat interval
-                            
-                        except websockets.exceptions.ConnectionClosed:
-                            logger.warning("WebSocket connection closed")
-                            break
+                    except websockets.exceptions.ConnectionClosed:
+                        pass
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+                    logger.warning("WebSocket connection closed")
 
             except Exception as e:
                 logger.error(f"Connection error: {e}")
                 await asyncio.sleep(10)  # Wait before retry
                 continue
 
+    def _task_done(self, task, websocket):
+        """Log a heartbeat or stream task that died and drop the connection, so it is re-established"""
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None or isinstance(error, websockets.exceptions.ConnectionClosed):
+            return
+        logger.error(f"{task.get_coro().__name__} failed, reconnecting: {error!r}")
+        # Closing ends the command loop in connect_to_server, which reconnects
+        self._closing = asyncio.ensure_future(websocket.close())
+
+    async def negotiate(self, websocket):
+        """Offer protocol version 2; returns the control codec, or None for version 1"""
+        await websocket.send(json.dumps(hello(self.device_id)))
+        try:
+            reply = await asyncio.wait_for(websocket.recv(), HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Older relays ignore the hello
+            logger.info("No protocol handshake from server, using version 1 JSON messages")
+            return None
+        data = json.loads(reply)
+        if data.get('type') != 'welcome':
+            await self.handle_message(reply)
+            return None
+        codec = ControlCodec.from_welcome(data)
+        logger.info(f"Negotiated protocol v{data['version']} ({codec.name if codec else 'json'})")
+        return codec
+
+    async def send_control(self, websocket, message):
+        """Send a control message in the negotiated format"""
+        await websocket.send(self.codec.encode(message) if self.codec else json.dumps(message))
+
+    async def send_heartbeats(self, websocket, connection_type):
+        """Tell the relay this device is alive every HEARTBEAT_SECONDS"""
+        while True:
+            await self.send_control(websocket, {
+                'type': 'heartbeat',
+                'device_id': self.device_id,
+                'connection_type': connection_type
+            })
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def stream_frames(self, websocket, connection_type):
+        """Send live frames, as full JPEGs or tile deltas depending on the link"""
+        codec = STREAM_CODECS.get(connection_type, 'jpeg')
+        logger.info(f"Streaming {codec} frames over {connection_type}")
+        while True:
+            frame = await asyncio.to_thread(self.frame_source)
+            try:
+                if codec == 'tiles':
+                    await self.send_tiles(websocket, frame)
+                else:
+                    await self.send_jpeg(websocket, frame)
+            except BudgetExceeded:
+                logger.debug("Frame memory budget in use, skipping a frame")
+            await asyncio.sleep(1.0 / self.stream_fps())
+
+    def stream_fps(self):
+        """Live frame rate, from the governor's live policy when there is one"""
+        return self.governor.decision('live')['fps'] if self.governor else STREAM_FPS
+
+    def stream_quality(self):
+        """Live JPEG quality, from the governor's live policy when there is one"""
+        return self.governor.jpeg_quality('live') if self.governor else STREAM_QUALITY
+
+    async def send_tiles(self, websocket, frame):
+        """Encode a frame as changed tiles and send it, held against the frame budget"""
+        encoded = await asyncio.to_thread(self.encoder.encode, frame)
+        # Nothing changed: nothing to send
+        if not encoded:
+            return
+        header = {'type': 'camera_tiles', 'device_id': self.device_id}
+        if self.codec:
+            skeleton, blobs = split_blobs(encoded)
+            data = pack_frame(dict(header, frame=skeleton), blobs)
+        else:
+            data = json.dumps(dict(header, frame=to_json(encoded)))
+        try:
+            frame_budget.reserve(len(data))
+        except BudgetExceeded:
+            # Later deltas build on this one, so start over from a keyframe
+            self.encoder.force_keyframe()
+            raise
+        try:
+            await websocket.send(data)
+        finally:
+            frame_budget.release(len(data))
+
+    async def send_jpeg(self, websocket, frame):
+        """Encode a frame into a pooled buffer and send it from there
+
+        With protocol v2 the container header goes into the buffer's
+        headroom, so the JPEG is never copied between encode and send.
+        """
+        header = {'type': 'camera_frame', 'device_id': self.device_id}
+        with frame_pool.acquire() as buffer:
+            await asyncio.to_thread(encode_jpeg, frame, self.stream_quality(), buffer)
+            if self.codec:
+                buffer.prepend(frame_header(header, [len(buffer)]))
+                await websocket.send(buffer.view())
+            else:
+                await websocket.send(json.dumps(dict(header, frame_data=base64.b64encode(buffer.view()).decode('utf-8'))))
+
     async def handle_message(self, message):
         """Handle incoming messages from server"""
         try:
-            data = json.loads(message)
+            data = self.codec.decode(message) if isinstance(message, bytes) else json.loads(message)
             if data.get('type') == 'capture_request':
                 # Handle capture request
                 logger.info("Received capture request")
                 # TODO: Implement capture logic
                 pass
+            elif data.get('type') == 'keyframe_request':
+                # A viewer joined the relay; resend the whole picture
+                self.encoder.force_keyframe()
             elif data.get('type') == 'status_request':
                 # Send status update
-                await self.ws_connection.send(json.dumps({
+                await self.send_control(self.ws_connection, {
                     'type': 'status_response',
                     'device_id': self.device_id,
                     'connection_type': self.current_connection,
                     'timestamp': time.time()
-                }))
+                })
         except Exception as e:
             logger.error(f"Error handling message: {e}")
 
+def camera_frame_source():
+    """Start the Pi camera for live streaming and return its frame callable
+
+    Returns None when picamera2 or the camera is unavailable, in which case
+    the manager keeps the connection up with heartbeats only.
+    """
+    try:
+        from picamera2 import Picamera2
+
+        picam = Picamera2()
+        picam.configure(picam.create_video_configuration(main={'size': CONSUMERS['stream']}))
+        picam.start()
+    except Exception as e:
+        logger.warning(f"Camera unavailable, connecting without a live stream: {e}")
+        return None
+    # The default XBGR8888 format reads back as RGBX; drop the padding byte
+    return lambda: picam.capture_array('main')[..., :3]
+
 async def main():
-    manager = NetworkManager()
+    governor = Governor()
+    governor.start()
+    manager = NetworkManager(frame_source=camera_frame_source(), governor=governor)
     server_url = "wss://your-replit-server/ws"  # Replace with actual server URL
     await manager.connect_to_server(server_url)
 
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MODES = ('auto', 'on', 'off')
+
+# Scene brightness is the mean lores luma scaled to this exposure at unity
+# gain, so it keeps falling at dusk after auto exposure has maxed out
+REFERENCE_EXPOSURE_US = 10_000
+
+# Night exposure: long shutter plus analogue gain
+NIGHT_EXPOSURE_US = 500_000
+NIGHT_ANALOGUE_GAIN = 8.0
+
+# Hysteresis thresholds on that normalized brightness (0-255 scale). The
+# night exposure is 400x the reference, so these read as lores luma ~120
+# and ~200 once night mode is on
+ENTER_NIGHT_LUMA = 0.3
+EXIT_NIGHT_LUMA = 0.5
+
+# Lores luma at which the night exposure is clipping and understates the
+# scene; treated as bright enough to leave night mode
+SATURATED_LUMA = 200
+
+# Readings in a row that must agree before switching, so headlights or a
+# passing cloud do not flip the mode
+SWITCH_READINGS = 3
+
+METER_INTERVAL_SECONDS = 20
+
+# Frames combined per scheduled night capture, and how
+STACK_FRAMES = 6
+STACK_METHOD = 'mean'
+
+# CPU seconds per stacked frame (default VGA profile) a Pi 4 core can afford
+# between scheduled captures; benchmarks/bench_processing.py reports against it
+STACK_CPU_BUDGET_PER_FRAME = 0.15
+
+
+def scene_luma(reading):
+    """Normalize a meter reading {'luma', 'exposure', 'gain'} to the reference exposure"""
+    exposure = max(1, reading.get('exposure') or REFERENCE_EXPOSURE_US)
+    gain = max(1.0, reading.get('gain') or 1.0)
+    return reading['luma'] * REFERENCE_EXPOSURE_US / (exposure * gain)
+
+
+class NightModeController:
+    """Switch the camera between day and night exposure from lores luminance.
+
+    The camera's 'night_mode' setting is 'auto', 'on' or 'off'; the result is
+    mirrored in its 'night_active' setting, so switches reach listeners
+    through the settings store like any other change.
+    """
+    def __init__(self, camera, interval=METER_INTERVAL_SECONDS):
+        self.camera = camera
+        self.interval = interval
+        self.last_luma = None
+        self.last_reading = None
+        self._streak = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def active(self):
+        return bool(self.camera.settings.get('night_active'))
+
+    def desired(self, luma, saturated=False):
+        """Whether night mode should be on after a reading, with hysteresis"""
+        mode = self.camera.settings.get('night_mode', 'auto')
+        if mode != 'auto':
+            self._streak = 0
+            return mode == 'on'
+        if luma is None:
+            return self.active
+        crossing = luma < ENTER_NIGHT_LUMA if not self.active else (saturated or luma > EXIT_NIGHT_LUMA)
+        self._streak = self._streak + 1 if crossing else 0
+        if self._streak >= SWITCH_READINGS:
+            self._streak = 0
+            return not self.active
+        return self.active
+
+    def tick(self):
+        """Take one meter reading and switch modes if needed"""
+        with self._lock:
+            luma = None
+            saturated = False
+            if self.camera.settings.get('night_mode', 'auto') == 'auto':
+                self.last_reading = self.camera.meter()
+                luma = self.last_luma = scene_luma(self.last_reading)
+                saturated = self.last_reading['luma'] >= SATURATED_LUMA
+            target = self.desired(luma, saturated)
+            if target == self.active:
+                return False
+            self.camera.set_night_mode(target)
+        logger.info(f"Night mode {'on' if target else 'off'} (scene luma {luma})")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Night mode metering failed: {e}")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'mode': self.camera.settings.get('night_mode', 'auto'),
+            'active': self.active,
+            'scene_luma': self.last_luma,
+            'reading': self.last_reading,
+            'enter_below': ENTER_NIGHT_LUMA,
+            'exit_above': EXIT_NIGHT_LUMA,
+            'stack_frames': STACK_FRAMES,
+            'stack_method': STACK_METHOD
+        }
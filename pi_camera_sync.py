@@ -5,12 +5,39 @@ import time
 from datetime import datetime
 from pathlib import Path
 from git_utils import GitOperations
+from governor import Governor
+
+# Time of the last successful push, so runs between pushes only capture
+LAST_SYNC_FILE = '.last_sync'
 
 class PiCameraSync:
     def __init__(self):
         self.git_ops = GitOperations()
         self.image_dir = Path("captured_images")
         self.image_dir.mkdir(exist_ok=True)
+        self.last_sync_file = self.image_dir / LAST_SYNC_FILE
+
+    def last_sync(self):
+        try:
+            return float(self.last_sync_file.read_text())
+        except (OSError, ValueError):
+            return 0.0
+
+    def sync_due(self, governor):
+        """Whether to push now: never while critical, else once per the governor's sync interval
+
+        Constrained devices get a longer interval, so captures pile up and
+        go out in fewer, larger pushes.
+        """
+        interval = governor.decision('background')['sync_interval_seconds']
+        if interval is None:
+            print(f"Deferring sync ({governor.level}: {', '.join(governor.reasons)})")
+            return False
+        waited = time.time() - self.last_sync()
+        if waited < interval:
+            print(f"Next sync in {int(interval - waited)}s ({governor.level})")
+            return False
+        return True
         
     def capture_and_sync(self):
         try:
@@ -30,10 +57,17 @@ class PiCameraSync:
             camera.capture_file(str(image_path))
             print(f"Image captured: {image_path}")
             
+            # Sync is lowest priority: keep the capture, push on a later run
+            governor = Governor()
+            governor.update()
+            if not self.sync_due(governor):
+                return str(image_path)
+
             # Git operations
             commit_message = f"Add camera capture from {timestamp}"
             self.git_ops.git_pull()  # Ensure we're up to date
             self.git_ops.git_push(commit_message)
+            self.last_sync_file.write_text(str(time.time()))
             print("Successfully pushed to GitHub")
             
             return str(image_path)
@@ -0,0 +1,163 @@
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Version 1 is the original protocol: every message is a JSON text frame.
+# Version 2 adds a hello/welcome handshake after which control messages
+# (device_info, heartbeat, status and keyframe requests) travel as binary
+# frames in the negotiated encoding, and camera frames as binary containers
+# of raw JPEG bytes (see pack_frame) instead of base64 inside JSON.
+LEGACY_VERSION = 1
+PROTOCOL_VERSION = 2
+SUPPORTED_VERSIONS = (LEGACY_VERSION, PROTOCOL_VERSION)
+
+# Preferred first; msgpack only when installed on both ends
+ENCODINGS = ('msgpack', 'json') if msgpack else ('json',)
+COMPRESSIONS = ('zlib',)
+
+# Seconds a device waits for a welcome before assuming a version 1 relay
+HANDSHAKE_TIMEOUT = 3.0
+
+# First byte of every binary message
+FLAG_MSGPACK = 0x01
+FLAG_ZLIB = 0x02
+# Camera frame container: raw JPEG bytes, never compressed or base64-encoded
+FLAG_FRAME = 0x80
+
+# Control messages are tiny and repetitive: deflate runs as one stream per
+# connection (like permessage-deflate with context takeover) and is primed
+# with typical messages so even the first heartbeat compresses. The samples
+# are part of protocol version 2; changing them needs a new version.
+COMPRESSION_LEVEL = 9
+COMPRESSION_WINDOW_BITS = 12
+DICTIONARY_SAMPLES = (
+    {'type': 'device_info', 'device_id': '', 'connection_type': 'cellular'},
+    {'type': 'status_response', 'device_id': '', 'connection_type': 'wifi', 'timestamp': 0.0},
+    {'type': 'keyframe_request'},
+    {'type': 'heartbeat', 'device_id': '', 'connection_type': 'ethernet'}
+)
+
+
+def _serialize(message, encoding):
+    if encoding == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+
+def _deserialize(data, encoding):
+    if encoding == 'msgpack':
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def is_frame(data):
+    return bool(data) and data[0] == FLAG_FRAME
+
+
+def pack_frame(header, blobs):
+    """Binary camera frame: a small JSON header followed by the JPEGs as-is
+
+    JPEG does not compress further, so the payload skips deflate entirely
+    and avoids base64's third more bytes.
+    """
+    return frame_header(header, [len(blob) for blob in blobs]) + b''.join(blobs)
+
+
+def frame_header(header, sizes):
+    """The pack_frame prefix for blobs of the given sizes
+
+    Lets a sender put the prefix in front of a JPEG already encoded into
+    a pooled buffer instead of joining copies of both.
+    """
+    head = json.dumps(dict(header, sizes=sizes), separators=(',', ':')).encode('utf-8')
+    return bytes([FLAG_FRAME]) + len(head).to_bytes(2, 'big') + head
+
+
+def unpack_frame(data):
+    """Return (header, blobs) from pack_frame output
+
+    Blobs are memoryviews into data rather than copies.
+    """
+    data = memoryview(data)
+    length = int.from_bytes(data[1:3], 'big')
+    header = json.loads(bytes(data[3:3 + length]))
+    blobs = []
+    offset = 3 + length
+    for size in header.pop('sizes'):
+        blobs.append(data[offset:offset + size])
+        offset += size
+    if offset != len(data):
+        raise ValueError("Frame container sizes do not match its length")
+    return header, blobs
+
+
+def hello(device_id=None):
+    """What a device offers when it connects"""
+    return {
+        'type': 'hello',
+        'device_id': device_id,
+        'versions': list(SUPPORTED_VERSIONS),
+        'encodings': list(ENCODINGS),
+        'compression': list(COMPRESSIONS)
+    }
+
+
+def negotiate(offer):
+    """Pick the settings for a connection from a device's hello; returns the welcome"""
+    versions = set(offer.get('versions') or [LEGACY_VERSION]) & set(SUPPORTED_VERSIONS)
+    version = max(versions) if versions else LEGACY_VERSION
+    welcome = {'type': 'welcome', 'version': version, 'encoding': 'json', 'compression': None}
+    if version >= PROTOCOL_VERSION:
+        offered = offer.get('encodings') or []
+        welcome['encoding'] = next((e for e in ENCODINGS if e in offered), 'json')
+        welcome['compression'] = next((c for c in COMPRESSIONS if c in (offer.get('compression') or [])), None)
+    return welcome
+
+
+class ControlCodec:
+    """Encode and decode one connection's control messages as negotiated.
+
+    Each side keeps one codec per connection: the deflate streams carry
+    state from message to message, so messages must be decoded in order.
+    """
+    def __init__(self, encoding='json', compression=None):
+        if encoding == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack encoding requested but msgpack is not installed")
+        self.encoding = encoding
+        self.compression = compression
+        self.flags = (FLAG_MSGPACK if encoding == 'msgpack' else 0) | (FLAG_ZLIB if compression else 0)
+        if compression:
+            dictionary = b''.join(_serialize(sample, encoding) for sample in DICTIONARY_SAMPLES)
+            self._compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -COMPRESSION_WINDOW_BITS,
+                                                zdict=dictionary)
+            self._decompressor = zlib.decompressobj(-COMPRESSION_WINDOW_BITS, zdict=dictionary)
+
+    @classmethod
+    def from_welcome(cls, welcome):
+        """Codec for a negotiated connection, or None for the legacy JSON protocol"""
+        if welcome.get('version', LEGACY_VERSION) < PROTOCOL_VERSION:
+            return None
+        return cls(welcome.get('encoding', 'json'), welcome.get('compression'))
+
+    @property
+    def name(self):
+        return f"{self.encoding}+{self.compression}" if self.compression else self.encoding
+
+    def encode(self, message):
+        payload = _serialize(message, self.encoding)
+        if self.compression:
+            # A sync flush ends on 00 00 ff ff; the decoder adds it back
+            payload = (self._compressor.compress(payload) + self._compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        return bytes([self.flags]) + payload
+
+    def decode(self, data):
+        flags, payload = data[0], data[1:]
+        if flags != self.flags:
+            raise ValueError(f"Control frame flags {flags:#x} do not match the negotiated {self.flags:#x}")
+        if self.compression:
+            payload = self._decompressor.decompress(payload + b'\x00\x00\xff\xff')
+        return _deserialize(payload, self.encoding)
@@ -0,0 +1,153 @@
+import math
+import threading
+import time
+
+# Idle buckets are pruned once there are more than this many
+MAX_BUCKETS = 10_000
+
+
+class Overloaded(Exception):
+    """Raised when an operation cannot be admitted; retry_after is in seconds"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` operations per second with bursts of up to `burst`"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now, cost=1.0):
+        """Spend tokens if available; returns 0, or seconds until they would be"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost=1.0):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+    def idle(self, now):
+        """True once the bucket has refilled, so dropping it changes nothing"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """Token buckets per client, for every request and per limited route.
+
+    rules maps a route name to (rate, burst); default is the (rate, burst)
+    each client gets across all non-exempt routes together. A disabled
+    limiter allows everything.
+    """
+    def __init__(self, rules, default, enabled=True):
+        self.rules = dict(rules)
+        self.default = default
+        self.enabled = enabled
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, rule, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(rule[0], rule[1], now)
+        return bucket
+
+    def _prune(self, now):
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[key]
+
+    def check(self, client, route):
+        """Charge one request; returns 0 if allowed, else seconds to wait"""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            route_bucket = None
+            if route in self.rules:
+                route_bucket = self._bucket((client, route), self.rules[route], now)
+                wait = route_bucket.take(now)
+                if wait:
+                    return wait
+            wait = self._bucket((client, None), self.default, now).take(now)
+            if wait and route_bucket:
+                # Do not charge the route for a request that was refused anyway
+                route_bucket.refund()
+            return wait
+
+
+class AdmissionController:
+    """Concurrency caps with short bounded queues for expensive operations.
+
+    classes maps a name to (limit, max_queue, timeout): at most `limit` run at
+    once, up to `max_queue` more wait up to `timeout` seconds for a slot, and
+    anything beyond that is refused with an estimated Retry-After.
+    """
+    def __init__(self, classes):
+        self.classes = {name: list(config) for name, config in classes.items()}
+        self._running = {name: 0 for name in classes}
+        self._waiting = {name: 0 for name in classes}
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_time = {name: 1.0 for name in classes}
+        self._started = {}
+        self._condition = threading.Condition()
+
+    def set_limit(self, name, limit):
+        with self._condition:
+            self.classes[name][0] = limit
+            self._condition.notify_all()
+
+    def retry_after(self, name):
+        limit = max(1, self.classes[name][0])
+        backlog = self._running[name] + self._waiting[name] + 1
+        return max(1, math.ceil(self._hold_time[name] * backlog / limit))
+
+    def acquire(self, name):
+        """Take a slot, queueing briefly if allowed; raises Overloaded"""
+        limit, max_queue, timeout = self.classes[name]
+        with self._condition:
+            if self._running[name] >= limit:
+                if self._waiting[name] >= max_queue or timeout <= 0:
+                    raise Overloaded(f"Too many concurrent {name} requests", self.retry_after(name))
+                self._waiting[name] += 1
+                try:
+                    deadline = time.monotonic() + timeout
+                    while self._running[name] >= self.classes[name][0]:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise Overloaded(f"Timed out waiting for a {name} slot", self.retry_after(name))
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting[name] -= 1
+            self._running[name] += 1
+            token = object()
+            self._started[token] = (name, time.monotonic())
+            return token
+
+    def release(self, token):
+        with self._condition:
+            name, started = self._started.pop(token)
+            self._running[name] -= 1
+            self._hold_time[name] = 0.8 * self._hold_time[name] + 0.2 * (time.monotonic() - started)
+            self._condition.notify_all()
+
+    def status(self):
+        with self._condition:
+            return {
+                name: {
+                    'limit': config[0],
+                    'running': self._running[name],
+                    'waiting': self._waiting[name],
+                    'average_seconds': round(self._hold_time[name], 3)
+                }
+                for name, config in self.classes.items()
+            }
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from bisect import bisect_left
+from contextlib import nullcontext
+from pathlib import Path
+
+from metrics import SYNC_BYTES_TOTAL, SYNC_ITEMS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Ranges holding at most this many captures are listed outright instead of split
+LEAF_SIZE = 32
+# Ranges per /sync/ranges request and entries per /sync/entries request
+MAX_RANGES_PER_REQUEST = 256
+FETCH_BATCH = 64
+HTTP_TIMEOUT = 30
+# Seconds between /sync/status polls from the command line tool
+POLL_SECONDS = 2
+
+# Keys are "<month directory>/<file name>" below the images root
+SYNC_KEY = re.compile(r'^\d{4}_\d{2}/[A-Za-z0-9_.-]+\.jpg$')
+HEX_DIGITS = '0123456789abcdef'
+EMPTY_HASH = '0' * 64
+
+
+class SyncError(Exception):
+    """A peer could not be reached or sent something unusable"""
+
+
+class SyncBusy(Exception):
+    """A pull is already running on this node"""
+
+
+def item_id(key):
+    """Where a capture sits in its month's range tree; depends on the key only"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def item_digest(key, sha256):
+    return int.from_bytes(hashlib.sha256(f"{key}\0{sha256}".encode('utf-8')).digest(), 'big')
+
+
+class Manifest:
+    """Range-hash summary of a catalog, partitioned by month directory.
+
+    Within a month, captures are ordered by item_id and a range is every
+    capture whose id starts with a hex prefix: '' is the whole month and
+    each range splits into 16 children. A range's hash is the XOR of its
+    captures' digests (over key and content hash), so it does not depend
+    on how either node built its tree, and prefix XORs make any range's
+    [count, hash] an O(log n) lookup.
+    """
+    def __init__(self, items):
+        by_month = {}
+        for key, sha256 in items.items():
+            by_month.setdefault(key.split('/', 1)[0], []).append((item_id(key), key, sha256))
+        self._months = {}
+        for month, rows in by_month.items():
+            rows.sort()
+            xors = [0]
+            for _, key, sha256 in rows:
+                xors.append(xors[-1] ^ item_digest(key, sha256))
+            self._months[month] = ([row[0] for row in rows], rows, xors)
+
+    def __len__(self):
+        return sum(len(rows) for _, rows, _ in self._months.values())
+
+    def _bounds(self, month, prefix):
+        ids, rows, xors = self._months.get(month, ([], [], [0]))
+        # '~' sorts after every hex digit, so this ends the prefix's run
+        return ids, rows, xors, bisect_left(ids, prefix), bisect_left(ids, prefix + '~')
+
+    def range(self, month, prefix=''):
+        """[count, hash] of a range"""
+        _, _, xors, lo, hi = self._bounds(month, prefix)
+        return [hi - lo, format(xors[hi] ^ xors[lo], '064x') if hi > lo else EMPTY_HASH]
+
+    def months(self):
+        return {month: self.range(month) for month in sorted(self._months)}
+
+    def items(self, month, prefix=''):
+        """{key: sha256} of every capture in a range"""
+        _, rows, _, lo, hi = self._bounds(month, prefix)
+        return {key: sha256 for _, key, sha256 in rows[lo:hi]}
+
+    def children(self, month, prefix):
+        """Non-empty child ranges as {digit: [count, hash]}"""
+        children = {}
+        for digit in HEX_DIGITS:
+            summary = self.range(month, prefix + digit)
+            if summary[0]:
+                children[digit] = summary
+        return children
+
+    def answer(self, month, prefix, leaf_size=LEAF_SIZE):
+        """What a peer asking about a range gets: its captures if few, else its children"""
+        count, digest = self.range(month, prefix)
+        if count <= leaf_size or len(prefix) >= 64:
+            return {'count': count, 'hash': digest, 'items': self.items(month, prefix)}
+        return {'count': count, 'hash': digest, 'children': self.children(month, prefix)}
+
+
+def reconcile(manifest, peer):
+    """Find what differs between a local manifest and a peer's
+
+    Only ranges whose [count, hash] differ are expanded, one tree level per
+    round trip, so the exchange grows with the number of differences and
+    the log of the catalog size rather than with the catalog. Returns
+    {'missing': {key: sha256}, 'conflicts': [keys], 'peer_lacks': count,
+    'rounds': round trips}.
+    """
+    result = {'missing': {}, 'conflicts': [], 'peer_lacks': 0, 'rounds': 1}
+    remote = peer.manifest()
+    local = manifest.months()
+    for month in set(local) - set(remote):
+        result['peer_lacks'] += local[month][0]
+    pending = [(month, '') for month, summary in remote.items() if local.get(month) != summary]
+
+    while pending:
+        answers = []
+        for start in range(0, len(pending), MAX_RANGES_PER_REQUEST):
+            answers += peer.ranges(pending[start:start + MAX_RANGES_PER_REQUEST])
+        result['rounds'] += 1
+        expand = []
+        for (month, prefix), answer in zip(pending, answers):
+            if 'items' in answer:
+                mine = manifest.items(month, prefix)
+                for key, sha256 in answer['items'].items():
+                    if key not in mine:
+                        result['missing'][key] = sha256
+                    elif mine[key] != sha256:
+                        result['conflicts'].append(key)
+                result['peer_lacks'] += len(set(mine) - set(answer['items']))
+                continue
+            mine = manifest.children(month, prefix)
+            for digit, summary in answer['children'].items():
+                if mine.pop(digit, None) != summary:
+                    expand.append((month, prefix + digit))
+            # Children only this node has
+            result['peer_lacks'] += sum(summary[0] for summary in mine.values())
+        pending = expand
+    return result
+
+
+class Peer:
+    """JSON-over-HTTP client for another node's /sync endpoints"""
+    def __init__(self, base_url, timeout=HTTP_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def _open(self, path, payload=None, kind='summary'):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            raise SyncError(f"{self.base_url}{path}: {e}") from e
+        self.bytes_sent += len(data or b'')
+        self.bytes_received += len(body)
+        SYNC_BYTES_TOTAL.inc(len(body), kind=kind)
+        return body
+
+    def _call(self, path, payload=None):
+        try:
+            reply = json.loads(self._open(path, payload))
+        except ValueError as e:
+            raise SyncError(f"{self.base_url}{path}: invalid JSON ({e})") from e
+        if reply.get('status') != 'ok':
+            raise SyncError(f"{self.base_url}{path}: {reply.get('message', 'request failed')}")
+        return reply['data']
+
+    def manifest(self):
+        return {month: list(summary) for month, summary in self._call('/sync/manifest')['months'].items()}
+
+    def ranges(self, ranges):
+        return self._call('/sync/ranges', {'ranges': [list(r) for r in ranges]})
+
+    def entries(self, keys):
+        return self._call('/sync/entries', {'keys': list(keys)})
+
+    def media(self, sha256):
+        return self._open(f"/media/{sha256}.jpg", kind='media')
+
+    def pull(self, peer_url):
+        """Ask this node to pull from peer_url"""
+        return self._call('/sync/pull', {'peer': peer_url})
+
+    def status(self):
+        return self._call('/sync/status')
+
+
+class Replicator:
+    """Serves this node's manifest to peers and pulls the captures it lacks.
+
+    load_catalog returns the catalog ({path: entry} with sha256 digests);
+    on_stored receives {path: entry} for files written under images_root.
+    signature changes whenever the catalog does, so the manifest is only
+    rebuilt after captures are added or removed.
+    """
+    def __init__(self, images_root, load_catalog, on_stored, signature, gate=None, on_finished=None):
+        self.images_root = Path(images_root)
+        self.load_catalog = load_catalog
+        self.on_stored = on_stored
+        self.signature = signature
+        self.gate = gate or (lambda: nullcontext())
+        self.on_finished = on_finished
+        self._lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+        self._manifest = None
+        self._manifest_signature = None
+        self._entries = {}
+        self._running = None
+        self.last_result = None
+
+    def _key(self, path):
+        try:
+            key = Path(path).relative_to(self.images_root).as_posix()
+        except ValueError:
+            return None
+        return key if SYNC_KEY.match(key) else None
+
+    def manifest(self):
+        """The current Manifest and the catalog entries by key"""
+        with self._manifest_lock:
+            if self._manifest is None or self.signature() != self._manifest_signature:
+                catalog = self.load_catalog()
+                entries = {}
+                for path, entry in catalog.items():
+                    key = self._key(path)
+                    if key and entry.get('sha256'):
+                        entries[key] = entry
+                self._manifest = Manifest({key: entry['sha256'] for key, entry in entries.items()})
+                self._entries = entries
+                # Loading may itself update the catalog (digests of old entries)
+                self._manifest_signature = self.signature()
+            return self._manifest, self._entries
+
+    def answer_ranges(self, ranges):
+        """Answers to a peer's /sync/ranges request"""
+        manifest, _ = self.manifest()
+        if len(ranges) > MAX_RANGES_PER_REQUEST:
+            raise ValueError(f"At most {MAX_RANGES_PER_REQUEST} ranges per request")
+        answers = []
+        for month, prefix in ranges:
+            if not all(c in HEX_DIGITS for c in prefix):
+                raise ValueError(f"Invalid range prefix: {prefix}")
+            answers.append(manifest.answer(month, prefix))
+        return answers
+
+    def entries(self, keys):
+        """Catalog entries for a peer's /sync/entries request"""
+        if len(keys) > FETCH_BATCH:
+            raise ValueError(f"At most {FETCH_BATCH} entries per request")
+        _, entries = self.manifest()
+        return {key: entries[key] for key in keys if key in entries}
+
+    def _store(self, key, entry, data):
+        """Write one fetched capture; returns its catalog path or None if skipped"""
+        if hashlib.sha256(data).hexdigest() != entry['sha256']:
+            logger.warning(f"Sync: {key} does not match its digest, skipped")
+            return None
+        target = self.images_root / key
+        if target.exists():
+            return None
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+        return str(target)
+
+    def pull(self, peer):
+        """Reconcile with peer and copy over the captures this node lacks"""
+        started = time.time()
+        manifest, _ = self.manifest()
+        diff = reconcile(manifest, peer)
+        missing = [key for key in sorted(diff['missing']) if SYNC_KEY.match(key)]
+        stored = 0
+        for start in range(0, len(missing), FETCH_BATCH):
+            batch = missing[start:start + FETCH_BATCH]
+            # Copying is background work; yield to captures when constrained
+            with self.gate():
+                written = {}
+                for key, entry in peer.entries(batch).items():
+                    if key not in diff['missing'] or entry.get('sha256') != diff['missing'][key]:
+                        continue
+                    path = self._store(key, entry, peer.media(entry['sha256']))
+                    if path:
+                        written[path] = entry
+                if written:
+                    self.on_stored(written)
+                    stored += len(written)
+                    SYNC_ITEMS_TOTAL.inc(len(written))
+        result = {
+            'peer': peer.base_url,
+            'local_items': len(manifest),
+            'missing': len(diff['missing']),
+            'stored': stored,
+            'conflicts': diff['conflicts'],
+            'peer_lacks': diff['peer_lacks'],
+            'rounds': diff['rounds'],
+            'bytes_received': peer.bytes_received,
+            'bytes_sent': peer.bytes_sent,
+            'seconds': round(time.time() - started, 3)
+        }
+        logger.info(f"Sync from {peer.base_url}: {stored} of {len(diff['missing'])} missing captures copied "
+                    f"in {diff['rounds']} rounds, {peer.bytes_received} bytes received")
+        return result
+
+    def start(self, peer_url):
+        """Pull from peer_url in the background; raises SyncBusy if a pull is running"""
+        with self._lock:
+            if self._running:
+                raise SyncBusy(f"Already pulling from {self._running}")
+            self._running = peer_url
+
+        def run():
+            try:
+                result = self.pull(Peer(peer_url))
+            except Exception as e:
+                logger.error(f"Sync from {peer_url} failed: {e}")
+                result = {'peer': peer_url, 'error': str(e)}
+            result['finished'] = time.time()
+            with self._lock:
+                self.last_result = result
+                self._running = None
+            if self.on_finished:
+                self.on_finished(result)
+
+        threading.Thread(target=run, name='sync-pull', daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            return {'running': self._running, 'last': self.last_result}
+
+
+def replicate(node_urls):
+    """Have every node pull from every other node, then wait for all of them"""
+    nodes = [Peer(url) for url in node_urls]
+    results = {}
+    for node in nodes:
+        for other in nodes:
+            if other is node:
+                continue
+            # One pull per node at a time: wait for the previous one to finish
+            while node.status()['running']:
+                time.sleep(POLL_SECONDS)
+            node.pull(other.base_url)
+            while True:
+                status = node.status()
+                if not status['running']:
+                    break
+                time.sleep(POLL_SECONDS)
+            results[f"{other.base_url} -> {node.base_url}"] = status['last']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replicate captures between RanchPi nodes: each node pulls what it lacks from the others")
+    parser.add_argument('nodes', nargs='+', help="Base URLs of the nodes, e.g. http://ranch-house:5000")
+    args = parser.parse_args()
+    if len(args.nodes) < 2:
+        parser.error("Give at least two nodes")
+    print(json.dumps(replicate(args.nodes), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
+
+import catalog
+
+logger = logging.getLogger(__name__)
+
+# Journaled changes after which the snapshot file is rewritten and the journal dropped
+CHECKPOINT_EVENTS = 100
+
+
+def _freeze(value):
+    """Read-only copy of a settings value: dicts become mapping proxies, lists tuples"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Plain dict/list copy of a frozen value, for JSON"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class Snapshot:
+    """One immutable version of every settings section.
+
+    Snapshots are never modified after publication, so any thread can hold
+    and read one without locking. Values derived from a snapshot (such as
+    a serialized response) can be memoized on it with derived().
+    """
+    __slots__ = ('version', 'etag', 'sections', '_derived')
+
+    def __init__(self, version, sections, epoch):
+        self.version = version
+        # The epoch keeps tags unique across restarts, when unsaved
+        # (transient) changes may reuse a version number
+        self.etag = f"{epoch}-{version}"
+        self.sections = MappingProxyType({name: _freeze(values) for name, values in sections.items()})
+        self._derived = {}
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def section(self, name):
+        """Plain dict copy of one section"""
+        return thaw(self.sections[name])
+
+    def derived(self, name, build):
+        """Compute build(snapshot) once per snapshot and reuse it afterwards"""
+        try:
+            return self._derived[name]
+        except KeyError:
+            # Two threads may both build it; either result is correct
+            return self._derived.setdefault(name, build(self))
+
+
+class SettingsStore:
+    """Versioned settings persisted as a change journal with lock-free reads.
+
+    Every update is an event: it is appended to the journal and fsynced
+    before a new Snapshot replaces the current one, so a crash never loses
+    an acknowledged change and readers only ever take the latest reference.
+    Subscribers run after each change, in version order, with the new
+    snapshot, the section and the changed keys. Keys listed in transient
+    (runtime state such as whether night exposure is active) are versioned
+    and published like the rest but never written to disk.
+    """
+    def __init__(self, path, defaults, transient=None, checkpoint_events=CHECKPOINT_EVENTS):
+        self.path = Path(path)
+        self.journal = catalog.journal_path(self.path)
+        self.transient = {section: frozenset(keys) for section, keys in (transient or {}).items()}
+        self.checkpoint_events = checkpoint_events
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._defaults = {section: dict(values) for section, values in defaults.items()}
+        self._subscribers = []
+        # Serializes writers and their notifications; readers never take it
+        self._write_lock = threading.RLock()
+        version, sections = self._load()
+        self._snapshot = Snapshot(version, sections, self.epoch)
+
+    def _merge(self, sections, saved):
+        """Apply saved values for sections and keys this version still knows"""
+        for section, values in (saved or {}).items():
+            known = sections.get(section)
+            if known is None:
+                continue
+            for key, value in values.items():
+                if key in known and key not in self.transient.get(section, ()):
+                    known[key] = value
+
+    def _load(self):
+        """Defaults, then the snapshot file, then the journal replayed over it"""
+        sections = {section: dict(values) for section, values in self._defaults.items()}
+        saved = catalog.read_snapshot(self.path)
+        version = saved.get('version', 0)
+        self._merge(sections, saved.get('settings'))
+        self._journaled = 0
+        if self.journal.exists():
+            with open(self.journal, 'r') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-append
+                        continue
+                    if event.get('version', 0) <= version:
+                        continue
+                    self._merge(sections, {event['section']: event['changes']})
+                    version = event['version']
+                    self._journaled += 1
+        if version:
+            logger.info(f"Loaded settings version {version} from {self.path}")
+        return version, sections
+
+    def snapshot(self):
+        """The current settings; never blocks"""
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """Call callback(snapshot, section, changed_keys) after every change"""
+        with self._write_lock:
+            self._subscribers.append(callback)
+
+    def _persistent(self, snapshot):
+        return {
+            section: {key: value for key, value in values.items() if key not in self.transient.get(section, ())}
+            for section, values in ((name, snapshot.section(name)) for name in snapshot.sections)
+        }
+
+    def _append(self, event):
+        with open(self.journal, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journaled += 1
+
+    def checkpoint(self):
+        """Fold the journal into the snapshot file"""
+        with self._write_lock:
+            snapshot = self._snapshot
+            catalog.write_snapshot(self.path, {'version': snapshot.version, 'settings': self._persistent(snapshot)})
+            self._journaled = 0
+
+    def update(self, section, changes, source=None):
+        """Apply changes to one section; returns the resulting snapshot
+
+        Keys must already exist in the section. An update that changes
+        nothing keeps the current version and notifies nobody.
+        """
+        with self._write_lock:
+            current = self._snapshot
+            if section not in current.sections:
+                raise KeyError(f"Unknown settings section: {section}")
+            values = current[section]
+            unknown = [key for key in changes if key not in values]
+            if unknown:
+                raise KeyError(f"Unknown {section} settings: {', '.join(sorted(unknown))}")
+            changed = {key: value for key, value in changes.items() if _freeze(value) != values[key]}
+            if not changed:
+                return current
+
+            version = current.version + 1
+            durable = {key: thaw(value) for key, value in changed.items()
+                       if key not in self.transient.get(section, ())}
+            if durable:
+                self._append({'version': version, 'time': time.time(), 'source': source,
+                              'section': section, 'changes': durable})
+            sections = {name: current.section(name) for name in current.sections}
+            sections[section].update(changed)
+            snapshot = Snapshot(version, sections, self.epoch)
+            self._snapshot = snapshot
+            if self._journaled >= self.checkpoint_events:
+                self.checkpoint()
+
+            for callback in self._subscribers:
+                try:
+                    callback(snapshot, section, frozenset(changed))
+                except Exception as e:
+                    logger.error(f"Settings subscriber failed for version {version}: {e}")
+            return snapshot
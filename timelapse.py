@@ -0,0 +1,366 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+import catalog
+
+logger = logging.getLogger(__name__)
+
+# Output formats that can be written frame by frame with flat memory use.
+# Pillow's animated WebP writer needs every frame up front, so it is not offered.
+FORMATS = {
+    'avi': 'video/x-msvideo',
+    'gif': 'image/gif'
+}
+
+DEFAULTS = {
+    'stride': 1,
+    'format': 'avi',
+    'width': 640,
+    'height': 480,
+    'fps': 10,
+    'quality': 80,
+    'type': None
+}
+
+MAX_DIMENSION = 1920
+MAX_FPS = 60
+
+
+def _render_frame(path, size, fmt, quality):
+    """Decode, resize and re-encode one stored capture (runs in a worker process)"""
+    with Image.open(path) as img:
+        # Let libjpeg downscale during decode instead of decoding full size
+        img.draft('RGB', size)
+        frame = ImageOps.pad(img.convert('RGB'), size, color='black')
+    buffer = io.BytesIO()
+    if fmt == 'avi':
+        frame.save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+    frame.quantize(256).save(buffer, format='GIF')
+    return _gif_image_block(buffer.getvalue())
+
+
+def _gif_image_block(data):
+    """Turn a single-frame GIF into an image descriptor with a local color table"""
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError("Not a GIF stream")
+    packed = data[10]
+    pos = 13
+    color_table = b''
+    table_bits = 0
+    if packed & 0x80:
+        table_bits = packed & 0x07
+        table_size = 3 * (2 << table_bits)
+        color_table = data[pos:pos + table_size]
+        pos += table_size
+
+    # Skip any extension blocks Pillow wrote ahead of the image
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    if data[pos] != 0x2C:
+        raise ValueError("GIF image descriptor not found")
+
+    descriptor = bytearray(data[pos:pos + 10])
+    pos += 10
+    if not descriptor[9] & 0x80:
+        # Promote the global table to a local one so frames can use their own palettes
+        descriptor[9] = (descriptor[9] & 0x40) | 0x80 | table_bits
+        body = color_table
+    else:
+        local_size = 3 * (2 << (descriptor[9] & 0x07))
+        body = data[pos:pos + local_size]
+        pos += local_size
+
+    # LZW minimum code size, then data sub-blocks up to the terminator
+    start = pos
+    pos += 1
+    while data[pos]:
+        pos += data[pos] + 1
+    pos += 1
+    return bytes(descriptor) + body + data[start:pos]
+
+
+class MJPEGAviWriter:
+    """Stream JPEG frames into an MJPEG AVI, keeping only the frame index"""
+    def __init__(self, fp, width, height, fps):
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = 0
+        self.max_frame = 0
+        # 16 bytes per frame; spill the index to disk so huge runs stay flat
+        self.index = tempfile.TemporaryFile()
+        self._write_headers()
+
+    def _write_headers(self):
+        fp = self.fp
+        fp.write(b'RIFF' + b'\0\0\0\0' + b'AVI ')
+        fp.write(b'LIST' + struct.pack('<I', 4 + 64 + 124) + b'hdrl')
+
+        self._avih_pos = fp.tell()
+        fp.write(self._avih())
+
+        fp.write(b'LIST' + struct.pack('<I', 4 + 64 + 48) + b'strl')
+        self._strh_pos = fp.tell()
+        fp.write(self._strh())
+        fp.write(b'strf' + struct.pack('<I', 40) + struct.pack(
+            '<IiiHH4sIiiII', 40, self.width, self.height, 1, 24, b'MJPG',
+            self.width * self.height * 3, 0, 0, 0, 0))
+
+        self._movi_pos = fp.tell()
+        fp.write(b'LIST' + b'\0\0\0\0' + b'movi')
+
+    def _avih(self):
+        return b'avih' + struct.pack(
+            '<I14I', 56, int(1_000_000 / self.fps), self.max_frame * self.fps, 0, 0x10,
+            self.frames, 0, 1, self.max_frame, self.width, self.height, 0, 0, 0, 0)
+
+    def _strh(self):
+        return b'strh' + struct.pack(
+            '<I4s4sIHHIIIIIIIIhhhh', 56, b'vids', b'MJPG', 0, 0, 0, 0, 1, self.fps, 0,
+            self.frames, self.max_frame, 0xFFFFFFFF, 0, 0, 0, self.width, self.height)
+
+    def add_frame(self, jpeg):
+        offset = self.fp.tell() - (self._movi_pos + 8)
+        self.fp.write(b'00dc' + struct.pack('<I', len(jpeg)))
+        self.fp.write(jpeg)
+        if len(jpeg) % 2:
+            self.fp.write(b'\0')
+        self.index.write(b'00dc' + struct.pack('<III', 0x10, offset, len(jpeg)))
+        self.frames += 1
+        self.max_frame = max(self.max_frame, len(jpeg))
+
+    def close(self):
+        fp = self.fp
+        movi_end = fp.tell()
+        fp.write(b'idx1' + struct.pack('<I', self.frames * 16))
+        self.index.seek(0)
+        while chunk := self.index.read(64 * 1024):
+            fp.write(chunk)
+        self.index.close()
+        end = fp.tell()
+
+        # Patch sizes and counts now that they are known
+        fp.seek(4)
+        fp.write(struct.pack('<I', end - 8))
+        fp.seek(self._avih_pos)
+        fp.write(self._avih())
+        fp.seek(self._strh_pos)
+        fp.write(self._strh())
+        fp.seek(self._movi_pos + 4)
+        fp.write(struct.pack('<I', movi_end - self._movi_pos - 8))
+        fp.seek(end)
+
+
+class AnimatedGifWriter:
+    """Stream pre-encoded GIF image blocks into a looping animation"""
+    def __init__(self, fp, width, height, fps):
+        self.fp = fp
+        self.delay = max(2, round(100 / fps))
+        fp.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+        # NETSCAPE2.0 extension: loop forever
+        fp.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def add_frame(self, image_block):
+        # Graphic control extension: do-not-dispose, per-frame delay
+        self.fp.write(b'\x21\xF9\x04\x04' + struct.pack('<H', self.delay) + b'\x00\x00')
+        self.fp.write(image_block)
+
+    def close(self):
+        self.fp.write(b'\x3B')
+
+
+WRITERS = {
+    'avi': MJPEGAviWriter,
+    'gif': AnimatedGifWriter
+}
+
+
+def normalize_params(params):
+    """Validate a time-lapse request and fill in defaults"""
+    params = dict(params or {})
+    normalized = {key: params.get(key, default) for key, default in DEFAULTS.items()}
+    normalized.update(catalog.normalize_range(params))
+
+    for key in ('stride', 'width', 'height', 'fps', 'quality'):
+        try:
+            normalized[key] = int(normalized[key])
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be an integer")
+    if normalized['stride'] < 1:
+        raise ValueError("stride must be at least 1")
+    if not (16 <= normalized['width'] <= MAX_DIMENSION and 16 <= normalized['height'] <= MAX_DIMENSION):
+        raise ValueError(f"width and height must be between 16 and {MAX_DIMENSION}")
+    if not 1 <= normalized['fps'] <= MAX_FPS:
+        raise ValueError(f"fps must be between 1 and {MAX_FPS}")
+    if not 1 <= normalized['quality'] <= 95:
+        raise ValueError("quality must be between 1 and 95")
+    if normalized['format'] not in FORMATS:
+        raise ValueError(f"format must be one of {sorted(FORMATS)}")
+    return normalized
+
+
+def select_frames(metadata, params):
+    """Pick catalog entries in the time range, oldest first, every stride-th one"""
+    return [path for path, _ in catalog.select_entries(metadata, params)[::params['stride']]]
+
+
+class QueueFull(Exception):
+    """Raised by TimelapseBuilder.submit when too many jobs are pending"""
+
+
+class TimelapseBuilder:
+    """Queue of time-lapse jobs rendered from the image catalog"""
+    def __init__(self, output_dir, load_metadata, workers=None, gate=None, max_pending=None):
+        self.output_dir = Path(output_dir)
+        self.load_metadata = load_metadata
+        self.workers = workers or os.cpu_count() or 1
+        # Optional context manager factory yielding how many workers a job may use
+        self.gate = gate
+        self.max_pending = max_pending
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def job_id(self, params, frames):
+        """Cache key covering the query and the exact frames it selected"""
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+        for path in frames:
+            digest.update(path.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()[:32]
+
+    def output_path(self, job_id, fmt):
+        return self.output_dir / f"{job_id}.{fmt}"
+
+    def submit(self, params):
+        """Queue a job, or return the cached result for an identical query"""
+        params = normalize_params(params)
+        frames = select_frames(self.load_metadata(), params)
+        if not frames:
+            raise ValueError("No captures match the requested range")
+        job_id = self.job_id(params, frames)
+        output = self.output_path(job_id, params['format'])
+
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job and job['state'] in ('queued', 'running'):
+                return dict(job)
+            job = {
+                'id': job_id,
+                'params': params,
+                'state': 'queued',
+                'frames_total': len(frames),
+                'frames_done': 0,
+                'error': None,
+                'created': time.time(),
+                'finished': None
+            }
+            if output.exists():
+                job.update(state='done', frames_done=len(frames), finished=output.stat().st_mtime)
+                self.jobs[job_id] = job
+                return dict(job)
+            if self.max_pending is not None and self.pending() >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} time-lapse jobs are already pending")
+            self.jobs[job_id] = job
+
+        self._queue.put((job_id, frames))
+        self._ensure_worker()
+        logger.info(f"Queued time-lapse {job_id} with {len(frames)} frames")
+        return dict(job)
+
+    def pending(self):
+        """Number of jobs queued or running"""
+        return sum(1 for job in self.jobs.values() if job['state'] in ('queued', 'running'))
+
+    def get(self, job_id):
+        """Return a snapshot of a job, including cached results from earlier runs"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        for fmt in FORMATS:
+            output = self.output_path(job_id, fmt)
+            if output.exists():
+                return {'id': job_id, 'state': 'done', 'params': {'format': fmt}, 'error': None}
+        return None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_loop, daemon=True)
+                self._thread.start()
+
+    def _worker_loop(self):
+        while True:
+            job_id, frames = self._queue.get()
+            try:
+                if self.gate:
+                    with self.gate() as workers:
+                        self._build(job_id, frames, workers)
+                else:
+                    self._build(job_id, frames)
+            except Exception as e:
+                logger.error(f"Time-lapse {job_id} failed: {e}")
+                self._update(job_id, state='error', error=str(e), finished=time.time())
+            finally:
+                self._queue.task_done()
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            self.jobs[job_id].update(changes)
+
+    def _build(self, job_id, frames, workers=None):
+        workers = max(1, min(self.workers, workers or self.workers))
+        params = self.jobs[job_id]['params']
+        fmt = params['format']
+        size = (params['width'], params['height'])
+        output = self.output_path(job_id, fmt)
+        partial = output.with_suffix(output.suffix + '.part')
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._update(job_id, state='running')
+
+        # Only a small window of frames is ever in flight, whatever the total
+        window = workers * 2
+        pending = deque()
+        paths = iter(frames)
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(partial, 'wb') as fp:
+            writer = WRITERS[fmt](fp, size[0], size[1], params['fps'])
+            for path in paths:
+                pending.append(pool.submit(_render_frame, path, size, fmt, params['quality']))
+                if len(pending) >= window:
+                    break
+            while pending:
+                future = pending.popleft()
+                try:
+                    writer.add_frame(future.result())
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable frame in time-lapse {job_id}: {e}")
+                done += 1
+                self._update(job_id, frames_done=done)
+                for path in paths:
+                    pending.append(pool.submit(_render_frame, path, size, fmt, params['quality']))
+                    break
+            writer.close()
+        partial.replace(output)
+        self._update(job_id, state='done', finished=time.time())
+        logger.info(f"Time-lapse {job_id} written to {output}")
@@ -3,8 +3,15 @@ import websockets
 import logging
 import json
 import base64
+import time
+import zlib
 from datetime import datetime
 from pathlib import Path
+from metrics import (WS_SEND_LATENCY, QUEUE_DEPTH, FRAMES_TOTAL, FRAMES_DROPPED_TOTAL,
+                     BYTES_TOTAL, CONTROL_BYTES_TOTAL, forget_peer)
+from protocol import ControlCodec, is_frame, negotiate, unpack_frame
+from frame_codec import join_blobs
+from buffers import frame_budget
 
 # Configure logging
 logging.basicConfig(
@@ -17,52 +24,173 @@ logger = logging.getLogger(__name__)
 connected_devices = {}
 connected_viewers = set()
 
+# Last keyframe and the deltas since, per device streaming tiles, so a new
+# viewer can composite the current picture straight away; kept UTF-8 encoded
+tile_streams = {}
+# Deltas kept per device; past this a viewer waits for the next keyframe
+MAX_CACHED_DELTAS = 120
+# Message types carrying camera frames; everything else is control traffic
+FRAME_TYPES = ('camera_frame', 'camera_tiles')
+# Minimum seconds between keyframe requests sent to devices when viewers join
+KEYFRAME_REQUEST_INTERVAL = 2.0
+_last_keyframe_request = 0.0
+
+def _peer_name(websocket):
+    """Return a stable label for a connection's remote end"""
+    address = getattr(websocket, 'remote_address', None)
+    if isinstance(address, tuple) and len(address) >= 2:
+        return f"{address[0]}:{address[1]}"
+    return str(address or id(websocket))
+
 async def broadcast_frame(frame_data):
     """Broadcast camera frame to all connected viewers"""
     if connected_viewers:
-        websockets_to_remove = set()
-        for websocket in connected_viewers:
+        # Serialize once, not once per viewer
+        await _broadcast(json.dumps({
+            'type': 'camera_frame',
+            'data': frame_data
+        }))
+
+async def broadcast_tiles(device_id, frame):
+    """Cache a tile-codec frame for late joiners and relay it to viewers"""
+    message = json.dumps({
+        'type': 'camera_tiles',
+        'device_id': device_id,
+        'data': frame
+    }).encode('utf-8')
+    if frame.get('kind') == 'key':
+        tile_streams[device_id] = {'key': message, 'key_seq': frame.get('key'), 'deltas': []}
+    else:
+        stream = tile_streams.get(device_id)
+        if stream and stream['key_seq'] == frame.get('key') and len(stream['deltas']) < MAX_CACHED_DELTAS:
+            stream['deltas'].append(message)
+    if connected_viewers:
+        await _broadcast(message)
+
+async def request_keyframes():
+    """Ask every streaming device for a fresh keyframe, at most every few seconds"""
+    global _last_keyframe_request
+    now = time.monotonic()
+    if now - _last_keyframe_request < KEYFRAME_REQUEST_INTERVAL:
+        return
+    _last_keyframe_request = now
+    for device_id in list(tile_streams):
+        info = connected_devices.get(device_id)
+        if not info:
+            continue
+        try:
+            await send_control(info, {'type': 'keyframe_request'})
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+async def send_control(info, message):
+    """Send a control message to a device in the format it negotiated"""
+    codec = info.get('codec')
+    data = codec.encode(message) if codec else json.dumps(message)
+    await info['websocket'].send(data)
+    CONTROL_BYTES_TOTAL.inc(len(data), direction='sent', format=codec.name if codec else 'json')
+
+async def _broadcast(message):
+    """Send one serialized message to every viewer, dropping closed connections
+
+    The message is UTF-8 encoded once and the same bytes go to every
+    viewer, held against the frame memory budget until the last send; a
+    frame that does not fit is dropped rather than queued.
+    """
+    data = message.encode('utf-8') if isinstance(message, str) else message
+    if not frame_budget.try_reserve(len(data)):
+        FRAMES_DROPPED_TOTAL.inc(role='viewer', peer='budget')
+        return
+    websockets_to_remove = set()
+    try:
+        for websocket in list(connected_viewers):
+            peer = _peer_name(websocket)
             try:
-                await websocket.send(json.dumps({
-                    'type': 'camera_frame',
-                    'data': frame_data
-                }))
+                start = time.perf_counter()
+                await websocket.send(data, text=True)
+                WS_SEND_LATENCY.observe(time.perf_counter() - start)
+                FRAMES_TOTAL.inc(role='viewer', peer=peer)
+                BYTES_TOTAL.inc(len(data), role='viewer', peer=peer)
             except websockets.exceptions.ConnectionClosed:
+                FRAMES_DROPPED_TOTAL.inc(role='viewer', peer=peer)
                 websockets_to_remove.add(websocket)
+    finally:
+        frame_budget.release(len(data))
 
-        # Clean up closed connections
-        connected_viewers.difference_update(websockets_to_remove)
+    # Clean up closed connections
+    connected_viewers.difference_update(websockets_to_remove)
+    QUEUE_DEPTH.set(len(connected_viewers), queue='viewers')
 
-async def handle_device_connection(websocket, path):
+async def handle_device_connection(websocket, path=None):
     """Handle incoming device connections"""
     device_id = None
+    # Stays None for version 1 devices, which never say hello
+    codec = None
     try:
         async for message in websocket:
             try:
-                data = json.loads(message)
+                if isinstance(message, bytes):
+                    if codec is None:
+                        raise ValueError("binary frame before protocol negotiation")
+                    if is_frame(message):
+                        data, blobs = unpack_frame(message)
+                        # Viewers keep getting JSON; encode once here for all of them,
+                        # straight from the blob views without copying them out
+                        if data.get('type') == 'camera_frame':
+                            data['frame_data'] = base64.b64encode(blobs[0]).decode('utf-8')
+                        elif data.get('type') == 'camera_tiles':
+                            data['frame'] = join_blobs(data['frame'], blobs,
+                                                       lambda blob: base64.b64encode(blob).decode('ascii'))
+                    else:
+                        data = codec.decode(message)
+                        CONTROL_BYTES_TOTAL.inc(len(message), direction='received', format=codec.name)
+                else:
+                    data = json.loads(message)
+                    if data.get('type') not in FRAME_TYPES:
+                        CONTROL_BYTES_TOTAL.inc(len(message), direction='received', format='json')
                 message_type = data.get('type')
 
-                if message_type == 'device_info':
+                if message_type == 'hello':
+                    welcome = negotiate(data)
+                    # The welcome itself is plain JSON so any client can read it
+                    await websocket.send(json.dumps(welcome))
+                    codec = ControlCodec.from_welcome(welcome)
+                    logger.info(f"Device {data.get('device_id')} speaks protocol v{welcome['version']} "
+                                f"({codec.name if codec else 'json'})")
+
+                elif message_type == 'device_info':
                     device_id = data.get('device_id')
                     connected_devices[device_id] = {
                         'websocket': websocket,
+                        'codec': codec,
                         'connection_type': data.get('connection_type'),
                         'last_seen': datetime.now(),
                         'status': 'connected'
                     }
+                    QUEUE_DEPTH.set(len(connected_devices), queue='devices')
                     logger.info(f"Device {device_id} connected via {data.get('connection_type')}")
 
                 elif message_type == 'camera_frame':
+                    peer = device_id or _peer_name(websocket)
+                    FRAMES_TOTAL.inc(role='device', peer=peer)
+                    BYTES_TOTAL.inc(len(message), role='device', peer=peer)
                     # Broadcast frame to all viewers
                     await broadcast_frame(data.get('frame_data'))
 
+                elif message_type == 'camera_tiles':
+                    peer = device_id or _peer_name(websocket)
+                    FRAMES_TOTAL.inc(role='device', peer=peer)
+                    BYTES_TOTAL.inc(len(message), role='device', peer=peer)
+                    await broadcast_tiles(peer, data.get('frame') or {})
+
                 elif message_type == 'heartbeat':
                     if device_id in connected_devices:
                         connected_devices[device_id]['last_seen'] = datetime.now()
                         connected_devices[device_id]['connection_type'] = data.get('connection_type')
 
-            except json.JSONDecodeError:
-                logger.error("Invalid JSON message received")
+            except (ValueError, zlib.error) as e:
+                logger.error(f"Invalid message received: {e}")
+                FRAMES_DROPPED_TOTAL.inc(role='device', peer=device_id or _peer_name(websocket))
                 continue
 
     except websockets.exceptions.ConnectionClosed:
@@ -70,13 +198,24 @@ async def handle_device_connection(websocket, path):
     finally:
         if device_id and device_id in connected_devices:
             del connected_devices[device_id]
+        tile_streams.pop(device_id or _peer_name(websocket), None)
+        QUEUE_DEPTH.set(len(connected_devices), queue='devices')
+        forget_peer('device', device_id or _peer_name(websocket))
 
-async def handle_viewer_connection(websocket, path):
+async def handle_viewer_connection(websocket, path=None):
     """Handle incoming viewer connections"""
     try:
         connected_viewers.add(websocket)
+        QUEUE_DEPTH.set(len(connected_viewers), queue='viewers')
         logger.info("New viewer connected")
 
+        # Bring the viewer up to date with each tile stream, then have the
+        # devices start a fresh keyframe so the picture is clean
+        for stream in list(tile_streams.values()):
+            for message in [stream['key']] + stream['deltas']:
+                await websocket.send(message, text=True)
+        await request_keyframes()
+
         # Keep connection alive until closed
         await websocket.wait_closed()
 
@@ -84,6 +223,8 @@ async def handle_viewer_connection(websocket, path):
         logger.info("Viewer disconnected")
     finally:
         connected_viewers.discard(websocket)
+        QUEUE_DEPTH.set(len(connected_viewers), queue='viewers')
+        forget_peer('viewer', _peer_name(websocket))
 
 async def check_devices():
     """Periodically check device status and clean up stale connections"""
@@ -94,6 +235,7 @@ async def check_devices():
             if time_diff > 30:  # Device considered stale after 30 seconds
                 logger.warning(f"Device {device_id} connection stale, removing")
                 del connected_devices[device_id]
+        QUEUE_DEPTH.set(len(connected_devices), queue='devices')
         await asyncio.sleep(10)
 
 def get_connected_devices():
@@ -102,13 +244,16 @@ def get_connected_devices():
         device_id: {
             'connection_type': info['connection_type'],
             'last_seen': info['last_seen'].isoformat(),
-            'status': info['status']
+            'status': info['status'],
+            'protocol': info['codec'].name if info.get('codec') else 'json'
         }
         for device_id, info in connected_devices.items()
     }
 
 async def start_server(host='0.0.0.0', port=6789):
     """Start WebSocket server"""
+    # permessage-deflate stays available for version 1 devices; version 2
+    # devices compress control messages themselves and do not offer it
     device_server = await websockets.serve(handle_device_connection, host, port)
     viewer_server = await websockets.serve(handle_viewer_connection, host, port + 1)
 